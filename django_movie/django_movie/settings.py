@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,19 +47,26 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # собранная статика отдается с заголовками безопасности (HSTS,
+    # nosniff), но до остальных обработчиков и без замеров времени
+    'movies.staticfiles.PrecompressedStaticMiddleware',
+    # первым из остальных, чтобы время включало все обработчики страниц
+    'movies.instrumentation.RequestStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'movies.routers.PinPrimaryMiddleware',
 ]
 
 ROOT_URLCONF = 'django_movie.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # стандартный движок с замером времени рендеринга (movies.instrumentation)
+        'BACKEND': 'movies.instrumentation.DjangoTemplates',
         'DIRS': [
             BASE_DIR.joinpath('./templates')
         ],
@@ -76,6 +84,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'django_movie.wsgi.application'
 
+# асинхронные представления страниц фильмов, включается в asgi.py
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -83,10 +94,77 @@ WSGI_APPLICATION = 'django_movie.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # другой файл базы, например набор данных для тестов производительности
+        'NAME': os.environ.get('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# реплики только для чтения публичных страниц (movies.routers), например
+# DJANGO_DB_REPLICAS=replica.sqlite3; файлы обновляет команда sync_replicas
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['movies.routers.ReplicaRouter']
+# сколько секунд реплики могут отставать: столько после записи клиент
+# читает из основной базы
+REPLICA_LAG_SECONDS = 5
+
+# профиль SQLite для сервера (DJANGO_DB_PROFILE=production): WAL, чтобы
+# чтение не ждало записи, ожидание блокировки вместо "database is locked"
+# и постоянные соединения с проверкой перед запросом. PRAGMA выполняются
+# для каждого нового соединения (movies.sqlite)
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'default')
+SQLITE_PRAGMAS = {}
+if DB_PROFILE == 'production':
+    for database in DATABASES.values():
+        database.update({
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'timeout': 20},
+        })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        # в WAL фиксация не ждет fsync, при сбое питания теряются последние транзакции
+        'synchronous': 'normal',
+        'busy_timeout': 20000,
+        'mmap_size': 256 * 1024 * 1024,
+        # отрицательное значение — размер в КиБ
+        'cache_size': -64 * 1024,
+        'temp_store': 'memory',
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# версии содержимого и фрагменты хранятся в кэше; при нескольких
+# процессах нужен общий кэш, например django.core.cache.backends.redis.RedisCache
+
+CACHES = {
+    'default': {
+        # LocMemCache со счетчиком попаданий; для Redis — movies.instrumentation.RedisCache.
+        # С LocMemCache гистограммы времени ответа у каждого процесса свои,
+        # команда request_stats работает только с общим кэшем
+        'BACKEND': 'movies.instrumentation.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
+# сколько секунд браузер и CDN могут не перепроверять страницы фильмов
+PAGE_CACHE_MAX_AGE = 0
+# ответы JSON API без персональных данных, их можно хранить в прокси
+API_CACHE_MAX_AGE = 60
+
+# запросы дольше этого (мс) пишутся в журнал с самыми медленными SQL
+SLOW_REQUEST_MS = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -125,16 +203,36 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_DIR = BASE_DIR.joinpath('./static')
 STATICFILES_DIRS = [STATIC_DIR]
-# STATIC_ROOT = BASE_DIR.joinpath('./static')
+# сборка командой collectstatic: имена с хешем, сжатые копии .gz
+# (и .br при установленном пакете brotli), раздача — movies.staticfiles
+STATIC_ROOT = BASE_DIR.joinpath('./staticfiles')
+# сколько секунд кэшируются файлы статики без хеша в имени
+STATIC_CACHE_MAX_AGE = 60
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'movies.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR.joinpath('./media')
 
+# процессов для построения уменьшенных копий изображений (0 — только командой build_thumbnails)
+THUMBNAIL_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# буфер оценок: сброс в базу по числу голосов или по времени (секунды)
+RATING_BUFFER_SIZE = 500
+RATING_BUFFER_DELAY = 1.0
+
 CKEDITOR_UPLOAD_PATH = 'uploads/'
 CKEDITOR_CONFIGS = {
     'default': {
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django import forms
-from django.utils.safestring import mark_safe
+from django.utils import timezone
 
+from movies import boxoffice, facets, filmography, search, similar, thumbnails, versions
+from movies.changelists import FastChangeListMixin
 from movies.models import *
 
 from ckeditor_uploader.widgets import CKEditorUploadingWidget
@@ -41,21 +43,27 @@ class MovieShotInline(admin.StackedInline):
 
     # вывод миниатюры фотографии в списке
     def get_image(self, obj):
-        return mark_safe(f'<img src={obj.image.url} height="140">')
+        return thumbnails.picture(obj.image, 'card', height='140', loading='lazy')
     # имя столбика с картинками
     get_image.short_description = 'Изображениe'
 
 
 @ admin.register(Movie)
-class MovieAdmin(admin.ModelAdmin):
+class MovieAdmin(FastChangeListMixin, admin.ModelAdmin):
     """Фильм"""
     # порядок столбцов
     list_display = ('id', 'title', 'category', 'url', 'draft')
+    # категория необязательна: без явного указания не попадает в соединение
+    list_select_related = ('category',)
+    list_defer = ('description',)
     # ссылка на страницу редактирования
     list_display_links = ('title',)
     # фильтрация по полям
     list_filter = ('category', 'year')
-    # поиск по полям (важно указаь поле соединённой модели)
+    # поиск по полнотекстовому индексу и названию категории, по полям —
+    # если индекса нет или слова запроса слишком короткие для него
+    search_index = search.MOVIE
+    search_index_fields = ('title',)
     search_fields = ('title', 'category__name')
     # подключение связанных с фильмом моделей
     inlines = [MovieShotInline, ReviewInline]
@@ -99,27 +107,33 @@ class MovieAdmin(admin.ModelAdmin):
     # получение постера к фильму
 
     def get_poster(self, obj):
-        return mark_safe(f'<img src={obj.poster.url} height="240">')
+        return self.thumbnail(obj.poster, 'detail', height='240')
     # имя столбика с картинками
     get_poster.short_description = 'Изображениe'
 
-    def unpublish(self, request, queryset):
-        """Снять с публикации"""
-        row_update = queryset.update(draft=True)
+    def set_draft(self, request, queryset, draft):
+        """Смена публикации фильмов со связанными данными"""
+        movie_ids = list(queryset.values_list('id', flat=True))
+        row_update = queryset.update(draft=draft, updated=timezone.now())
+        # update() не вызывает сигналы, индекс фильтров и версия обновляются явно
+        facets.refresh_movies(movie_ids)
+        boxoffice.refresh_movies(movie_ids)
+        filmography.invalidate_movies(movie_ids)
+        similar.schedule(movie_ids)
+        versions.bump('movie')
         if row_update == 1:
             message_bit = "1 запись была обновлена"
         else:
             message_bit = f"{row_update} записей было обновлено"
         self.message_user(request, f"{message_bit}")
 
+    def unpublish(self, request, queryset):
+        """Снять с публикации"""
+        self.set_draft(request, queryset, True)
+
     def publish(self, request, queryset):
         """Опубликовать"""
-        row_update = queryset.update(draft=False)
-        if row_update == 1:
-            message_bit = "1 запись была обновлена"
-        else:
-            message_bit = f"{row_update} записей было обновлено"
-        self.message_user(request, f"{message_bit}")
+        self.set_draft(request, queryset, False)
 
     publish.short_description = 'Опубликовать'
     publish.allow_permissions = ('change',)
@@ -129,24 +143,33 @@ class MovieAdmin(admin.ModelAdmin):
 
 
 @ admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(FastChangeListMixin, admin.ModelAdmin):
     """Отзывы"""
     list_display = ('id', 'name', 'email', 'parent', 'movie')
     list_display_links = ('name',)
+    list_select_related = ('parent', 'movie')
+    list_defer = ('text', 'parent__text', 'movie__description')
+    # поиск по началу адреса, с учетом регистра
+    search_fields = ('^email',)
     # запрет редактирования полей
     readonly_fields = ('name', 'email')
 
 
 @admin.register(FilmCrew)
-class FilmCrewAdmin(admin.ModelAdmin):
+class FilmCrewAdmin(FastChangeListMixin, admin.ModelAdmin):
     """Съемочная группа"""
     list_display = ('id', 'name', 'age', 'get_image')
     list_display_links = ('name',)
     readonly_fields = ('get_image',)
+    list_defer = ('description',)
+    search_index = search.CREW
+    search_index_fields = ('name',)
+    search_fields = ('name',)
+    thumbnail_fields = ('image',)
 
     # вывод миниатюры фотографии в списке
     def get_image(self, obj):
-        return mark_safe(f'<img src={obj.image.url} height="50">')
+        return self.thumbnail(obj.image, 'admin', height='50')
     # имя столбика с картинками
     get_image.short_description = 'Изображениe'
 
@@ -159,25 +182,55 @@ class GenreAdmin(admin.ModelAdmin):
 
 
 @admin.register(MovieShot)
-class MovieShotAdmin(admin.ModelAdmin):
+class MovieShotAdmin(FastChangeListMixin, admin.ModelAdmin):
     """Кадры из фильма"""
     list_display = ('id', 'title', 'movie', 'get_image')
     list_display_links = ('title',)
+    list_select_related = ('movie',)
+    list_defer = ('description', 'movie__description')
+    thumbnail_fields = ('image',)
 
     readonly_fields = ('get_image',)
 
     # вывод миниатюры фотографии в списке
     def get_image(self, obj):
-        return mark_safe(f'<img src={obj.image.url} height="50">')
+        return self.thumbnail(obj.image, 'admin', height='50')
     # имя столбика с картинками
     get_image.short_description = 'Изображениe'
 
 
 @admin.register(Rating)
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(FastChangeListMixin, admin.ModelAdmin):
     """Рейтинг фильма"""
     list_display = ('id', 'ip', 'rate', 'movie')
     list_display_links = ('ip',)
+    list_select_related = ('movie',)
+    list_defer = ('movie__description',)
+    search_fields = ('^ip',)
+
+
+@admin.register(BoxOffice)
+class BoxOfficeAdmin(admin.ModelAdmin):
+    """Кассовые сборы: только просмотр, строки считает movies.boxoffice"""
+    list_display = (
+        'label', 'kind', 'movies', 'budget', 'fees_in_usa', 'fees_in_the_world', 'get_roi',
+    )
+    list_filter = ('kind',)
+    ordering = ('kind', 'label')
+    search_fields = ('label',)
+
+    def get_roi(self, obj):
+        return '—' if obj.roi is None else f'{obj.roi:.0%}'
+    get_roi.short_description = 'Окупаемость'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 # переименовывание заголовка и имени админской страницы
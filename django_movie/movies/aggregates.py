@@ -0,0 +1,126 @@
+"""Агрегаты оценок и отзывов, хранящиеся в самом фильме.
+
+Изменения применяются приращениями в той же транзакции, что и запись
+оценки или отзыва: сначала UPDATE со сдвигом счетчиков (он же берет
+блокировку записи), затем пересчет распределения и средней оценки.
+Команда reconcile_aggregates пересчитывает все заново и исправляет
+расхождения.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from movies.models import Movie, Rating, Review
+
+AGGREGATE_FIELDS = Movie.AGGREGATE_FIELDS
+
+
+def average(rating_sum, rating_count):
+    return round(rating_sum / rating_count, 2) if rating_count else 0
+
+
+def apply_rating_changes(changes):
+    """Применяет изменения оценок: (id фильма, прежняя, новая),
+    где отсутствующая оценка — None"""
+    histograms = defaultdict(Counter)
+    for movie_id, old_rate, new_rate in changes:
+        if old_rate is not None:
+            histograms[movie_id][old_rate] -= 1
+        if new_rate is not None:
+            histograms[movie_id][new_rate] += 1
+
+    with transaction.atomic():
+        for movie_id, delta in histograms.items():
+            count_delta = sum(delta.values())
+            sum_delta = sum(rate * count for rate, count in delta.items())
+            updated = Movie.objects.filter(pk=movie_id).update(
+                rating_count=F('rating_count') + count_delta,
+                rating_sum=F('rating_sum') + sum_delta,
+            )
+            if not updated:
+                continue
+            movie = Movie.objects.only(
+                'rating_count', 'rating_sum', 'rating_histogram'
+            ).get(pk=movie_id)
+            histogram = Counter(movie.rating_histogram)
+            histogram.update({str(rate): count for rate, count in delta.items()})
+            Movie.objects.filter(pk=movie_id).update(
+                updated=timezone.now(),
+                rating_avg=average(movie.rating_sum, movie.rating_count),
+                rating_histogram={
+                    rate: count for rate, count in sorted(
+                        histogram.items(), key=lambda item: int(item[0])
+                    ) if count
+                },
+            )
+
+
+def apply_review_change(movie_id, delta):
+    Movie.objects.filter(pk=movie_id).update(
+        review_count=F('review_count') + delta, updated=timezone.now()
+    )
+
+
+def _empty():
+    return {
+        'rating_count': 0, 'rating_sum': 0, 'rating_avg': 0,
+        'rating_histogram': {}, 'review_count': 0,
+    }
+
+
+def compute(movie_ids):
+    """Агрегаты указанных фильмов, посчитанные заново по таблицам
+    оценок и отзывов"""
+    result = defaultdict(_empty)
+    rows = (
+        Rating.objects.filter(movie_id__in=movie_ids, rate__isnull=False)
+        .values_list('movie_id', 'rate').annotate(count=Count('id'))
+        .order_by('movie_id', 'rate')
+    )
+    for movie_id, rate, count in rows:
+        values = result[movie_id]
+        values['rating_count'] += count
+        values['rating_sum'] += rate * count
+        values['rating_histogram'][str(rate)] = count
+    for values in result.values():
+        values['rating_avg'] = average(values['rating_sum'], values['rating_count'])
+    rows = (
+        Review.objects.filter(movie_id__in=movie_ids)
+        .values_list('movie_id').annotate(count=Count('id')).order_by()
+    )
+    for movie_id, count in rows:
+        result[movie_id]['review_count'] = count
+    return result
+
+
+def reconcile(batch_size=1000, dry_run=False):
+    """Сверяет агрегаты всех фильмов с таблицами пачками по `batch_size`
+    и исправляет расхождения, возвращает (проверено, исправлено)"""
+    checked = fixed = 0
+    last_id = 0
+    while True:
+        movies = list(
+            Movie.objects.filter(pk__gt=last_id).only(*AGGREGATE_FIELDS)
+            .order_by('pk')[:batch_size]
+        )
+        if not movies:
+            return checked, fixed
+        last_id = movies[-1].pk
+        checked += len(movies)
+        expected = compute([movie.pk for movie in movies])
+        changed = []
+        for movie in movies:
+            values = expected.get(movie.pk) or _empty()
+            if any(getattr(movie, field) != values[field] for field in AGGREGATE_FIELDS):
+                for field in AGGREGATE_FIELDS:
+                    setattr(movie, field, values[field])
+                changed.append(movie)
+        if changed and not dry_run:
+            now = timezone.now()
+            for movie in changed:
+                movie.updated = now
+            with transaction.atomic():
+                Movie.objects.bulk_update(changed, AGGREGATE_FIELDS + ('updated',))
+        fixed += len(changed)
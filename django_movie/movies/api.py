@@ -0,0 +1,272 @@
+"""JSON API только для чтения: фильмы, съемочная группа, жанры, категории.
+
+Ответ строится из .values() только по запрошенным полям (?fields=),
+связи (?include=) загружаются пачкой для всей страницы: внешний ключ —
+одним запросом, многие-ко-многим — запросом к промежуточной таблице и
+запросом к связанным записям. Число запросов не зависит от размера
+страницы. Списки листаются курсором (?after=), как и HTML-страницы.
+ETag, Last-Modified и кэш ответов — те же, что у страниц
+(movies.conditional).
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import FileField
+from django.http import Http404, JsonResponse
+from django.views.generic.base import View
+
+from movies.conditional import ConditionalPageMixin
+from movies.models import Category, FilmCrew, Genre, Movie
+from movies.pagination import after_key, decode_cursor, encode_cursor
+from movies.routers import ReplicaReadMixin
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class ApiError(ValueError):
+    """Неверный параметр запроса: (параметр, сообщение)"""
+
+    def __init__(self, param, message):
+        super().__init__(message)
+        self.param = param
+
+
+def split_param(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+class Relation:
+    """Связь ресурса: внешний ключ (column) или многие-ко-многим (through)"""
+
+    def __init__(self, resource, column=None, through=None, source=None, target=None,
+                 filters=None):
+        self.resource = resource
+        self.column = column
+        self.through = through
+        self.source = source
+        self.target = target
+        self.filters = filters or {}
+
+    def load(self, rows):
+        """Добавляет в строки связанные записи с полями по умолчанию"""
+        resource = RESOURCES[self.resource]
+        ids = [row['id'] for row in rows]
+        if self.column:
+            related = resource.rows(
+                {row[self.column] for row in rows if row[self.column] is not None},
+                resource.list_fields,
+            )
+            return [related.get(row[self.column]) for row in rows]
+        links = list(
+            self.through.objects.filter(**{f'{self.source}__in': ids}, **self.filters)
+            .order_by(self.source, 'id').values_list(self.source, self.target)
+        )
+        related = resource.rows({target for _, target in links}, resource.list_fields)
+        grouped = {pk: [] for pk in ids}
+        for source, target in links:
+            if target in related:
+                grouped[source].append(related[target])
+        return [grouped[pk] for pk in ids]
+
+
+class Resource:
+    """Модель в API: выборка, публичные поля и связи"""
+
+    def __init__(self, queryset, fields, list_fields, relations=None,
+                 lookup='pk', sort=None, content_versions=()):
+        self.queryset = queryset
+        # публичное имя поля -> имя для .values()
+        self.fields = fields
+        self.list_fields = list_fields
+        self.relations = relations or {}
+        self.lookup = lookup
+        # ?sort= -> поля ключа курсора
+        self.sort = {'': ('id',), **(sort or {})}
+        self.content_versions = content_versions
+        self.file_fields = {
+            name for name, column in fields.items()
+            if isinstance(queryset.model._meta.get_field(column), FileField)
+        }
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def parse_fields(self, value, default):
+        names = split_param(value) or list(default)
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError('fields', f'Неизвестные поля: {", ".join(unknown)}')
+        return ['id'] + [name for name in names if name != 'id']
+
+    def parse_include(self, value):
+        names = split_param(value)
+        unknown = [name for name in names if name not in self.relations]
+        if unknown:
+            raise ApiError('include', f'Неизвестные связи: {", ".join(unknown)}')
+        return names
+
+    def serialize(self, values, fields):
+        row = {name: values[self.fields[name]] for name in fields}
+        for name in self.file_fields.intersection(fields):
+            storage = self.queryset.model._meta.get_field(self.fields[name]).storage
+            row[name] = storage.url(row[name]) if row[name] else None
+        return row
+
+    def columns(self, fields, include):
+        columns = {self.fields[name] for name in fields}
+        columns.update(
+            self.relations[name].column for name in include if self.relations[name].column
+        )
+        return ['id', *sorted(columns - {'id'})]
+
+    def rows(self, ids, fields):
+        """{id: строка} для связанных записей"""
+        if not ids:
+            return {}
+        values = self.get_queryset().filter(pk__in=ids).values(*self.columns(fields, []))
+        return {row['id']: self.serialize(row, fields) for row in values}
+
+    def build(self, values, fields, include):
+        data = [self.serialize(row, fields) for row in values]
+        for name in include:
+            for row, related in zip(data, self.relations[name].load(values)):
+                row[name] = related
+        return data
+
+
+RESOURCES = {
+    'movies': Resource(
+        # те же фильмы, что и на страницах: только опубликованные
+        Movie.objects.filter(draft=False),
+        fields={
+            'id': 'id', 'url': 'url', 'title': 'title', 'tagline': 'tagline',
+            'description': 'description', 'poster': 'poster', 'year': 'year',
+            'country': 'country', 'world_premiere': 'world_premiere',
+            'budget': 'budget', 'fees_in_usa': 'fees_in_usa',
+            'fees_in_the_world': 'fees_in_the_world', 'category_id': 'category_id',
+            'rating_avg': 'rating_avg', 'rating_count': 'rating_count',
+            'rating_histogram': 'rating_histogram', 'review_count': 'review_count',
+            'updated': 'updated',
+        },
+        list_fields=('url', 'title', 'tagline', 'poster', 'year', 'rating_avg'),
+        relations={
+            'category': Relation('categories', column='category_id'),
+            'genres': Relation(
+                'genres', through=Movie.genres.through, source='movie_id', target='genre_id'
+            ),
+            'director': Relation(
+                'crew', through=Movie.director.through, source='movie_id', target='filmcrew_id'
+            ),
+            'actors': Relation(
+                'crew', through=Movie.actors.through, source='movie_id', target='filmcrew_id'
+            ),
+        },
+        lookup='url',
+        sort={'rating': ('-rating_avg', '-id')},
+        content_versions=('movie', 'category', 'genre', 'filmcrew', 'rating', 'review'),
+    ),
+    'crew': Resource(
+        FilmCrew.objects.all(),
+        fields={
+            'id': 'id', 'name': 'name', 'slug': 'slug', 'age': 'age',
+            'description': 'description', 'image': 'image',
+        },
+        list_fields=('name', 'slug', 'image'),
+        relations={
+            'directed': Relation(
+                'movies', through=Movie.director.through, source='filmcrew_id',
+                target='movie_id', filters={'movie__draft': False},
+            ),
+            'acted': Relation(
+                'movies', through=Movie.actors.through, source='filmcrew_id',
+                target='movie_id', filters={'movie__draft': False},
+            ),
+        },
+        content_versions=('filmcrew', 'movie', 'rating'),
+    ),
+    'genres': Resource(
+        Genre.objects.all(),
+        fields={'id': 'id', 'name': 'name', 'url': 'url', 'description': 'description'},
+        list_fields=('name', 'url'),
+        lookup='url',
+        content_versions=('genre',),
+    ),
+    'categories': Resource(
+        Category.objects.all(),
+        fields={'id': 'id', 'name': 'name', 'url': 'url', 'description': 'description'},
+        list_fields=('name', 'url'),
+        lookup='url',
+        content_versions=('category',),
+    ),
+}
+
+
+class ApiView(ReplicaReadMixin, ConditionalPageMixin, View):
+    """ Список или одна запись ресурса в JSON """
+    resource_name = None
+    max_age_setting = 'API_CACHE_MAX_AGE'
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        self.resource = RESOURCES[self.resource_name]
+        self.content_versions = self.resource.content_versions
+
+    def get(self, request, lookup=None):
+        try:
+            if lookup is None:
+                return JsonResponse(self.get_list(request), json_dumps_params={'ensure_ascii': False})
+            return JsonResponse(self.get_object(request, lookup), json_dumps_params={'ensure_ascii': False})
+        except ApiError as e:
+            return JsonResponse({'errors': {e.param: [str(e)]}}, status=400)
+
+    def get_object(self, request, lookup):
+        resource = self.resource
+        fields = resource.parse_fields(request.GET.get('fields'), resource.fields)
+        include = resource.parse_include(request.GET.get('include'))
+        values = list(
+            resource.get_queryset().filter(**{resource.lookup: lookup})
+            .values(*resource.columns(fields, include))[:1]
+        )
+        if not values:
+            raise Http404('Запись не найдена')
+        return {'data': resource.build(values, fields, include)[0]}
+
+    def get_list(self, request):
+        resource = self.resource
+        fields = resource.parse_fields(request.GET.get('fields'), resource.list_fields)
+        include = resource.parse_include(request.GET.get('include'))
+        sort = request.GET.get('sort', '')
+        if sort not in resource.sort:
+            raise ApiError('sort', f'Допустимые значения: {", ".join(filter(None, resource.sort))}')
+        keys = resource.sort[sort]
+        try:
+            limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        except ValueError:
+            raise ApiError('limit', 'Ожидается число')
+        if limit < 1:
+            raise ApiError('limit', 'Ожидается положительное число')
+
+        queryset = resource.get_queryset()
+        cursor = decode_cursor(request.GET.get('after'))
+        if cursor is not None:
+            if len(cursor) != len(keys) or None in cursor:
+                raise ApiError('after', 'Неверный курсор')
+            try:
+                cursor = [
+                    queryset.model._meta.get_field(key.lstrip('-')).to_python(value)
+                    for key, value in zip(keys, cursor)
+                ]
+            except (ValueError, TypeError, ValidationError):
+                raise ApiError('after', 'Неверный курсор')
+            queryset = queryset.filter(after_key(keys, cursor))
+        names = [key.lstrip('-') for key in keys]
+        columns = resource.columns(fields, include)
+        values = list(
+            queryset.order_by(*keys).values(*columns, *set(names) - set(columns))[:limit + 1]
+        )
+        next_url = None
+        if len(values) > limit:
+            values = values[:limit]
+            query = request.GET.copy()
+            query['after'] = encode_cursor(values[-1][name] for name in names)
+            next_url = f'{request.path}?{query.urlencode()}'
+        return {'data': resource.build(values, fields, include), 'next': next_url}
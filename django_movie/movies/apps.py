@@ -5,3 +5,7 @@ class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movies'
     verbose_name = 'Фильмы'
+
+    def ready(self):
+        # подключение обработчиков сигналов
+        from movies import instrumentation, signals, sqlite  # noqa: F401
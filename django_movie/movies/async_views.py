@@ -0,0 +1,198 @@
+"""Асинхронные варианты страниц фильмов для ASGI.
+
+Данные загружаются асинхронным ORM, части страницы собираются через
+asyncio.gather. Параллельными запросы к базе от этого не становятся:
+асинхронный ORM выполняет их по очереди в одном потоке (sync_to_async
+с thread_sensitive) на одном соединении, одновременно ожидаются
+только обращения к кэшу. Выигрыш ASGI — в том, что цикл событий не
+занят, пока страница ждет базу. Шаблон рендерится в потоке запроса
+(sync_to_async), так как теги шапки и боковой панели при промахе
+кэша обращаются к базе.
+
+Под WSGI используются movies.views, под ASGI — этот модуль
+(настройка ASYNC_VIEWS).
+"""
+import asyncio
+from bisect import bisect_right
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import aget_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.views.generic.base import View
+
+from movies import facets, filmography, filters, similar
+from movies.conditional import AsyncConditionalPageMixin
+from movies.forms import ReviewForm
+from movies.models import Facet, FilmCrew, Movie, Rating, Review
+from movies.pagination import KeysetPaginationMixin
+from movies.routers import AsyncReplicaReadMixin
+from movies.views import MovieDetailView as SyncMovieDetailView
+from movies.views import MoviesView as SyncMoviesView
+
+
+async def prefetch(instance, *names):
+    """Загрузка связанных списков в кэш prefetch_related"""
+    querysets = [getattr(instance, name).all() for name in names]
+    # асинхронный обход заполняет кэш результатов queryset; запросы
+    # выполняются по очереди в потоке ORM
+    await asyncio.gather(*(_fetch(queryset) for queryset in querysets))
+    instance._prefetched_objects_cache = dict(zip(names, querysets))
+
+
+async def _fetch(queryset):
+    return [obj async for obj in queryset]
+
+
+class AsyncPageView(AsyncReplicaReadMixin, AsyncConditionalPageMixin, View):
+    """Страница с боковой панелью: контекст собирается асинхронно"""
+    template_name = None
+    facets = None
+
+    def get_genres(self):
+        return self.facets[Facet.GENRE]
+
+    def get_years(self):
+        return self.facets[Facet.YEAR]
+
+    async def get_context_data(self, **kwargs):
+        return {'view': self}
+
+    async def get(self, request, *args, **kwargs):
+        context = await self.get_context_data(**kwargs)
+        return TemplateResponse(request, self.template_name, context)
+
+
+class MoviesView(KeysetPaginationMixin, AsyncPageView):
+    """ Список фильмов """
+    content_versions = SyncMoviesView.content_versions
+    sort_fields = SyncMoviesView.sort_fields
+    get_cursor_fields = SyncMoviesView.get_cursor_fields
+    model = Movie
+    template_name = 'movies/movie_list.html'
+
+    def get_queryset(self):
+        return Movie.objects.filter(draft=False)
+
+    async def paginate(self):
+        return await self.apaginate_queryset(self.get_queryset(), self.paginate_by)
+
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+        (_, page, object_list, has_next), self.facets = await asyncio.gather(
+            self.paginate(), facets.aget_facets()
+        )
+        context.update({
+            'paginator': None,
+            'page_obj': page,
+            'is_paginated': has_next,
+            'object_list': object_list,
+            'movie_list': object_list,
+        })
+        return context
+
+
+class FilterMoviesView(MoviesView):
+    """ Фильтр фильмов """
+
+    async def paginate(self):
+        # индекс фильтров строится в потоке при первом обращении
+        self.filter_result = await sync_to_async(filters.search)(self.request.GET)
+        ids = self.filter_result.ids
+        cursor = self.get_cursor()
+        start = bisect_right(ids, cursor[0]) if cursor else 0
+        page_ids = ids[start:start + self.paginate_by]
+        object_list = [
+            movie async for movie in
+            Movie.objects.filter(id__in=page_ids).order_by('id')
+        ]
+        has_next = start + self.paginate_by < len(ids)
+        page = self.make_page(object_list, has_next)
+        return None, page, page.object_list, has_next
+
+    def get_cursor_fields(self):
+        return self.cursor_fields
+
+    def get_genres(self):
+        return self.filter_result.facet_values('genre', super().get_genres())
+
+    def get_years(self):
+        return self.filter_result.facet_values('year', super().get_years())
+
+
+class MovieDetailView(AsyncPageView):
+    """ Описание фильма """
+    content_versions = SyncMovieDetailView.content_versions
+    cache_response = False
+    reviews_paginate_by = SyncMovieDetailView.reviews_paginate_by
+    template_name = 'movies/movie_detail.html'
+
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+        try:
+            movie = await Movie.objects.select_related('category').aget(url=kwargs['slug'])
+        except Movie.DoesNotExist:
+            raise Http404('Фильм не найден')
+        # съемочная группа, жанры, кадры, отзывы, похожие фильмы и фильтры
+        # не зависят друг от друга; запросы к базе все равно идут по очереди
+        _, (reviews, next_after), similar_movies, self.facets = await asyncio.gather(
+            prefetch(movie, 'director', 'actors', 'genres', 'movieshot_set'),
+            Review.objects.athread_page(
+                movie,
+                after=self.request.GET.get('reviews_after', ''),
+                limit=self.reviews_paginate_by,
+            ),
+            similar.aget_similar(movie),
+            facets.aget_facets(),
+        )
+        context.update({
+            'object': movie,
+            'movie': movie,
+            'reviews': Review.build_tree(reviews),
+            'reviews_next': next_after,
+            'star_choices': Rating.RATE_CHOICES,
+            'similar_movies': similar_movies,
+        })
+        return context
+
+
+class FilmCrewView(AsyncPageView):
+    """ Вывод информации о члене съёмочной группы """
+    content_versions = ('filmcrew', 'movie', 'category', 'facets')
+    template_name = 'movies/filmcrew.html'
+
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+        filmcrew = await aget_object_or_404(FilmCrew, slug=kwargs['slug'])
+        movies, self.facets = await asyncio.gather(
+            filmography.aget(filmcrew), facets.aget_facets(),
+        )
+        context.update({'object': filmcrew, 'filmcrew': filmcrew, 'filmography': movies})
+        return context
+
+
+class AddReview(View):
+    """ Отзыв """
+
+    async def post(self, request, id):
+        bound_form = ReviewForm(request.POST)
+        movie = await aget_object_or_404(Movie, id=id)
+
+        if bound_form.is_valid():
+            review = bound_form.save(commit=False)
+            parent_id = request.POST.get('parent', '')
+            if parent_id.isdigit():
+                review.parent = await Review.objects.filter(
+                    id=int(parent_id), movie=movie
+                ).afirst()
+            review.movie = movie
+            # транзакции доступны только в синхронном коде
+            await sync_to_async(self.save_review)(review)
+
+        return redirect(movie.get_absolute_url())
+
+    @staticmethod
+    def save_review(review):
+        with transaction.atomic():
+            review.save()
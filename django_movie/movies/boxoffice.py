@@ -0,0 +1,194 @@
+"""Кассовая аналитика: бюджеты, сборы и окупаемость по разрезам.
+
+Суммы по опубликованным фильмам хранятся в таблице BoxOffice для
+каждого года, жанра, страны и категории и общей строкой (TOTAL).
+Разрез целиком считается одним запросом с GROUP BY — база проходит
+фильмы один раз и складывает все столбцы сразу, построчной обработки в
+Python нет. При изменении фильмов пересчитываются только затронутые
+значения (запрос по индексу значения), общая строка складывается из
+строк по годам. Сигналы собирают затронутые значения (schedule) и
+пересчитывают их один раз после фиксации транзакции. Отчет читается
+из кэша, к таблицам фильмов запросы аналитики не обращаются.
+"""
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from movies import routers, versions
+from movies.models import BoxOffice, Category, Genre, Movie
+
+VERSION = 'boxoffice'
+# разрез -> столбец, по которому группируются суммы (жанр — в таблице связей)
+COLUMNS = {
+    BoxOffice.YEAR: 'year',
+    BoxOffice.GENRE: 'genre_id',
+    BoxOffice.COUNTRY: 'country',
+    BoxOffice.CATEGORY: 'category_id',
+}
+SUMS = ('movies', 'budget', 'fees_in_usa', 'fees_in_the_world', 'budgeted_fees')
+
+
+def _sums(prefix=''):
+    """Выражения сумм для values().annotate(); prefix — путь к фильму.
+    Имена с "sum_": аннотации с именами полей фильма заслоняли бы поля"""
+    return {
+        'sum_movies': Count(f'{prefix}id'),
+        'sum_budget': Sum(f'{prefix}budget', default=0),
+        'sum_fees_in_usa': Sum(f'{prefix}fees_in_usa', default=0),
+        'sum_fees_in_the_world': Sum(f'{prefix}fees_in_the_world', default=0),
+        'sum_budgeted_fees': Sum(
+            f'{prefix}fees_in_the_world', filter=Q(**{f'{prefix}budget__gt': 0}), default=0
+        ),
+    }
+
+
+def _grouped(kind, values=None):
+    """{значение: суммы} опубликованных фильмов, все значения или values"""
+    column = COLUMNS[kind]
+    if kind == BoxOffice.GENRE:
+        rows, prefix = Movie.genres.through.objects.filter(movie__draft=False), 'movie__'
+    else:
+        rows, prefix = Movie.objects.filter(draft=False), ''
+    if values is not None:
+        rows = rows.filter(**{f'{column}__in': values})
+    return {
+        row[column]: {name: row[f'sum_{name}'] for name in SUMS}
+        for row in rows.order_by().values(column).annotate(**_sums(prefix))
+        if row[column] is not None
+    }
+
+
+def _labels(kind, values):
+    if kind == BoxOffice.GENRE:
+        return dict(Genre.objects.filter(id__in=values).values_list('id', 'name'))
+    if kind == BoxOffice.CATEGORY:
+        return dict(Category.objects.filter(id__in=values).values_list('id', 'name'))
+    return {value: str(value) for value in values}
+
+
+def _store(kind, values, grouped):
+    """Заменяет строки значений values разреза kind"""
+    labels = _labels(kind, grouped)
+    BoxOffice.objects.filter(kind=kind, value__in=[str(value) for value in values]).delete()
+    BoxOffice.objects.bulk_create([
+        BoxOffice(kind=kind, value=str(value), label=labels.get(value, str(value)), **sums)
+        for value, sums in grouped.items()
+    ])
+
+
+def _store_total():
+    # у каждого фильма ровно один год: общая строка — сумма строк по годам
+    totals = BoxOffice.objects.filter(kind=BoxOffice.YEAR).aggregate(
+        **{name: Sum(name, default=0) for name in SUMS}
+    )
+    BoxOffice.objects.update_or_create(
+        kind=BoxOffice.TOTAL, value='',
+        defaults={'label': dict(BoxOffice.KIND_CHOICES)[BoxOffice.TOTAL], **totals},
+    )
+
+
+def affected(movie_ids):
+    """{разрез: значения}, к которым относятся фильмы"""
+    found = {kind: set() for kind in COLUMNS}
+    for year, country, category_id in Movie.objects.filter(id__in=movie_ids).values_list(
+        'year', 'country', 'category_id'
+    ):
+        found[BoxOffice.YEAR].add(year)
+        found[BoxOffice.COUNTRY].add(country)
+        if category_id is not None:
+            found[BoxOffice.CATEGORY].add(category_id)
+    found[BoxOffice.GENRE].update(
+        Movie.genres.through.objects.filter(movie_id__in=movie_ids)
+        .values_list('genre_id', flat=True)
+    )
+    return found
+
+
+def merge(*found):
+    merged = {kind: set() for kind in COLUMNS}
+    for item in found:
+        for kind, values in item.items():
+            merged[kind].update(values)
+    return merged
+
+
+def refresh(found):
+    """Пересчет значений {разрез: значения}"""
+    found = {kind: set(values) for kind, values in found.items() if values}
+    if not found:
+        return
+    with transaction.atomic():
+        for kind, values in found.items():
+            _store(kind, values, _grouped(kind, values))
+        if BoxOffice.YEAR in found:
+            _store_total()
+    versions.bump(VERSION)
+
+
+def refresh_movies(movie_ids):
+    """Пересчет значений, к которым относятся фильмы"""
+    refresh(affected(list(movie_ids)))
+
+
+def rebuild():
+    """Полный пересчет: один запрос с GROUP BY на разрез"""
+    with transaction.atomic():
+        BoxOffice.objects.all().delete()
+        for kind in COLUMNS:
+            _store(kind, (), _grouped(kind))
+        _store_total()
+    versions.bump(VERSION)
+    return BoxOffice.objects.count()
+
+
+# как в movies.similar: у каждого потока свои незафиксированные изменения
+_pending = threading.local()
+
+
+def schedule(found=None, movie_ids=()):
+    """Пересчитать значения {разрез: значения} и значения фильмов movie_ids
+    после фиксации транзакции; прежние значения фильма передаются до
+    изменения в found"""
+    if not hasattr(_pending, 'found'):
+        _pending.found, _pending.movie_ids = merge(), set()
+    _pending.found = merge(_pending.found, found or {})
+    _pending.movie_ids.update(movie_ids)
+    transaction.on_commit(flush)
+
+
+def flush():
+    found = getattr(_pending, 'found', {})
+    movie_ids = getattr(_pending, 'movie_ids', set())
+    _pending.found, _pending.movie_ids = merge(), set()
+    if movie_ids:
+        found = merge(found, affected(movie_ids))
+    refresh(found)
+
+
+def _report(rows):
+    report = {kind: [] for kind, _ in BoxOffice.KIND_CHOICES}
+    for row in rows:
+        report[row.kind].append({
+            'value': row.value,
+            'label': row.label,
+            **{name: getattr(row, name) for name in SUMS},
+            'roi': row.roi,
+        })
+    report[BoxOffice.YEAR].sort(key=lambda row: int(row['value']))
+    for kind in (BoxOffice.GENRE, BoxOffice.COUNTRY, BoxOffice.CATEGORY):
+        report[kind].sort(key=lambda row: row['label'])
+    report[BoxOffice.TOTAL] = report[BoxOffice.TOTAL][0] if report[BoxOffice.TOTAL] else None
+    return report
+
+
+def get_report():
+    """Все разрезы: из кэша, без кэша — один запрос к BoxOffice"""
+    key = versions.key('movies:boxoffice', VERSION)
+    report = cache.get(key)
+    if report is None:
+        report = _report(BoxOffice.objects.all())
+        if routers.cacheable(VERSION):
+            cache.set(key, report, versions.FRAGMENT_TIMEOUT)
+    return report
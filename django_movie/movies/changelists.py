@@ -0,0 +1,188 @@
+"""Списки админки для больших таблиц (фильмы, отзывы, оценки).
+
+FastChangeListMixin подключается к ModelAdmin и меняет то, что в
+стандартном списке растет вместе с таблицей:
+- связанные объекты из list_display загружаются соединением
+  (list_select_related), тяжелые столбцы не читаются (list_defer);
+- вместо точного COUNT(*) число записей считается только до
+  EstimatedCountPaginator.exact_limit, дальше — оценка по наибольшему id;
+- при сортировке по полям модели страницы выбираются по курсору
+  (movies.pagination) без OFFSET, дальние страницы не дороже первой;
+- поиск идет по полнотекстовому индексу (search_index) и подстроке в
+  полях search_fields, которых в нем нет, или по началу значения
+  ("^поле" в search_fields) условием-диапазоном по индексу;
+- миниатюры (thumbnail_fields) берутся из кэша одним запросом на страницу,
+  файлы изображений при выводе списка не читаются.
+"""
+from django.contrib.admin.utils import lookup_spawns_duplicates
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+from movies import search, thumbnails
+from movies.pagination import after_key, decode_cursor, encode_cursor
+
+CURSOR_VAR = 'after'
+# верхняя граница строк Unicode для условия "начинается с"
+PREFIX_END = '\U0010ffff'
+
+
+class EstimatedCountPaginator(Paginator):
+    """Число записей: точное до exact_limit, дальше — оценка"""
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        # COUNT по подзапросу с LIMIT: просматривается не больше exact_limit строк
+        count = queryset[:self.exact_limit + 1].count()
+        self.exact = count <= self.exact_limit
+        if self.exact or queryset.query.has_filters():
+            return count
+        # без условий: id растут по порядку, наибольший — оценка сверху
+        return max(count, queryset.aggregate(last=Max('pk'))['last'] or 0)
+
+    @property
+    def count_label(self):
+        count = self.count
+        if self.exact:
+            return str(count)
+        if self.object_list.query.has_filters():
+            return f'более {self.exact_limit}'
+        return f'≈ {count}'
+
+
+class FastChangeList(ChangeList):
+    """Список с курсором вместо номера страницы"""
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # курсор относится к текущим условиям и сортировке
+        return super().get_query_string(new_params, [*(remove or []), CURSOR_VAR])
+
+    def apply_select_related(self, qs):
+        qs = super().apply_select_related(qs)
+        return qs.defer(*self.model_admin.list_defer)
+
+    def get_cursor_fields(self):
+        """Поля сортировки, если по ним можно листать курсором, иначе None"""
+        fields = []
+        for item in self.queryset.query.order_by:
+            if not isinstance(item, str):
+                return None
+            name = item.lstrip('-')
+            try:
+                field = self.opts.pk if name == 'pk' else self.opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            # NULL не сравнивается, связи сортируются по полям другой таблицы
+            if field.null or field.is_relation and not field.primary_key:
+                return None
+            fields.append((item, field))
+        return fields if fields and fields[-1][1].primary_key else None
+
+    def get_cursor(self, request, fields):
+        values = decode_cursor(request.GET.get(CURSOR_VAR))
+        # NULL не сравнивается: курсор с null испорчен
+        if values is None or len(values) != len(fields) or None in values:
+            return None
+        try:
+            return [field.to_python(value) for (_, field), value in zip(fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def get_results(self, request):
+        fields = self.get_cursor_fields()
+        self.keyset = fields is not None and not self.show_all
+        if not self.keyset:
+            super().get_results(request)
+        else:
+            self.get_keyset_results(request, fields)
+        self.prefetch_thumbnails()
+
+    def get_keyset_results(self, request, fields):
+        self.paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page
+        )
+        self.cursor = self.get_cursor(request, fields)
+        queryset = self.queryset
+        if self.cursor is not None:
+            queryset = queryset.filter(after_key([item for item, _ in fields], self.cursor))
+        self.result_list = queryset[:self.list_per_page]
+
+        self.next_page_url = None
+        if len(self.result_list) == self.list_per_page:
+            last = self.result_list[self.list_per_page - 1]
+            values = [getattr(last, field.attname) for _, field in fields]
+            if queryset.filter(after_key([item for item, _ in fields], values)).exists():
+                self.next_page_url = self.get_query_string({CURSOR_VAR: encode_cursor(values)})
+        self.first_page_url = self.get_query_string() if self.cursor is not None else None
+
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = bool(self.next_page_url or self.first_page_url)
+
+    def prefetch_thumbnails(self):
+        fields = self.model_admin.thumbnail_fields
+        if not fields:
+            return
+        objects = list(self.result_list)
+        manifests = thumbnails.get_cached_manifests(
+            getattr(obj, name) for obj in objects for name in fields
+        )
+        for obj in objects:
+            obj._admin_thumbnails = manifests
+
+
+class FastChangeListMixin:
+    """Списки ModelAdmin для больших таблиц"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # поля, не нужные списку, в том числе у связанных объектов ("movie__description")
+    list_defer = ()
+    # вид записей полнотекстового индекса (search.MOVIE, search.CREW)
+    search_index = None
+    # поля search_fields, которые покрывает индекс; остальные ищутся
+    # вместе с ним по подстроке
+    search_index_fields = ()
+    thumbnail_fields = ()
+
+    def get_changelist(self, request, **kwargs):
+        return FastChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if self.search_index:
+            condition = search.matching(self.search_index, term)
+            if condition is not None:
+                use_distinct = False
+                for field in self.get_search_fields(request):
+                    if field not in self.search_index_fields:
+                        path = field.lstrip('^=@')
+                        condition |= Q(**{f'{path}__icontains': term})
+                        use_distinct |= lookup_spawns_duplicates(self.opts, path)
+                return queryset.filter(condition), use_distinct
+        fields = self.get_search_fields(request)
+        if fields and all(field.startswith('^') for field in fields):
+            # диапазон вместо LIKE: индекс используется, регистр учитывается
+            condition = Q()
+            for field in fields:
+                condition |= Q(**{f'{field[1:]}__gte': term, f'{field[1:]}__lt': term + PREFIX_END})
+            return queryset.filter(condition), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def thumbnail(self, fieldfile, size, **attrs):
+        """Миниатюра для столбца списка или поля формы"""
+        manifests = getattr(fieldfile.instance, '_admin_thumbnails', None)
+        return thumbnails.picture(fieldfile, size, manifests=manifests, loading='lazy', **attrs)
@@ -0,0 +1,145 @@
+"""Условные GET-запросы и кэш готовых страниц.
+
+ETag и Last-Modified страницы вычисляются по версиям данных, которые
+она выводит (movies.versions), и полному пути запроса. Совпавший
+If-None-Match или If-Modified-Since дает 304 еще до шаблонов и базы,
+а страницы без персональных данных целиком отдаются из кэша. Пока
+реплики могут отставать от последнего изменения (routers.cacheable),
+страница отдается без валидаторов и с no-store.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from movies import routers, versions
+
+
+class ConditionalPageMixin:
+    """ETag/Last-Modified по версиям содержимого, 304 и кэш страницы"""
+    # данные, которые выводит страница
+    content_versions = ('movie', 'category', 'facets')
+    # страницы с токеном CSRF нельзя отдавать другим из общего кэша
+    cache_response = True
+    # настройка со сроком хранения в кэше браузера и прокси
+    max_age_setting = 'PAGE_CACHE_MAX_AGE'
+
+    def make_etag(self, request, current):
+        source = '|'.join(
+            [request.get_full_path()] +
+            [f'{name}={current[name]}' for name in sorted(current)]
+        )
+        etag = hashlib.sha1(source.encode()).hexdigest()
+        # одинаковые байты гарантированы только для страниц из кэша
+        return quote_etag(etag) if self.cache_response else f'W/"{etag}"'
+
+    def get_etag(self, request):
+        return self.make_etag(request, versions.get_many(*self.content_versions))
+
+    def get_validators(self, request):
+        return self.get_etag(request), versions.last_modified(*self.content_versions)
+
+    async def aget_validators(self, request):
+        current = await versions.aget_many(*self.content_versions)
+        last_modified = await versions.alast_modified(*self.content_versions)
+        return self.make_etag(request, current), last_modified
+
+    def page_key(self, etag):
+        return f'movies:page:{etag}'
+
+    def cached_page(self, cached):
+        return HttpResponse(cached['content'], content_type=cached['content_type'])
+
+    def get_cached_response(self, request, etag, last_modified):
+        """Ответ 304 или страница из кэша, None — страницу нужно построить"""
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return response
+        cached = cache.get(self.page_key(etag)) if self.cache_response else None
+        return None if cached is None else self.cached_page(cached)
+
+    async def aget_cached_response(self, request, etag, last_modified):
+        """Асинхронный вариант get_cached_response"""
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return response
+        cached = await cache.aget(self.page_key(etag)) if self.cache_response else None
+        return None if cached is None else self.cached_page(cached)
+
+    def store_response(self, response, etag, cacheable):
+        if response.status_code == 200 and self.cache_response and cacheable:
+            cache.set(self.page_key(etag), {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+            }, versions.FRAGMENT_TIMEOUT)
+        return response
+
+    async def astore_response(self, response, etag, cacheable):
+        if response.status_code == 200 and self.cache_response and cacheable:
+            await cache.aset(self.page_key(etag), {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+            }, versions.FRAGMENT_TIMEOUT)
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(request)
+        response = self.get_cached_response(request, etag, last_modified)
+        cacheable = routers.cacheable(*self.content_versions)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            self.store_response(response, etag, cacheable)
+        return self.patch_headers(response, etag, last_modified, cacheable)
+
+    def patch_headers(self, response, etag, last_modified, cacheable):
+        # RFC 9110: в ответе 304 повторяются ETag и Cache-Control
+        if response.status_code not in (200, 304):
+            return response
+        if not cacheable:
+            # страница с отстающей реплики: валидаторы новой версии
+            # закрепили бы старое содержимое в кэше браузера и прокси
+            patch_cache_control(response, no_store=True)
+            return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # patch_cache_control записывает False как «private=False»
+        visibility = 'public' if self.cache_response else 'private'
+        patch_cache_control(
+            response,
+            max_age=getattr(settings, self.max_age_setting, 0),
+            **{visibility: True},
+        )
+        return response
+
+
+class AsyncConditionalPageMixin(ConditionalPageMixin):
+    """ConditionalPageMixin для асинхронных представлений"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = super(ConditionalPageMixin, self).dispatch
+        if request.method not in ('GET', 'HEAD'):
+            return await handler(request, *args, **kwargs)
+        # версии и страницы — асинхронными вызовами кэша: общий кэш
+        # (Redis) не должен блокировать цикл событий
+        etag, last_modified = await self.aget_validators(request)
+        response = await self.aget_cached_response(request, etag, last_modified)
+        cacheable = await routers.acacheable(*self.content_versions)
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                # шаблонные теги могут обращаться к базе
+                await sync_to_async(response.render)()
+            await self.astore_response(response, etag, cacheable)
+        return self.patch_headers(response, etag, last_modified, cacheable)
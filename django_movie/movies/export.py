@@ -0,0 +1,138 @@
+"""Потоковая выгрузка каталога в NDJSON или JSON.
+
+Фильмы читаются .iterator() пачками по `batch_size`, съемочная группа и
+жанры подгружаются prefetch_related для каждой пачки, каждая запись
+сразу сериализуется в строку. Память не зависит от размера каталога.
+
+Инкрементальная выгрузка берет фильмы с updated не раньше `since`.
+Версия выгрузки — время ее начала, его передают как `since` в
+следующий раз; запись, измененная во время выгрузки, попадет в обе.
+Снятые с публикации (без `drafts`) и удаленные фильмы попадают в нее
+как tombstone — {"id", "url", "removed": true, "updated"}, чтобы
+получатель убрал их у себя. Удаления берутся из журнала DeletedMovie.
+"""
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from movies.models import DeletedMovie, Movie
+
+BATCH_SIZE = 500
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def parse_since(value):
+    """Время из ISO 8601 или unix time, ValueError для неверного"""
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError(f'Неверное время: {value}')
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, dt_timezone.utc)
+    return since
+
+
+def get_version():
+    """Версия выгрузки: время начала в ISO 8601"""
+    return timezone.now().isoformat()
+
+
+def movies(since=None, drafts=False):
+    queryset = Movie.objects.select_related('category').prefetch_related(
+        'director', 'actors', 'genres',
+    ).order_by('id')
+    if since is not None:
+        # черновики нужны и без drafts: они выгружаются как tombstone
+        return queryset.filter(updated__gte=since)
+    if not drafts:
+        queryset = queryset.filter(draft=False)
+    return queryset
+
+
+def deleted(since):
+    return DeletedMovie.objects.filter(deleted__gte=since).order_by('deleted', 'id')
+
+
+def _crew(people):
+    return [{'id': person.pk, 'name': person.name} for person in people]
+
+
+def document(movie):
+    """Фильм с вложенными связями и агрегатами"""
+    category = movie.category
+    return {
+        'id': movie.pk,
+        'url': movie.url,
+        'title': movie.title,
+        'tagline': movie.tagline,
+        'description': movie.description,
+        'poster': movie.poster.name,
+        'year': movie.year,
+        'country': movie.country,
+        'world_premiere': movie.world_premiere,
+        'budget': movie.budget,
+        'fees_in_usa': movie.fees_in_usa,
+        'fees_in_the_world': movie.fees_in_the_world,
+        'draft': movie.draft,
+        'category': category and {
+            'id': category.pk, 'url': category.url, 'name': category.name,
+        },
+        'genres': [
+            {'id': genre.pk, 'url': genre.url, 'name': genre.name}
+            for genre in movie.genres.all()
+        ],
+        'director': _crew(movie.director.all()),
+        'actors': _crew(movie.actors.all()),
+        'rating': {
+            'count': movie.rating_count,
+            'avg': movie.rating_avg,
+            'histogram': movie.rating_histogram,
+        },
+        'review_count': movie.review_count,
+        'updated': movie.updated,
+    }
+
+
+def tombstone(movie_id, url, updated):
+    """Запись об удаленном или снятом с публикации фильме"""
+    return {'id': movie_id, 'url': url, 'removed': True, 'updated': updated}
+
+
+def documents(since=None, drafts=False, batch_size=BATCH_SIZE):
+    for movie in movies(since, drafts).iterator(chunk_size=batch_size):
+        if movie.draft and not drafts:
+            yield tombstone(movie.pk, movie.url, movie.updated)
+        else:
+            yield document(movie)
+    if since is not None:
+        for row in deleted(since).iterator(chunk_size=batch_size):
+            yield tombstone(row.movie_id, row.url, row.deleted)
+
+
+def dumps(doc):
+    return json.dumps(doc, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def stream(since=None, drafts=False, file_format='ndjson', batch_size=BATCH_SIZE):
+    """Строки выгрузки: по фильму в строке (ndjson) или массив JSON"""
+    docs = documents(since, drafts, batch_size)
+    if file_format == 'ndjson':
+        for doc in docs:
+            yield dumps(doc) + '\n'
+        return
+    separator = '[\n'
+    for doc in docs:
+        yield separator + dumps(doc)
+        separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
@@ -0,0 +1,121 @@
+"""Индекс значений фильтров (годы, жанры) для боковой панели.
+
+Число опубликованных фильмов по каждому значению хранится в таблице
+Facet и пересчитывается только для затронутых значений при изменении
+фильмов. Сама панель читается из кэша и запросов к базе не делает.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from movies import routers, versions
+from movies.models import Facet, Genre, Movie
+
+VERSION = 'facets'
+
+
+def _group(facets):
+    grouped = {kind: [] for kind, _ in Facet.KIND_CHOICES}
+    for facet in facets:
+        grouped[facet.kind].append(facet)
+    grouped[Facet.YEAR].sort(key=lambda facet: int(facet.value))
+    grouped[Facet.GENRE].sort(key=lambda facet: facet.label)
+    return grouped
+
+
+def get_facets():
+    """Значения фильтров с ненулевым числом фильмов по видам"""
+    key = versions.key('movies:facets', VERSION)
+    facets = cache.get(key)
+    if facets is None:
+        facets = _group(Facet.objects.filter(count__gt=0))
+        if routers.cacheable(VERSION):
+            cache.set(key, facets, versions.FRAGMENT_TIMEOUT)
+    return facets
+
+
+async def aget_facets():
+    """Асинхронный вариант get_facets"""
+    key = await versions.akey('movies:facets', VERSION)
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = _group([facet async for facet in Facet.objects.filter(count__gt=0)])
+        if await routers.acacheable(VERSION):
+            await cache.aset(key, facets, versions.FRAGMENT_TIMEOUT)
+    return facets
+
+
+def get_version():
+    """Версия индекса, меняется при любом изменении фильтров"""
+    return versions.get(VERSION)
+
+
+def invalidate():
+    versions.bump(VERSION)
+
+
+def _store(kind, counts, labels):
+    """Записывает пересчитанные значения одного вида фильтра"""
+    for value, label in labels.items():
+        count = counts.get(value, 0)
+        if count:
+            Facet.objects.update_or_create(
+                kind=kind, value=str(value),
+                defaults={'label': label, 'count': count},
+            )
+        else:
+            Facet.objects.filter(kind=kind, value=str(value)).delete()
+
+
+def refresh_years(years):
+    """Пересчет числа фильмов по указанным годам"""
+    years = {year for year in years if year is not None}
+    if not years:
+        return
+    counts = dict(
+        Movie.objects.filter(draft=False, year__in=years)
+        .values_list('year').annotate(count=Count('id'))
+    )
+    _store(Facet.YEAR, counts, {year: str(year) for year in years})
+    invalidate()
+
+
+def refresh_genres(genre_ids):
+    """Пересчет числа фильмов по указанным жанрам"""
+    genre_ids = set(genre_ids)
+    if not genre_ids:
+        return
+    counts = dict(
+        Movie.genres.through.objects
+        .filter(genre_id__in=genre_ids, movie__draft=False)
+        .values_list('genre_id').annotate(count=Count('id'))
+    )
+    labels = dict(
+        Genre.objects.filter(id__in=genre_ids).values_list('id', 'name')
+    )
+    # удаленные жанры убираются из индекса
+    for genre_id in genre_ids - labels.keys():
+        Facet.objects.filter(kind=Facet.GENRE, value=str(genre_id)).delete()
+    _store(Facet.GENRE, counts, labels)
+    invalidate()
+
+
+def refresh_movies(movie_ids):
+    """Пересчет значений, к которым относятся указанные фильмы"""
+    movie_ids = list(movie_ids)
+    refresh_years(
+        Movie.objects.filter(id__in=movie_ids)
+        .values_list('year', flat=True).distinct()
+    )
+    refresh_genres(
+        Movie.genres.through.objects.filter(movie_id__in=movie_ids)
+        .values_list('genre_id', flat=True).distinct()
+    )
+
+
+def rebuild():
+    """Полный пересчет индекса"""
+    with transaction.atomic():
+        Facet.objects.all().delete()
+        refresh_years(Movie.objects.values_list('year', flat=True).distinct())
+        refresh_genres(Genre.objects.values_list('id', flat=True))
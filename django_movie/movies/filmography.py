@@ -0,0 +1,76 @@
+"""Фильмография члена съемочной группы для его страницы.
+
+Опубликованные фильмы, где человек режиссер или актер, читаются одним
+запросом с признаками обеих ролей и кэшируются для каждого человека
+отдельно. У каждого человека своя версия (versions, вид
+"filmography:<id>"): сигналы увеличивают ее при изменении его фильмов и
+связей с ними, массовые изменения без сигналов (update, прямые вставки
+импорта) вызывают invalidate/invalidate_movies явно.
+"""
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+from movies import routers, versions
+from movies.models import Movie
+
+DIRECTOR = Movie.director.through
+ACTORS = Movie.actors.through
+
+
+def version_name(person_id):
+    return f'filmography:{person_id}'
+
+
+def query(person_id):
+    """Фильмы человека по годам, новые первыми, с ролями directed/acted"""
+    directed = DIRECTOR.objects.filter(filmcrew_id=person_id)
+    acted = ACTORS.objects.filter(filmcrew_id=person_id)
+    return Movie.objects.filter(
+        Q(pk__in=directed.values('movie_id')) | Q(pk__in=acted.values('movie_id')),
+        draft=False,
+    ).annotate(
+        directed=Exists(directed.filter(movie_id=OuterRef('pk'))),
+        acted=Exists(acted.filter(movie_id=OuterRef('pk'))),
+    ).order_by('-year', 'title', 'id').values('title', 'url', 'year', 'directed', 'acted')
+
+
+def get(person):
+    name = version_name(person.pk)
+    key = versions.key(f'movies:filmography:{person.pk}', name)
+    movies = cache.get(key)
+    if movies is None:
+        movies = list(query(person.pk))
+        if routers.cacheable(name):
+            cache.set(key, movies, versions.FRAGMENT_TIMEOUT)
+    return movies
+
+
+async def aget(person):
+    """Асинхронный вариант get"""
+    name = version_name(person.pk)
+    key = await versions.akey(f'movies:filmography:{person.pk}', name)
+    movies = await cache.aget(key)
+    if movies is None:
+        movies = [movie async for movie in query(person.pk)]
+        if await routers.acacheable(name):
+            await cache.aset(key, movies, versions.FRAGMENT_TIMEOUT)
+    return movies
+
+
+def invalidate(person_ids):
+    names = {version_name(pk) for pk in person_ids}
+    if names:
+        versions.bump(*names)
+
+
+def crew_of(movie_ids):
+    """id режиссеров и актеров фильмов одним запросом"""
+    return set(
+        DIRECTOR.objects.filter(movie_id__in=movie_ids).values_list('filmcrew_id', flat=True)
+        .union(ACTORS.objects.filter(movie_id__in=movie_ids).values_list('filmcrew_id', flat=True))
+    )
+
+
+def invalidate_movies(movie_ids):
+    """Фильмографии всех людей, снимавшихся в фильмах"""
+    invalidate(crew_of(movie_ids))
@@ -0,0 +1,165 @@
+"""Фильтр фильмов по году, жанру, категории и стране.
+
+Для опубликованных фильмов в памяти процесса хранятся множества id по
+каждому значению фильтра. Внутри одного фильтра значения объединяются
+(ИЛИ), разные фильтры пересекаются (И); для жанров можно потребовать
+все выбранные сразу. Индекс перестраивается после смены версии индекса
+фильтров (movies.facets), поэтому время фильтрации не зависит от
+запросов к базе.
+"""
+import threading
+from collections import defaultdict
+
+from movies import facets, routers
+from movies.models import Movie
+
+FILTERS = ('year', 'genre', 'category', 'country')
+
+_lock = threading.Lock()
+_index = None
+
+
+class FilterQuery:
+    """ Выбранные значения фильтров """
+
+    def __init__(self, selected=None, genre_mode='any', year_from=None, year_to=None):
+        self.selected = {
+            name: set(values) for name, values in (selected or {}).items()
+            if name in FILTERS and values
+        }
+        self.genre_mode = genre_mode
+        self.year_from = year_from
+        self.year_to = year_to
+
+    @classmethod
+    def from_request(cls, data):
+        def year(name):
+            value = data.get(name, '')
+            return int(value) if value.isdigit() else None
+
+        return cls(
+            selected={name: data.getlist(name) for name in FILTERS},
+            genre_mode='all' if data.get('genre_mode') == 'all' else 'any',
+            year_from=year('year_from'),
+            year_to=year('year_to'),
+        )
+
+    def is_selected(self, name, value):
+        return value in self.selected.get(name, ())
+
+
+class FilterResult:
+    """ Найденные фильмы и число фильмов по каждому значению фильтров """
+
+    def __init__(self, query, ids, counts):
+        self.query = query
+        self.ids = ids
+        self.counts = counts
+
+    def facet_values(self, name, facet_list):
+        """Значения фильтра для боковой панели с учетом выбора"""
+        counts = self.counts.get(name, {})
+        return [
+            {
+                'value': facet.value,
+                'label': facet.label,
+                'count': counts.get(facet.value, 0),
+                'selected': self.query.is_selected(name, facet.value),
+            }
+            for facet in facet_list
+        ]
+
+
+class FilterIndex:
+    """ Множества id опубликованных фильмов по значениям фильтров """
+
+    def __init__(self, movies, movie_genres):
+        self.all_ids = set()
+        self.values = {name: defaultdict(set) for name in FILTERS}
+        for movie_id, year, category_id, country in movies:
+            self.all_ids.add(movie_id)
+            self.values['year'][str(year)].add(movie_id)
+            if category_id is not None:
+                self.values['category'][str(category_id)].add(movie_id)
+            if country:
+                self.values['country'][country].add(movie_id)
+        for movie_id, genre_id in movie_genres:
+            self.values['genre'][str(genre_id)].add(movie_id)
+
+    @classmethod
+    def build(cls):
+        return cls(
+            Movie.objects.filter(draft=False)
+            .values_list('id', 'year', 'category_id', 'country').iterator(),
+            Movie.genres.through.objects.filter(movie__draft=False)
+            .values_list('movie_id', 'genre_id').iterator(),
+        )
+
+    def _union(self, name, values):
+        sets = [self.values[name].get(value, set()) for value in values]
+        return set().union(*sets)
+
+    def _facet_ids(self, name, query):
+        """Фильмы, подходящие под один фильтр, или None если он не задан"""
+        values = query.selected.get(name)
+        if name == 'year' and (query.year_from or query.year_to):
+            low, high = query.year_from or 0, query.year_to or 9999
+            in_range = {
+                year for year in self.values['year'] if low <= int(year) <= high
+            }
+            values = in_range & values if values else in_range
+            return self._union(name, values)
+        if not values:
+            return None
+        if name == 'genre' and query.genre_mode == 'all':
+            return _intersect([self.values[name].get(v, set()) for v in values])
+        return self._union(name, values)
+
+    def search(self, query):
+        facet_ids = {}
+        for name in FILTERS:
+            ids = self._facet_ids(name, query)
+            if ids is not None:
+                facet_ids[name] = ids
+        found = _intersect([self.all_ids, *facet_ids.values()])
+
+        counts = {}
+        for name in FILTERS:
+            if name == 'genre' and query.genre_mode == 'all':
+                # каждый жанр добавляется к уже выбранным
+                base = found
+            else:
+                # без учета собственного фильтра, чтобы видеть альтернативы
+                base = _intersect([self.all_ids] + [
+                    ids for other, ids in facet_ids.items() if other != name
+                ])
+            counts[name] = {
+                value: len(base & ids) for value, ids in self.values[name].items()
+            }
+        return FilterResult(query, sorted(found), counts)
+
+
+def _intersect(sets):
+    sets = sorted(sets, key=len)
+    return set(sets[0]).intersection(*sets[1:]) if sets else set()
+
+
+def get_index():
+    """Индекс текущей версии, при устаревании строится заново"""
+    global _index
+    version = facets.get_version()
+    index = _index
+    if index is None or index[0] != version:
+        with _lock:
+            if _index is None or _index[0] != version:
+                # отставшая реплика оставила бы в памяти старый индекс
+                # под новой версией
+                with routers.primary_reads():
+                    _index = (version, FilterIndex.build())
+            index = _index
+    return index[1]
+
+
+def search(data):
+    """Фильтрация по параметрам GET-запроса"""
+    return get_index().search(FilterQuery.from_request(data))
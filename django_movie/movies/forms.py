@@ -1,6 +1,6 @@
 from django import forms
 
-from movies.models import Review
+from movies.models import Rating, Review
 
 
 class ReviewForm(forms.ModelForm):
@@ -9,3 +9,9 @@ class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
         fields = ('name', 'email', 'text')
+
+
+class RatingForm(forms.Form):
+    """ Форма оценки фильма """
+    movie = forms.IntegerField(min_value=1)
+    star = forms.TypedChoiceField(choices=Rating.RATE_CHOICES, coerce=int)
@@ -0,0 +1,342 @@
+"""Замеры каждого запроса: база, шаблоны, кэш, общее время.
+
+RequestStatsMiddleware собирает на время запроса:
+- число и время SQL-запросов по всем базам и самые медленные из них;
+- время рендеринга шаблонов (шаблонный движок DjangoTemplates отсюда,
+  вложенные шаблоны не считаются повторно);
+- попадания и промахи кэша (кэши LocMemCache/RedisCache отсюда).
+
+Итог уходит в заголовок Server-Timing, медленные запросы
+(settings.SLOW_REQUEST_MS) пишутся в журнал вместе с самыми медленными
+SQL, а время по имени адреса копится гистограммой в общем кэше, чтобы
+ее видели все процессы: команда request_stats и страница для
+администраторов. Общим кэш должен быть на самом деле (RedisCache): у
+LocMemCache гистограмма своя в каждом процессе, страница показывает
+только обработавший ее процесс, а команда, запущенная отдельным
+процессом, не видит ничего и завершается ошибкой (is_shared).
+
+Для потоковых ответов время заканчивается с началом передачи. Под
+ASGI middleware работает в цикле событий, без перехода в поток; SQL
+считается на всех соединениях (connection_created), в том числе в
+потоках sync_to_async, где асинхронный ORM выполняет запросы.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends import dummy, locmem, redis
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends import django as django_backend
+from django.urls import URLPattern, URLResolver, get_resolver
+
+logger = logging.getLogger(__name__)
+
+# верхние границы интервалов гистограммы, мс; последний — все остальное
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PREFIX = 'movies:timing:'
+UNRESOLVED = '<unresolved>'
+SLOWEST_SQL = 3
+
+_stats = ContextVar('movies_request_stats', default=None)
+_MISSING = object()
+
+
+class RequestStats:
+    """Счетчики одного запроса"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = []
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_depth = 0
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        self.slowest.append((duration, sql))
+        if len(self.slowest) > SLOWEST_SQL:
+            self.slowest.sort(reverse=True)
+            del self.slowest[SLOWEST_SQL:]
+
+
+def current():
+    return _stats.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    """Замер SQL на каждом соединении. Соединения у каждого потока свои,
+    под ASGI запросы идут из потока sync_to_async, а не из потока
+    middleware; счетчики запроса доходят туда через ContextVar"""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@contextmanager
+def collect():
+    """Счетчики для кода внутри блока"""
+    stats = RequestStats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+class TimedTemplate:
+    """Шаблон движка с замером рендеринга"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _stats.get()
+        if stats is None:
+            return self.template.render(context, request)
+        stats.render_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.render_depth -= 1
+            if not stats.render_depth:
+                stats.render_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Стандартный движок шаблонов с замером времени"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class CacheStatsMixin:
+    """Попадания и промахи get/get_many; get_many базового класса
+    вызывает get для каждого ключа, такие вызовы не считаются дважды"""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        stats = _stats.get()
+        if stats is not None and not stats.cache_depth:
+            if value is _MISSING:
+                stats.cache_misses += 1
+            else:
+                stats.cache_hits += 1
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        stats = _stats.get()
+        if stats is None:
+            return super().get_many(keys, version)
+        stats.cache_depth += 1
+        try:
+            values = super().get_many(keys, version)
+        finally:
+            stats.cache_depth -= 1
+        if not stats.cache_depth:
+            stats.cache_hits += len(values)
+            stats.cache_misses += len(keys) - len(values)
+        return values
+
+
+class LocMemCache(CacheStatsMixin, locmem.LocMemCache):
+    pass
+
+
+class RedisCache(CacheStatsMixin, redis.RedisCache):
+    pass
+
+
+def is_shared():
+    """Видят ли кэш по умолчанию другие процессы"""
+    return not isinstance(caches['default'], (locmem.LocMemCache, dummy.DummyCache))
+
+
+def server_timing(stats, total):
+    """Значение заголовка; SQL из шаблонов входит и в db, и в tpl"""
+    return ', '.join([
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+        f'tpl;dur={stats.render_time * 1000:.1f}',
+        f'cache;desc="{stats.cache_hits} hits / {stats.cache_misses} misses"',
+        f'app;dur={max(0, total - stats.db_time - stats.render_time) * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+def _key(name, field):
+    return f'{PREFIX}{name}:{field}'
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # первый запрос по адресу; при гонке add не перезапишет чужое значение
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+async def _aincr(key, delta):
+    try:
+        await cache.aincr(key, delta)
+    except ValueError:
+        if not await cache.aadd(key, delta, None):
+            await cache.aincr(key, delta)
+
+
+def _increments(name, total, queries):
+    duration = total * 1000
+    return {
+        _key(name, 'count'): 1,
+        _key(name, 'ms'): int(duration),
+        _key(name, 'queries'): queries,
+        _key(name, f'b{bisect_left(BUCKETS, duration)}'): 1,
+    }
+
+
+def record(name, total, queries):
+    """Добавляет запрос в гистограмму адреса"""
+    for key, delta in _increments(name, total, queries).items():
+        _incr(key, delta)
+
+
+async def arecord(name, total, queries):
+    """Асинхронный вариант record"""
+    for key, delta in _increments(name, total, queries).items():
+        await _aincr(key, delta)
+
+
+def url_names(resolver=None, namespace=''):
+    """Имена всех адресов проекта с пространствами имен"""
+    names = []
+    for pattern in (resolver or get_resolver()).url_patterns:
+        if isinstance(pattern, URLResolver):
+            nested = f'{namespace}{pattern.namespace}:' if pattern.namespace else namespace
+            names += url_names(pattern, nested)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.append(f'{namespace}{pattern.name}')
+    return names
+
+
+def _percentile(buckets, count, share):
+    """Верхняя граница интервала, в который попадает доля share запросов"""
+    seen = 0
+    for index, value in enumerate(buckets):
+        seen += value
+        if seen >= count * share:
+            return BUCKETS[index] if index < len(BUCKETS) else None
+    return None
+
+
+def histograms():
+    """Гистограммы по именам адресов, где были запросы"""
+    fields = ['count', 'ms', 'queries'] + [f'b{i}' for i in range(len(BUCKETS) + 1)]
+    names = url_names() + [UNRESOLVED]
+    values = cache.get_many([_key(name, field) for name in names for field in fields])
+    result = {}
+    for name in names:
+        count = values.get(_key(name, 'count'))
+        if not count:
+            continue
+        buckets = [values.get(_key(name, f'b{i}'), 0) for i in range(len(BUCKETS) + 1)]
+        result[name] = {
+            'count': count,
+            'mean_ms': round(values.get(_key(name, 'ms'), 0) / count, 1),
+            'mean_queries': round(values.get(_key(name, 'queries'), 0) / count, 1),
+            # оценка по интервалам: "не больше", None — больше последней границы
+            'p50_ms': _percentile(buckets, count, 0.5),
+            'p95_ms': _percentile(buckets, count, 0.95),
+            'p99_ms': _percentile(buckets, count, 0.99),
+            'buckets': {
+                (f'<={BUCKETS[i]}' if i < len(BUCKETS) else f'>{BUCKETS[-1]}'): value
+                for i, value in enumerate(buckets)
+            },
+        }
+    return result
+
+
+def reset():
+    fields = ['count', 'ms', 'queries'] + [f'b{i}' for i in range(len(BUCKETS) + 1)]
+    cache.delete_many([
+        _key(name, field) for name in url_names() + [UNRESOLVED] for field in fields
+    ])
+
+
+class RequestStatsMiddleware:
+    """Server-Timing, журнал медленных запросов и гистограммы по адресам"""
+    # под ASGI запрос не переводится в поток ради этого middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with collect() as stats:
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+        name = self.finish(request, response, stats, total)
+        record(name, total, stats.queries)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect() as stats:
+            response = await self.get_response(request)
+        total = time.perf_counter() - started
+        name = self.finish(request, response, stats, total)
+        await arecord(name, total, stats.queries)
+        return response
+
+    def finish(self, request, response, stats, total):
+        """Заголовок и журнал; возвращает имя адреса для гистограммы"""
+        response['Server-Timing'] = server_timing(stats, total)
+        match = request.resolver_match
+        name = match.view_name if match and match.url_name else UNRESOLVED
+        if total * 1000 >= getattr(settings, 'SLOW_REQUEST_MS', 500):
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.0f мс, SQL %d за %.0f мс, шаблоны %.0f мс, '
+                'кэш %d/%d; самые медленные SQL:\n%s',
+                request.method, request.get_full_path(), name, total * 1000,
+                stats.queries, stats.db_time * 1000, stats.render_time * 1000,
+                stats.cache_hits, stats.cache_misses,
+                '\n'.join(
+                    f'  {duration * 1000:.1f} мс: {sql}'
+                    for duration, sql in sorted(stats.slowest, reverse=True)
+                ),
+            )
+        return name
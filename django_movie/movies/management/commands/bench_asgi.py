@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils.encoding import iri_to_uri
+
+from movies.conditional import ConditionalPageMixin
+from movies.models import FilmCrew, Genre, Movie
+
+MODES = ('wsgi', 'asgi')
+HOST = 'localhost'
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение синхронных (WSGI) и асинхронных (ASGI) страниц фильмов: '
+        'запросов в секунду и задержка p50/p99 при одновременных клиентах. '
+        'Каждый режим запускается в отдельном процессе через обработчики Django'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--clients', type=int, default=32)
+        parser.add_argument(
+            '--no-page-cache', action='store_true',
+            help='Строить каждую страницу заново (кэш фрагментов остается)',
+        )
+        parser.add_argument('--json', action='store_true', help='Результат в JSON')
+        parser.add_argument('--mode', choices=MODES, help='Запустить один режим в этом процессе')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options)))
+            return
+
+        results = []
+        for mode in MODES:
+            env = dict(os.environ, DJANGO_ASYNC_VIEWS='1' if mode == 'asgi' else '0')
+            command = [
+                sys.executable, '-m', 'django', 'bench_asgi', '--mode', mode,
+                '--requests', str(options['requests']), '--clients', str(options['clients']),
+            ]
+            if options['no_page_cache']:
+                command.append('--no-page-cache')
+            completed = subprocess.run(
+                command, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True
+            )
+            if completed.returncode:
+                raise CommandError(completed.stderr)
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']}: {result['requests']} запросов, "
+                f"{result['clients']} клиентов, {result['rps']:.0f} запросов/с, "
+                f"p50 {result['p50_ms']:.1f} мс, p99 {result['p99_ms']:.1f} мс"
+            )
+
+    def get_paths(self):
+        paths = [reverse('movie_list')]
+        genre = Genre.objects.first()
+        if genre is not None:
+            paths.append(f"{reverse('filter')}?genre={genre.pk}")
+        paths += [
+            movie.get_absolute_url()
+            for movie in Movie.objects.filter(draft=False).only('url')[:5]
+        ]
+        paths += [
+            reverse('filmcrew_detail', kwargs={'slug': slug})
+            for slug in FilmCrew.objects.values_list('slug', flat=True)[:3]
+        ]
+        return [iri_to_uri(path) for path in paths]
+
+    def run_mode(self, options):
+        if options['no_page_cache']:
+            ConditionalPageMixin.cache_response = False
+        paths = self.get_paths()
+        if not paths:
+            raise CommandError('Нет опубликованных фильмов')
+        schedule = [paths[i % len(paths)] for i in range(options['requests'])]
+        run = self.run_wsgi if options['mode'] == 'wsgi' else self.run_asgi
+        # прогрев кэшей и индексов; ошибки 404 или 500 быстрее
+        # обычных страниц и исказили бы результат
+        self.check_failures(run(paths, 1)[1])
+        started = time.perf_counter()
+        timings, failures = run(schedule, options['clients'])
+        elapsed = time.perf_counter() - started
+        self.check_failures(failures)
+        timings.sort()
+        return {
+            'mode': options['mode'],
+            'requests': len(schedule),
+            'clients': options['clients'],
+            'rps': len(schedule) / elapsed,
+            'p50_ms': timings[len(timings) // 2] * 1000,
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        }
+
+    def check_failures(self, failures):
+        if failures:
+            details = ', '.join(f'{path} ({status})' for path, status in sorted(set(failures)))
+            raise CommandError(f'Ответы не 2xx: {details}')
+
+    def run_wsgi(self, paths, clients):
+        handler = WSGIHandler()
+        factory = RequestFactory()
+        failures = []
+
+        def request(path):
+            environ = factory.get(path, HTTP_HOST=HOST).environ
+            # сервер WSGI передает путь байтами в iso-8859-1 (PEP 3333)
+            environ['PATH_INFO'] = environ['PATH_INFO'].encode().decode('iso-8859-1')
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: None)
+            b''.join(response)
+            response.close()
+            if not 200 <= response.status_code < 300:
+                failures.append((path, response.status_code))
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            timings = list(executor.map(request, paths))
+        return timings, failures
+
+    def run_asgi(self, paths, clients):
+        handler = ASGIHandler()
+
+        async def request(path):
+            url = urlsplit(path)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'root_path': '',
+                'path': unquote(url.path), 'raw_path': url.path.encode(),
+                'query_string': url.query.encode(),
+                'headers': [(b'host', HOST.encode())],
+                'client': ('127.0.0.1', 0), 'server': (HOST, 80),
+            }
+            sent = []
+
+            async def receive():
+                if not sent:
+                    sent.append(None)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # соединение не закрывается до конца ответа
+                await asyncio.Future()
+
+            status = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            return path, time.perf_counter() - started, status[0]
+
+        async def main():
+            queue = list(reversed(paths))
+            results = []
+
+            async def client():
+                while queue:
+                    results.append(await request(queue.pop()))
+
+            await asyncio.gather(*(client() for _ in range(clients)))
+            return results
+
+        results = asyncio.run(main())
+        failures = [
+            (path, status) for path, _, status in results if not 200 <= status < 300
+        ]
+        return [timing for _, timing, _ in results], failures
@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from movies.models import Movie, Rating
+from movies.ratings import RatingBuffer, write_votes
+
+IP_PREFIX = 'bench-'
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест приема оценок: голоса в секунду через буфер '
+        'или по одной транзакции на голос. Пишет в текущую базу, '
+        'тестовые голоса удаляются в конце'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--votes', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--addresses', type=int, default=5000)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--delay', type=float, default=1.0)
+        parser.add_argument(
+            '--unbuffered', action='store_true',
+            help='Отдельная транзакция на каждый голос для сравнения',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Не удалять голоса')
+
+    def handle(self, *args, **options):
+        movie_ids = list(
+            Movie.objects.filter(draft=False).values_list('pk', flat=True)[:100]
+        )
+        if not movie_ids:
+            raise CommandError('Нет опубликованных фильмов')
+        rnd = random.Random(options['seed'])
+        votes = [
+            (rnd.choice(movie_ids), f"{IP_PREFIX}{rnd.randrange(options['addresses'])}",
+             rnd.randint(1, 10))
+            for _ in range(options['votes'])
+        ]
+        clients = options['clients']
+        buffer = RatingBuffer(max_size=options['batch_size'], max_delay=options['delay'])
+        errors = []
+
+        def client(part):
+            try:
+                for movie_id, ip, rate in part:
+                    try:
+                        if options['unbuffered']:
+                            write_votes({(movie_id, ip): rate})
+                        else:
+                            buffer.add(movie_id, ip, rate)
+                    except OperationalError as error:
+                        errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=client, args=(votes[i::clients],))
+            for i in range(clients)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.flush()
+        elapsed = time.perf_counter() - started
+
+        mode = 'без буфера' if options['unbuffered'] else f"буфер {options['batch_size']}"
+        self.stdout.write(
+            f'{len(votes)} голосов, {clients} клиентов, {mode}: '
+            f'{elapsed:.2f} с, {len(votes) / elapsed:.0f} голосов/с, ошибок: {len(errors)}'
+        )
+        stored = Rating.objects.filter(ip__startswith=IP_PREFIX).count()
+        self.stdout.write(f'Записано уникальных голосов: {stored}')
+        if not options['keep']:
+            Rating.objects.filter(ip__startswith=IP_PREFIX).delete()
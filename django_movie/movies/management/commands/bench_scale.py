@@ -0,0 +1,215 @@
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from movies import synthetic
+from movies.models import Category, FilmCrew, Genre, Movie, MovieShot, Rating, Review
+
+HOST = 'localhost'
+
+
+def percentile(values, share):
+    """Значение с рангом share (0..1) в отсортированном списке"""
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0
+
+
+def summary(timings, queries):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+        'queries_mean': round(sum(queries) / len(queries), 1) if queries else 0,
+        'queries_max': max(queries, default=0),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Задержка p50/p95/p99, число запросов к базе и пик памяти для публичных '
+        'страниц и списков админки на каталогах разного размера. Каталоги '
+        'создаются generate_catalogue в отдельных файлах базы, результат — JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='',
+            help=f'Размеры через запятую ({", ".join(synthetic.SCALES)}), '
+                 'без параметра — текущая база',
+        )
+        parser.add_argument(
+            '--directory',
+            help='Где хранить базы каталогов для повторных запусков (по умолчанию временно)',
+        )
+        parser.add_argument('--requests', type=int, default=30, help='Запросов с прогретым кэшем')
+        parser.add_argument('--cold-requests', type=int, default=5, help='Запросов без кэша')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Файл для JSON, по умолчанию стандартный вывод')
+        parser.add_argument('--label', help='Название набора данных в результате')
+
+    def handle(self, *args, **options):
+        scales = [scale for scale in options['scales'].split(',') if scale]
+        unknown = set(scales) - set(synthetic.SCALES)
+        if unknown:
+            raise CommandError(f'Неизвестные размеры: {", ".join(sorted(unknown))}')
+        if scales:
+            results = self.run_scales(scales, options)
+        else:
+            results = [self.run_suite(options['label'] or 'current', options)]
+
+        report = json.dumps({
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'results': results,
+        }, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+            self.stderr.write(self.style.SUCCESS(f"Результат записан в {options['output']}"))
+        else:
+            self.stdout.write(report)
+
+    def run_scales(self, scales, options):
+        """Каждый размер — своя база, тест в отдельном процессе"""
+        with tempfile.TemporaryDirectory() as temporary:
+            directory = options['directory'] or temporary
+            os.makedirs(directory, exist_ok=True)
+            results = []
+            for scale in scales:
+                path = os.path.join(directory, f"catalogue-{scale}-{options['seed']}.sqlite3")
+                env = dict(os.environ, DJANGO_DB_PATH=path)
+                if not os.path.exists(path):
+                    self.stderr.write(f'Создание каталога {scale}: {path}')
+                    self.manage(env, 'migrate', '-v0')
+                    self.manage(
+                        env, 'generate_catalogue', '--scale', scale, '--seed', str(options['seed'])
+                    )
+                output = self.manage(
+                    env, 'bench_scale', '--label', scale,
+                    '--requests', str(options['requests']),
+                    '--cold-requests', str(options['cold_requests']),
+                )
+                results += json.loads(output)['results']
+            return results
+
+    def manage(self, env, *args):
+        completed = subprocess.run(
+            [sys.executable, '-m', 'django', *args],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if completed.returncode:
+            raise CommandError(completed.stderr)
+        return completed.stdout
+
+    def get_targets(self):
+        """(название, адрес): публичные страницы и списки админки"""
+        movie = Movie.objects.filter(draft=False).order_by('-review_count', 'id').first()
+        if movie is None:
+            raise CommandError('Нет опубликованных фильмов')
+        person = FilmCrew.objects.annotate(
+            films=Count('film_actors')
+        ).order_by('-films', 'id').only('slug').first()
+        genre = Genre.objects.order_by('id').first()
+        targets = [
+            ('movie_list', reverse('movie_list')),
+            ('filter', f"{reverse('filter')}?genre={genre.pk}&year_from=1990&year_to=2000"),
+            ('search', f"{reverse('search')}?q={movie.title.split()[0]}"),
+            ('movie_detail', movie.get_absolute_url()),
+            ('filmcrew_detail', person.get_absolute_url()),
+            ('api_movies', f"{reverse('api_movies')}?sort=rating&include=genres,director,actors"),
+            ('api_movie', reverse('api_movie', kwargs={'lookup': movie.url})),
+        ]
+        for model in admin.site._registry:
+            if model._meta.app_label == 'movies':
+                name = f'admin_{model._meta.model_name}'
+                targets.append((name, reverse(f'admin:movies_{model._meta.model_name}_changelist')))
+        return targets
+
+    def run_suite(self, label, options):
+        # как на сервере: без страницы отладки и журнала запросов
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [HOST]
+        user = get_user_model().objects.create_superuser(
+            f'bench-{get_random_string(8)}', 'bench@example.com', get_random_string(16)
+        )
+        try:
+            client = Client(HTTP_HOST=HOST)
+            client.force_login(user)
+            results = {
+                name: self.measure(client, url, options)
+                for name, url in self.get_targets()
+            }
+        finally:
+            client.logout()
+            user.delete()
+        return {
+            'label': label,
+            'counts': {
+                model._meta.model_name: model.objects.count()
+                for model in (Movie, FilmCrew, Genre, Category, MovieShot, Review, Rating)
+            },
+            'targets': results,
+        }
+
+    def request(self, client, url):
+        """(секунды, запросов к базе)"""
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        return elapsed, len(queries)
+
+    def measure(self, client, url, options):
+        cold = []
+        for _ in range(options['cold_requests']):
+            # без кэша: фрагменты, версии и индекс фильтров строятся заново
+            cache.clear()
+            cold.append(self.request(client, url))
+
+        cache.clear()
+        tracemalloc.start()
+        try:
+            self.request(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        warm = [self.request(client, url) for _ in range(options['requests'])]
+        return {
+            'url': url,
+            'cold': summary([t for t, _ in cold], [q for _, q in cold]),
+            'warm': summary([t for t, _ in warm], [q for _, q in warm]),
+            'peak_memory_kb': peak // 1024,
+        }
@@ -0,0 +1,201 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from django.utils.encoding import iri_to_uri
+
+from movies import sqlite
+from movies.models import Movie
+
+PROFILES = ('default', 'production')
+HOST = 'localhost'
+
+
+class Command(BaseCommand):
+    help = (
+        'Смешанная нагрузка на SQLite: страницы фильмов (MovieDetailView) и '
+        'отзывы (AddReview) из одновременных потоков, чтений и записей в '
+        'секунду и ошибок блокировки для стандартного и production-профиля. '
+        'Несколько процессов, как у сервера с несколькими обработчиками, '
+        'работают с отдельной копией базы для каждого профиля'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=3000)
+        parser.add_argument('--processes', type=int, default=4, help='Процессов-обработчиков')
+        parser.add_argument('--clients', type=int, default=4, help='Потоков в каждом процессе')
+        parser.add_argument(
+            '--write-ratio', type=float, default=0.2, help='Доля запросов с отзывом',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help='Результат в JSON')
+        # параметры процесса-обработчика
+        parser.add_argument('--profile', choices=PROFILES, help=argparse.SUPPRESS)
+        parser.add_argument('--database-file', help=argparse.SUPPRESS)
+        parser.add_argument('--worker', type=int, default=0, help=argparse.SUPPRESS)
+        parser.add_argument('--start-at', type=float, default=0, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['profile']:
+            self.stdout.write(json.dumps(self.run_worker(options)))
+            return
+
+        source = connections[DEFAULT_DB_ALIAS]
+        if source.vendor != 'sqlite':
+            raise CommandError('Поддерживается только SQLite')
+        source.ensure_connection()
+        results = []
+        # копии рядом с базой: на той же файловой системе, что и в работе
+        directory = os.path.dirname(os.path.abspath(source.settings_dict['NAME']))
+        with tempfile.TemporaryDirectory(dir=directory) as directory:
+            for profile in PROFILES:
+                path = os.path.join(directory, f'{profile}.sqlite3')
+                target = sqlite3.connect(path)
+                try:
+                    source.connection.backup(target)
+                    # режим журнала хранится в файле: копия начинает со стандартного
+                    target.execute('PRAGMA journal_mode = delete')
+                finally:
+                    target.close()
+                results.append(self.run_profile(profile, path, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                f"{result['profile']} ({result['pragmas'].get('journal_mode', '?')}): "
+                f"{result['reads_per_second']:.0f} чтений/с, "
+                f"{result['writes_per_second']:.0f} записей/с, "
+                f"p99 чтения {result['read_p99_ms']:.1f} мс, "
+                f"p99 записи {result['write_p99_ms']:.1f} мс, "
+                f"ошибок: {result['errors']} (database is locked: {result['locked']})"
+            )
+
+    def run_profile(self, profile, path, options):
+        """Процессы-обработчики одновременно нагружают одну копию базы"""
+        # запуск Django занимает время, нагрузка начинается у всех сразу
+        start_at = time.time() + 3 + options['processes'] * 0.5
+        workers = [
+            subprocess.Popen(
+                [
+                    sys.executable, '-m', 'django', 'bench_sqlite', '--profile', profile,
+                    '--database-file', path, '--worker', str(worker),
+                    '--processes', str(options['processes']),
+                    '--requests', str(options['requests']), '--clients', str(options['clients']),
+                    '--write-ratio', str(options['write_ratio']), '--seed', str(options['seed']),
+                    '--start-at', str(start_at),
+                ],
+                env=dict(os.environ, DJANGO_DB_PROFILE=profile), cwd=settings.BASE_DIR,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            )
+            for worker in range(options['processes'])
+        ]
+        parts = []
+        for worker in workers:
+            stdout, stderr = worker.communicate()
+            if worker.returncode:
+                raise CommandError(stderr)
+            parts.append(json.loads(stdout.strip().splitlines()[-1]))
+
+        elapsed = max(part['finished'] for part in parts) - start_at
+        result = {
+            'profile': profile,
+            'requests': options['requests'],
+            'processes': options['processes'],
+            'clients': options['clients'],
+            'seconds': elapsed,
+            'errors': sum(part['errors'] for part in parts),
+            'locked': sum(part['locked'] for part in parts),
+            'pragmas': parts[0]['pragmas'],
+        }
+        for kind in ('read', 'write'):
+            timings = sorted(timing for part in parts for timing in part[kind])
+            result[f'{kind}s_per_second'] = len(timings) / elapsed
+            result[f'{kind}_p99_ms'] = (
+                timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000 if timings else 0
+            )
+        return result
+
+    def run_worker(self, options):
+        # вся нагрузка идет в копию, основная база не меняется
+        connections.close_all()
+        settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'] = options['database_file']
+        # как на сервере: без страницы отладки и журнала запросов
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [HOST]
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        movies = list(Movie.objects.filter(draft=False).order_by('id').only('url')[:20])
+        if not movies:
+            raise CommandError('Нет опубликованных фильмов')
+        rnd = random.Random(options['seed'])
+        schedule = []
+        for _ in range(options['requests']):
+            movie = rnd.choice(movies)
+            if rnd.random() < options['write_ratio']:
+                schedule.append(('write', iri_to_uri(reverse('add_review', kwargs={'id': movie.pk}))))
+            else:
+                schedule.append(('read', iri_to_uri(movie.get_absolute_url())))
+        schedule = schedule[options['worker']::options['processes']]
+        pragmas = sqlite.get_pragmas(connections[DEFAULT_DB_ALIAS], [
+            'journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size',
+        ])
+        connections.close_all()
+
+        handler = WSGIHandler()
+        factory = RequestFactory()
+        token = get_random_string(32)
+        locked = []
+
+        def on_exception(sender, request=None, **kwargs):
+            if 'database is locked' in str(sys.exc_info()[1]):
+                locked.append(request)
+
+        def request(item):
+            kind, path = item
+            if kind == 'read':
+                environ = factory.get(path, HTTP_HOST=HOST).environ
+            else:
+                environ = factory.post(path, {
+                    'name': 'bench', 'email': 'bench@example.com', 'text': 'Отзыв',
+                }, HTTP_HOST=HOST, HTTP_X_CSRFTOKEN=token).environ
+                environ['HTTP_COOKIE'] = f'{settings.CSRF_COOKIE_NAME}={token}'
+            # сервер WSGI передает путь байтами в iso-8859-1 (PEP 3333)
+            environ['PATH_INFO'] = environ['PATH_INFO'].encode().decode('iso-8859-1')
+            status = []
+            started = time.perf_counter()
+            response = handler(environ, lambda value, headers: status.append(value))
+            b''.join(response)
+            response.close()
+            ok = status[0].startswith('200' if kind == 'read' else '302')
+            return kind, time.perf_counter() - started, ok
+
+        got_request_exception.connect(on_exception)
+        time.sleep(max(0, options['start_at'] - time.time()))
+        with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+            results = list(executor.map(request, schedule))
+        return {
+            'finished': time.time(),
+            'errors': sum(not ok for _, _, ok in results),
+            'locked': len(locked),
+            'pragmas': pragmas,
+            'read': [timing for kind, timing, ok in results if kind == 'read' and ok],
+            'write': [timing for kind, timing, ok in results if kind == 'write' and ok],
+        }
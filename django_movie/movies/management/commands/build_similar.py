@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies import similar
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие фильмы для всех опубликованных фильмов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество фильмов в одной записи',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = similar.build(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие фильмы посчитаны для {total} фильмов за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,56 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from movies import thumbnails, versions
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии всех изображений в MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Количество процессов',
+        )
+
+    def sources(self, root):
+        for directory, subdirs, files in os.walk(root):
+            if directory == root and thumbnails.DIRECTORY in subdirs:
+                subdirs.remove(thumbnails.DIRECTORY)
+            for filename in files:
+                if filename.lower().endswith(thumbnails.IMAGE_EXTENSIONS):
+                    yield os.path.join(directory, filename)
+
+    def handle(self, *args, **options):
+        root = str(settings.MEDIA_ROOT)
+        started = time.monotonic()
+        created = skipped = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(thumbnails.render, path, root): path
+                for path in self.sources(root)
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    _, built = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{os.path.relpath(path, root)}: {e}')
+                    continue
+                if built:
+                    created += 1
+                else:
+                    skipped += 1
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                cache.delete(thumbnails.cache_key(name))
+        versions.bump('movie', 'filmcrew', 'movieshot')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано: {created}, уже были: {skipped}, ошибок: {failed} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
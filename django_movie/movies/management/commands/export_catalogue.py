@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import export
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка каталога фильмов в NDJSON или JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Файл выгрузки, по умолчанию стандартный вывод')
+        parser.add_argument(
+            '--since',
+            help='Только фильмы, измененные с этого времени (ISO 8601, unix time '
+                 'или версия предыдущей выгрузки); снятые с публикации и удаленные '
+                 'выгружаются с "removed": true',
+        )
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--drafts', action='store_true', help='Включить черновики')
+        parser.add_argument('--batch-size', type=int, default=export.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = export.parse_since(options['since'])
+        except ValueError as e:
+            raise CommandError(e)
+        version = export.get_version()
+        started = time.monotonic()
+        lines = export.stream(
+            since, drafts=options['drafts'], file_format=options['format'],
+            batch_size=options['batch_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                count = self.write(f.write, lines)
+        else:
+            count = self.write(lambda line: self.stdout.write(line, ending=''), lines)
+        if options['format'] == 'json':
+            # последняя строка только закрывает массив
+            count -= 1
+        # стандартный вывод может быть самой выгрузкой, итог пишется в stderr
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено фильмов: {count} за {time.monotonic() - started:.1f} с. '
+            f'Следующая выгрузка: --since {version}'
+        ))
+
+    def write(self, write, lines):
+        count = 0
+        for line in lines:
+            write(line)
+            count += 1
+        return count
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        'Синтетический каталог заданного размера: фильмы, съемочная группа, жанры, '
+        'кадры, отзывы с ответами и оценки. Один размер и seed дают один каталог, '
+        'повторный запуск пропускает уже созданные фильмы'
+    )
+
+    def add_arguments(self, parser):
+        size = parser.add_mutually_exclusive_group(required=True)
+        size.add_argument('--scale', choices=list(synthetic.SCALES), help='Готовый размер')
+        size.add_argument('--movies', type=int, help='Количество фильмов')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество фильмов в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        count = synthetic.SCALES[options['scale']] if options['scale'] else options['movies']
+        if count < 1:
+            raise CommandError('Нужен хотя бы один фильм')
+        started = time.monotonic()
+
+        def progress(generator):
+            if generator.processed % (generator.batch_size * 10) and generator.processed != count:
+                return
+            self.stdout.write(
+                f'{generator.processed} из {count}: добавлено {generator.importer.created}, '
+                f'{generator.processed / (time.monotonic() - started):.0f} фильмов/с'
+            )
+
+        generator = synthetic.CatalogueGenerator(
+            count, seed=options['seed'], batch_size=options['batch_size']
+        )
+        generator.run(on_batch=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано фильмов: {generator.importer.created}, '
+            f'пропущено: {generator.importer.skipped} за {time.monotonic() - started:.1f} с'
+        ))
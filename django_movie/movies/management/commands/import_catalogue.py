@@ -0,0 +1,66 @@
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import catalogue
+
+READERS = {'csv': catalogue.read_csv, 'jsonl': catalogue.read_jsonl}
+
+
+class Command(BaseCommand):
+    help = (
+        'Импорт каталога фильмов из CSV или JSONL пачками. '
+        'Фильмы с уже существующим url пропускаются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл каталога, "-" — стандартный ввод')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат файла, по умолчанию по расширению',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество фильмов в одной транзакции',
+        )
+        parser.add_argument('--encoding', default='utf-8')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError('Укажите --format csv или --format jsonl')
+        if path == '-':
+            self.load(sys.stdin, file_format, options)
+            return
+        try:
+            # newline='' нужен модулю csv для строк с переводами строк внутри
+            with open(path, encoding=options['encoding'], newline='') as f:
+                self.load(f, file_format, options)
+        except OSError as e:
+            raise CommandError(e)
+
+    def load(self, lines, file_format, options):
+        importer = catalogue.CatalogueImporter(
+            on_error=lambda number, message: self.stderr.write(f'Строка {number}: {message}')
+        )
+        records = READERS[file_format](lines)
+        started = time.monotonic()
+        processed = 0
+        while batch := list(islice(records, options['batch_size'])):
+            importer.add_batch(batch)
+            processed += len(batch)
+            self.stdout.write(
+                f'{processed} записей: добавлено {importer.created}, '
+                f'пропущено {importer.skipped}, ошибок {importer.failed}, '
+                f'{processed / (time.monotonic() - started):.0f} записей/с'
+            )
+        importer.finish()
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано фильмов: {importer.created}, пропущено: {importer.skipped}, '
+            f'ошибок: {importer.failed} за {time.monotonic() - started:.1f} с'
+        ))
+        if importer.created:
+            self.stdout.write('Уменьшенные копии изображений: manage.py build_thumbnails')
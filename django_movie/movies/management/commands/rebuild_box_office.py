@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies import boxoffice
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает кассовые сборы опубликованных фильмов по всем разрезам'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = boxoffice.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Посчитано строк: {total} за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс фильмов и съемочной группы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество записей в одной вставке',
+        )
+
+    def handle(self, *args, **options):
+        if search.tokenizer() is None:
+            self.stderr.write('Таблица FTS5 недоступна, используется поиск без индекса')
+            return
+        started = time.monotonic()
+        total = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано записей: {total} за {time.monotonic() - started:.1f} с'
+        ))
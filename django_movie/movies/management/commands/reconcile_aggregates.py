@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies import aggregates
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает агрегаты оценок и отзывов фильмов и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество фильмов в одной пачке',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать число расхождений',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        checked, fixed = aggregates.reconcile(
+            batch_size=options['batch_size'], dry_run=options['dry_run']
+        )
+        action = 'Найдено расхождений' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено фильмов: {checked}, {action.lower()}: {fixed} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
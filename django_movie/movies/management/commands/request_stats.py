@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies import instrumentation
+
+
+class Command(BaseCommand):
+    help = (
+        'Время ответа по именам адресов из общего кэша: число запросов, среднее, '
+        'p50/p95/p99 по интервалам гистограммы и среднее число SQL-запросов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Результат в JSON')
+        parser.add_argument('--reset', action='store_true', help='Очистить после вывода')
+
+    def handle(self, *args, **options):
+        if not instrumentation.is_shared():
+            raise CommandError(
+                'Кэш по умолчанию у каждого процесса свой, гистограммы серверных '
+                'процессов отсюда не видны: нужен общий кэш, например '
+                'movies.instrumentation.RedisCache'
+            )
+        stats = instrumentation.histograms()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2, ensure_ascii=False))
+        elif not stats:
+            self.stdout.write('Запросов еще не было')
+        else:
+            width = max(len(name) for name in stats)
+            for name, row in sorted(stats.items(), key=lambda item: -item[1]['count']):
+                percentiles = ' '.join(
+                    f"{key[:-3]} {'≤' + str(row[key]) if row[key] else '>' + str(instrumentation.BUCKETS[-1])}"
+                    for key in ('p50_ms', 'p95_ms', 'p99_ms')
+                )
+                self.stdout.write(
+                    f"{name:<{width}}  {row['count']:>7}  среднее {row['mean_ms']:>8.1f} мс  "
+                    f"{percentiles} мс  SQL {row['mean_queries']:.1f}"
+                )
+        if options['reset']:
+            instrumentation.reset()
+            self.stderr.write(self.style.SUCCESS('Статистика очищена'))
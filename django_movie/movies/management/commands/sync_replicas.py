@@ -0,0 +1,49 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from movies import routers
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в файлы реплик (settings.DATABASE_REPLICAS). '
+        'Замена репликации для локальной проверки: с --interval копирует '
+        'периодически, отставание реплик равно интервалу'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять каждые N секунд (0 — один раз)',
+        )
+
+    def handle(self, *args, **options):
+        replicas = routers.get_replicas()
+        if not replicas:
+            raise CommandError('Реплики не настроены: задайте DJANGO_DB_REPLICAS')
+        primary = connections[routers.PRIMARY]
+        for alias in [routers.PRIMARY, *replicas]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias}: поддерживается только SQLite')
+
+        while True:
+            started = time.monotonic()
+            primary.ensure_connection()
+            for alias in replicas:
+                # открытое соединение с репликой увидит новый файл после переподключения
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    # онлайн-копия: страницы, измененные во время копирования, копируются заново
+                    primary.connection.backup(target)
+                finally:
+                    target.close()
+            self.stdout.write(self.style.SUCCESS(
+                f'Реплик обновлено: {len(replicas)} за {time.monotonic() - started:.2f} с'
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+PATH_STEP = 10
+
+
+def fill_paths(apps, schema_editor):
+    """Материализованные пути для уже существующих отзывов"""
+    Review = apps.get_model('movies', 'Review')
+    reviews = list(Review.objects.only('id', 'parent_id'))
+    parents = {review.id: review.parent_id for review in reviews}
+    paths = {}
+
+    def path_of(review_id):
+        if review_id not in paths:
+            parent_id = parents.get(review_id)
+            prefix = path_of(parent_id) if parent_id in parents else ''
+            paths[review_id] = f'{prefix}{review_id:0{PATH_STEP}d}/'
+        return paths[review_id]
+
+    for review in reviews:
+        review.path = path_of(review.id)
+    Review.objects.bulk_update(reviews, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_alter_movie_world_premiere'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255, verbose_name='Путь в дереве'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'path'], name='review_movie_path_idx'),
+        ),
+    ]
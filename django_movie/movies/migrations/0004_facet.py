@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:27
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_facets(apps, schema_editor):
+    """Начальное заполнение индекса фильтров"""
+    Facet = apps.get_model('movies', 'Facet')
+    Movie = apps.get_model('movies', 'Movie')
+    Genre = apps.get_model('movies', 'Genre')
+    facets = [
+        Facet(kind='year', value=str(year), label=str(year), count=count)
+        for year, count in Movie.objects.filter(draft=False)
+        .values_list('year').annotate(count=Count('id'))
+    ]
+    counts = dict(
+        Movie.genres.through.objects.filter(movie__draft=False)
+        .values_list('genre_id').annotate(count=Count('id'))
+    )
+    facets += [
+        Facet(kind='genre', value=str(genre.id), label=genre.name,
+              count=counts[genre.id])
+        for genre in Genre.objects.filter(id__in=counts)
+    ]
+    Facet.objects.bulk_create(facets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_review_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Facet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('year', 'Год'), ('genre', 'Жанр')], max_length=20, verbose_name='Фильтр')),
+                ('value', models.CharField(max_length=160, verbose_name='Значение')),
+                ('label', models.CharField(max_length=160, verbose_name='Название')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Опубликованных фильмов')),
+            ],
+            options={
+                'verbose_name': 'Значение фильтра',
+                'verbose_name_plural': 'Значения фильтров',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='facet',
+            constraint=models.UniqueConstraint(fields=('kind', 'value'), name='facet_kind_value_unique'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations, transaction
+from django.db.utils import OperationalError
+from django.utils.html import strip_tags
+
+
+TOKENIZERS = ("trigram", "unicode61 remove_diacritics 2")
+
+
+def create_search_table(apps, schema_editor):
+    """Таблица FTS5 для поиска, если SQLite собран с ее поддержкой"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for tokenize in TOKENIZERS:
+            try:
+                with transaction.atomic(using=connection.alias):
+                    cursor.execute(
+                        "CREATE VIRTUAL TABLE movies_search USING fts5("
+                        "kind UNINDEXED, object_id UNINDEXED, title, body, "
+                        f"tokenize = '{tokenize}')"
+                    )
+                break
+            except OperationalError:
+                continue
+        else:
+            return
+
+        Movie = apps.get_model('movies', 'Movie')
+        FilmCrew = apps.get_model('movies', 'FilmCrew')
+        rows = [
+            ('movie', movie.id, movie.title,
+             f'{movie.tagline} {strip_tags(movie.description)}')
+            for movie in Movie.objects.all()
+        ] + [
+            ('crew', person.id, person.name, strip_tags(person.description))
+            for person in FilmCrew.objects.all()
+        ]
+        cursor.executemany(
+            "INSERT INTO movies_search (kind, object_id, title, body) "
+            "VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS movies_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_facet'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:32
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_aggregates(apps, schema_editor):
+    """Начальные значения агрегатов оценок и отзывов"""
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    Review = apps.get_model('movies', 'Review')
+    histograms = defaultdict(dict)
+    rows = (
+        Rating.objects.filter(rate__isnull=False)
+        .values_list('movie_id', 'rate').annotate(count=Count('id'))
+        .order_by('movie_id', 'rate')
+    )
+    for movie_id, rate, count in rows:
+        histograms[movie_id][str(rate)] = count
+    reviews = dict(
+        Review.objects.values_list('movie_id').annotate(count=Count('id')).order_by()
+    )
+    movies = list(Movie.objects.filter(pk__in=set(histograms) | set(reviews)))
+    for movie in movies:
+        histogram = histograms.get(movie.pk, {})
+        movie.rating_histogram = histogram
+        movie.rating_count = sum(histogram.values())
+        movie.rating_sum = sum(int(rate) * count for rate, count in histogram.items())
+        movie.rating_avg = (
+            round(movie.rating_sum / movie.rating_count, 2) if movie.rating_count else 0
+        )
+        movie.review_count = reviews.get(movie.pk, 0)
+    Movie.objects.bulk_update(movies, [
+        'rating_count', 'rating_sum', 'rating_avg', 'rating_histogram', 'review_count'
+    ], batch_size=500)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_histogram',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Распределение оценок'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['rating_avg', 'id'], name='movie_rating_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:33
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Оставляет последний голос для каждой пары фильм/адрес и
+    пересчитывает агрегаты оценок затронутых фильмов (0006 заполнила
+    их еще с повторными голосами)"""
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    duplicates = (
+        Rating.objects.values('movie_id', 'ip')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    movie_ids = set()
+    for row in duplicates:
+        Rating.objects.filter(movie_id=row['movie_id'], ip=row['ip']).exclude(
+            id=row['last_id']
+        ).delete()
+        movie_ids.add(row['movie_id'])
+    if not movie_ids:
+        return
+
+    histograms = defaultdict(dict)
+    rows = (
+        Rating.objects.filter(movie_id__in=movie_ids, rate__isnull=False)
+        .values_list('movie_id', 'rate').annotate(count=Count('id'))
+        .order_by('movie_id', 'rate')
+    )
+    for movie_id, rate, count in rows:
+        histograms[movie_id][str(rate)] = count
+    movies = list(Movie.objects.filter(pk__in=movie_ids))
+    for movie in movies:
+        histogram = histograms.get(movie.pk, {})
+        movie.rating_histogram = histogram
+        movie.rating_count = sum(histogram.values())
+        movie.rating_sum = sum(int(rate) * count for rate, count in histogram.items())
+        movie.rating_avg = (
+            round(movie.rating_sum / movie.rating_count, 2) if movie.rating_count else 0
+        )
+    Movie.objects.bulk_update(movies, [
+        'rating_count', 'rating_sum', 'rating_avg', 'rating_histogram'
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_movie_aggregates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rating',
+            name='ip',
+            field=models.CharField(max_length=45, verbose_name='IP адрес'),
+        ),
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('movie', 'ip'), name='rating_movie_ip_unique'),
+        ),
+    ]
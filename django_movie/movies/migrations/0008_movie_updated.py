@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_rating_unique_ip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, verbose_name='Изменен'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['updated', 'id'], name='movie_updated_idx'),
+        ),
+    ]
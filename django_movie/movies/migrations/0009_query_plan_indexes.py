@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_movie_updated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filmcrew',
+            index=models.Index(fields=['name'], name='filmcrew_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(('draft', False)), fields=['id'], name='movie_published_idx'),
+        ),
+    ]
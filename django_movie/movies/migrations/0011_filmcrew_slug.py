@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:20
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def fill_slugs(apps, schema_editor):
+    """Адреса существующих людей из имен; однофамильцы получают номер"""
+    FilmCrew = apps.get_model('movies', 'FilmCrew')
+    people = list(FilmCrew.objects.order_by('id').only('id', 'name'))
+    taken = set()
+    for person in people:
+        base = slugify(person.name, allow_unicode=True)[:150] or 'person'
+        slug, number = base, 1
+        while slug in taken:
+            number += 1
+            slug = f'{base}-{number}'
+        taken.add(slug)
+        person.slug = slug
+    FilmCrew.objects.bulk_update(people, ['slug'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0010_admin_search_indexes'),
+    ]
+
+    operations = [
+        # сначала без уникальности: у существующих строк адресов еще нет
+        migrations.AddField(
+            model_name='filmcrew',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, blank=True, max_length=160, null=True, verbose_name='Адрес'),
+        ),
+        migrations.RunPython(fill_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='filmcrew',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, blank=True, max_length=160, unique=True, verbose_name='Адрес'),
+        ),
+    ]
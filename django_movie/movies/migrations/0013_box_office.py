@@ -0,0 +1,88 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:36
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+SUMS = ('movies', 'budget', 'fees_in_usa', 'fees_in_the_world', 'budgeted_fees')
+
+
+def fill_box_office(apps, schema_editor):
+    """Начальный расчет кассовых сборов по разрезам"""
+    BoxOffice = apps.get_model('movies', 'BoxOffice')
+    Movie = apps.get_model('movies', 'Movie')
+    Genre = apps.get_model('movies', 'Genre')
+    Category = apps.get_model('movies', 'Category')
+
+    def sums(prefix=''):
+        return {
+            'sum_movies': Count(f'{prefix}id'),
+            'sum_budget': Sum(f'{prefix}budget', default=0),
+            'sum_fees_in_usa': Sum(f'{prefix}fees_in_usa', default=0),
+            'sum_fees_in_the_world': Sum(f'{prefix}fees_in_the_world', default=0),
+            'sum_budgeted_fees': Sum(
+                f'{prefix}fees_in_the_world', filter=Q(**{f'{prefix}budget__gt': 0}), default=0
+            ),
+        }
+
+    movies = Movie.objects.filter(draft=False).order_by()
+    genres = Movie.genres.through.objects.filter(movie__draft=False).order_by()
+    labels = {
+        'genre': dict(Genre.objects.values_list('id', 'name')),
+        'category': dict(Category.objects.values_list('id', 'name')),
+    }
+    rows = []
+    for kind, queryset, column, prefix in (
+        ('year', movies, 'year', ''),
+        ('genre', genres, 'genre_id', 'movie__'),
+        ('country', movies, 'country', ''),
+        ('category', movies, 'category_id', ''),
+    ):
+        for row in queryset.values(column).annotate(**sums(prefix)):
+            value = row[column]
+            if value is not None:
+                label = labels.get(kind, {}).get(value, str(value))
+                rows.append(BoxOffice(
+                    kind=kind, value=str(value), label=label,
+                    **{name: row[f'sum_{name}'] for name in SUMS},
+                ))
+    rows.append(BoxOffice(kind='total', value='', label='Всего', **{
+        name: sum(getattr(row, name) for row in rows if row.kind == 'year') for name in SUMS
+    }))
+    BoxOffice.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0012_similar_movie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoxOffice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('total', 'Всего'), ('year', 'Год'), ('genre', 'Жанр'), ('country', 'Страна'), ('category', 'Категория')], max_length=20, verbose_name='Разрез')),
+                ('value', models.CharField(max_length=160, verbose_name='Значение')),
+                ('label', models.CharField(max_length=160, verbose_name='Название')),
+                ('movies', models.PositiveIntegerField(default=0, verbose_name='Фильмов')),
+                ('budget', models.PositiveBigIntegerField(default=0, verbose_name='Бюджет')),
+                ('fees_in_usa', models.PositiveBigIntegerField(default=0, verbose_name='Сборы в США')),
+                ('fees_in_the_world', models.PositiveBigIntegerField(default=0, verbose_name='Сборы в мире')),
+                ('budgeted_fees', models.PositiveBigIntegerField(default=0, verbose_name='Сборы фильмов с бюджетом')),
+            ],
+            options={
+                'verbose_name': 'Кассовые сборы',
+                'verbose_name_plural': 'Кассовые сборы',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['country'], name='movie_country_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='boxoffice',
+            constraint=models.UniqueConstraint(fields=('kind', 'value'), name='box_office_kind_value_unique'),
+        ),
+        migrations.RunPython(fill_box_office, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0013_box_office'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedMovie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movie_id', models.PositiveIntegerField(verbose_name='id фильма')),
+                ('url', models.SlugField(db_index=False, max_length=160)),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Удален')),
+            ],
+            options={
+                'verbose_name': 'Удаленный фильм',
+                'verbose_name_plural': 'Удаленные фильмы',
+                'indexes': [models.Index(fields=['deleted', 'id'], name='deleted_movie_deleted_idx')],
+            },
+        ),
+    ]
@@ -1,7 +1,12 @@
 from datetime import date
 
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
 
 
 class Category(models.Model):
@@ -18,9 +23,35 @@ class Category(models.Model):
         return self.name
 
 
+def unique_slugs(queryset, values, default='item'):
+    """Адреса из values (в том же порядке), не занятые в queryset и друг
+    другом: при совпадении добавляется номер, "-2", "-3" и т. д."""
+    bases = [slugify(value, allow_unicode=True)[:150] or default for value in values]
+    slugs = [None] * len(values)
+    pending = dict(enumerate(bases))
+    taken = set()
+    number = 1
+    while pending:
+        taken.update(
+            queryset.filter(slug__in=set(pending.values())).values_list('slug', flat=True)
+        )
+        conflicts = []
+        for index, slug in pending.items():
+            if slug in taken:
+                conflicts.append(index)
+            else:
+                taken.add(slug)
+                slugs[index] = slug
+        number += 1
+        pending = {index: f'{bases[index]}-{number}' for index in conflicts}
+    return slugs
+
+
 class FilmCrew(models.Model):
     """ Съемочная группа """
     name = models.CharField('Имя', max_length=50)
+    # адрес страницы; пустой заполняется из имени при сохранении
+    slug = models.SlugField('Адрес', max_length=160, unique=True, allow_unicode=True, blank=True)
     age = models.PositiveSmallIntegerField('Возраст', default=0)
     description = models.TextField('Описание')
     image = models.ImageField('Изображение', upload_to='crew/')
@@ -28,9 +59,18 @@ class FilmCrew(models.Model):
     class Meta:
         verbose_name = "Съемочная группа"
         verbose_name_plural = "Съемочная группа"
+        indexes = [
+            # импорт каталога ищет людей по имени
+            models.Index(fields=['name'], name='filmcrew_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = unique_slugs(FilmCrew.objects.all(), [self.name], 'person')[0]
+        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
-        return reverse('filmcrew_detail', kwargs={"slug": self.name})
+        return reverse('filmcrew_detail', kwargs={"slug": self.slug})
 
     def __str__(self):
         return self.name
@@ -53,6 +93,22 @@ class Genre(models.Model):
         return reverse("Genre_detail", kwargs={"pk": self.pk})
 
 
+class MovieQuerySet(models.QuerySet):
+    """ Выборки фильмов """
+
+    def with_detail(self):
+        """Фильм вместе со съемочной группой, жанрами и кадрами
+        за фиксированное число запросов"""
+        return self.select_related('category').prefetch_related(
+            'director', 'actors', 'genres', 'movieshot_set',
+        )
+
+    def touch(self):
+        """Отмечает фильмы измененными для инкрементальной выгрузки
+        (update() и изменения связей не обновляют auto_now)"""
+        return self.update(updated=timezone.now())
+
+
 class Movie(models.Model):
     """ Фильм """
     title = models.CharField('Название', max_length=100)
@@ -84,19 +140,67 @@ class Movie(models.Model):
     url = models.SlugField(max_length=160, unique=True)
     draft = models.BooleanField('Черновик', default=False)
 
+    # агрегаты оценок и отзывов, обновляются вместе с записью оценки/отзыва
+    rating_count = models.PositiveIntegerField(
+        'Количество оценок', default=0, editable=False
+    )
+    rating_sum = models.PositiveIntegerField(
+        'Сумма оценок', default=0, editable=False
+    )
+    rating_avg = models.FloatField('Средняя оценка', default=0, editable=False)
+    rating_histogram = models.JSONField(
+        'Распределение оценок', default=dict, editable=False
+    )
+    review_count = models.PositiveIntegerField(
+        'Количество отзывов', default=0, editable=False
+    )
+    # время последнего изменения фильма, его связей или агрегатов
+    updated = models.DateTimeField('Изменен', auto_now=True)
+
+    # пишутся только movies.aggregates, save() их не сохраняет
+    AGGREGATE_FIELDS = (
+        'rating_count', 'rating_sum', 'rating_avg', 'rating_histogram', 'review_count'
+    )
+
+    objects = MovieQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Фильм'
         verbose_name_plural = 'Фильмы'
+        indexes = [
+            models.Index(fields=['rating_avg', 'id'], name='movie_rating_idx'),
+            models.Index(fields=['updated', 'id'], name='movie_updated_idx'),
+            # значения фильтра по году в админке
+            models.Index(fields=['year'], name='movie_year_idx'),
+            # пересчет кассовых сборов по стране (movies.boxoffice)
+            models.Index(fields=['country'], name='movie_country_idx'),
+            # опубликованные фильмы по id: условие NOT draft не использует
+            # обычный индекс, частичный подходит по совпадению условия
+            models.Index(
+                fields=['id'], condition=models.Q(draft=False), name='movie_published_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # агрегаты в памяти могли устареть с загрузки фильма: оценки и
+        # отзывы, поданные за это время, не должны затираться
+        if (not self._state.adding and not args and not kwargs.get('force_insert') and
+                kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in self.AGGREGATE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse("movie_detail", kwargs={"slug": self.url})
 
     # получение отзыва о фильме без родительских записей
     def get_review(self):
-        return self.review_set.filter(parent__isnull=True)
+        return self.review_set.filter(parent__isnull=True).order_by('path')
 
 
 class MovieShot(models.Model):
@@ -133,7 +237,7 @@ class Rating(models.Model):
         (9, '9'),
         (10, '10'),
     )
-    ip = models.CharField('IP адрес', max_length=16)
+    ip = models.CharField('IP адрес', max_length=45)
     rate = models.PositiveSmallIntegerField(choices=RATE_CHOICES, null=True)
     movie = models.ForeignKey(
         Movie, verbose_name='Фильм', on_delete=models.CASCADE)
@@ -141,16 +245,87 @@ class Rating(models.Model):
     class Meta:
         verbose_name = 'Рейтинг'
         verbose_name_plural = 'Рейтинги'
+        constraints = [
+            # один голос с адреса, повторный заменяет прежний
+            models.UniqueConstraint(fields=['movie', 'ip'], name='rating_movie_ip_unique'),
+        ]
+        indexes = [
+            # поиск в админке по началу адреса
+            models.Index(fields=['ip'], name='rating_ip_idx'),
+        ]
 
     def __str__(self):
-        return self.name
+        return f'{self.rate} - {self.movie_id}'
 
     def get_absolute_url(self):
         return reverse("Rating_detail", kwargs={"pk": self.pk})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # прежняя оценка нужна для пересчета агрегатов фильма
+        instance._loaded_rate = instance.__dict__.get('rate')
+        instance._loaded_movie_id = instance.__dict__.get('movie_id')
+        return instance
+
+
+class ReviewQuerySet(models.QuerySet):
+    """ Выборки отзывов по дереву """
+
+    def thread(self, movie):
+        """Все отзывы к фильму в порядке обхода дерева"""
+        return self.filter(movie=movie).order_by('path')
+
+    def subtree(self, review):
+        """Отзыв со всеми ответами на любой глубине"""
+        return self.filter(
+            movie_id=review.movie_id,
+            path__gte=review.path,
+            path__lt=Review.path_upper_bound(review.path),
+        ).order_by('path')
+
+    def thread_roots(self, movie, after, limit):
+        return (
+            self.filter(movie=movie, parent__isnull=True, path__gt=after)
+            .order_by('path')
+            .values_list('path', flat=True)[:limit + 1]
+        )
+
+    def thread_reviews(self, movie, roots):
+        return self.filter(
+            movie=movie,
+            path__gte=roots[0],
+            path__lt=Review.path_upper_bound(roots[-1]),
+        ).order_by('path')
+
+    def thread_page(self, movie, after='', limit=20):
+        """Страница веток обсуждения: `limit` отзывов верхнего уровня
+        после `after` вместе со всеми ответами.
+
+        Возвращает список отзывов в порядке обхода дерева и путь,
+        с которого начинается следующая страница (или None)"""
+        roots = list(self.thread_roots(movie, after, limit))
+        if not roots:
+            return [], None
+        next_after = roots[limit - 1] if len(roots) > limit else None
+        reviews = list(self.thread_reviews(movie, roots[:limit]))
+        return reviews, next_after
+
+    async def athread_page(self, movie, after='', limit=20):
+        """Асинхронный вариант thread_page"""
+        roots = [path async for path in self.thread_roots(movie, after, limit)]
+        if not roots:
+            return [], None
+        next_after = roots[limit - 1] if len(roots) > limit else None
+        reviews = [review async for review in self.thread_reviews(movie, roots[:limit])]
+        return reviews, next_after
+
 
 class Review(models.Model):
     """ Отзыв """
+    # число цифр в одном сегменте пути
+    PATH_STEP = 10
+
     email = models.EmailField()
     name = models.CharField('Имя', max_length=100)
     text = models.TextField('Текст', max_length=5000)
@@ -160,13 +335,208 @@ class Review(models.Model):
     movie = models.ForeignKey(
         Movie, verbose_name='Фильм', on_delete=models.CASCADE
     )
+    # материализованный путь: id предков и самого отзыва через "/"
+    path = models.CharField(
+        'Путь в дереве', max_length=255, default='', editable=False
+    )
+
+    objects = ReviewQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
+        indexes = [
+            models.Index(fields=['movie', 'path'], name='review_movie_path_idx'),
+            # поиск в админке по началу адреса
+            models.Index(fields=['email'], name='review_email_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
         return reverse("Review_detail", kwargs={"pk": self.pk})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # запоминаем родителя, чтобы при смене перенести ветку
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    @property
+    def depth(self):
+        """Уровень вложенности, у отзывов верхнего уровня 0"""
+        return max(len(self.path) // (self.PATH_STEP + 1) - 1, 0)
+
+    @staticmethod
+    def path_upper_bound(path):
+        """Граница диапазона ветки: "/" меньше любой цифры,
+        поэтому все пути ветки лежат в [path, path[:-1] + "0")"""
+        return path[:-1] + '0'
+
+    def clean(self):
+        if self.parent_id and self.pk:
+            parent_path = self.parent.path
+            if self.path and parent_path.startswith(self.path):
+                raise ValidationError(
+                    {'parent': 'Отзыв не может отвечать на свой ответ'}
+                )
+
+    def save(self, *args, **kwargs):
+        moved = (
+            self.path and
+            self.parent_id != getattr(self, '_loaded_parent_id', self.parent_id)
+        )
+        super().save(*args, **kwargs)
+        if not self.path or moved:
+            parent_path = self.parent.path if self.parent_id else ''
+            self.move_subtree(f'{parent_path}{self.pk:0{self.PATH_STEP}d}/')
+        self._loaded_parent_id = self.parent_id
+
+    def move_subtree(self, new_path):
+        """Переписывает путь отзыва и всех ответов на него"""
+        if self.path:
+            Review.objects.subtree(self).update(
+                path=Concat(Value(new_path), Substr('path', len(self.path) + 1))
+            )
+        else:
+            Review.objects.filter(pk=self.pk).update(path=new_path)
+        self.path = new_path
+
+    def detach_replies(self):
+        """Поднимает ответы на уровень выше удаляемого отзыва:
+        родитель у них обнуляется, ветки становятся верхнего уровня"""
+        # при удалении нескольких отзывов одной ветки путь в памяти мог
+        # устареть: его уже переписал отзыв, удаляемый раньше
+        self.path = Review.objects.values_list('path', flat=True).get(pk=self.pk)
+        Review.objects.subtree(self).exclude(pk=self.pk).update(
+            path=Substr('path', len(self.path) + 1)
+        )
+
+    @staticmethod
+    def build_tree(reviews):
+        """Раскладывает список отзывов по родителям без
+        дополнительных запросов, возвращает отзывы верхнего уровня"""
+        reviews = list(reviews)
+        by_id = {review.id: review for review in reviews}
+        roots = []
+        for review in reviews:
+            review.replies = []
+        for review in reviews:
+            parent = by_id.get(review.parent_id)
+            if parent is None:
+                roots.append(review)
+            else:
+                parent.replies.append(review)
+        return roots
+
+
+class SimilarMovie(models.Model):
+    """ Похожий фильм (movies.similar) """
+    movie = models.ForeignKey(
+        Movie, verbose_name='Фильм', on_delete=models.CASCADE, related_name='similar_links'
+    )
+    similar = models.ForeignKey(
+        Movie, verbose_name='Похожий фильм', on_delete=models.CASCADE, related_name='+'
+    )
+    score = models.FloatField('Сходство')
+    rank = models.PositiveSmallIntegerField('Место')
+
+    class Meta:
+        verbose_name = 'Похожий фильм'
+        verbose_name_plural = 'Похожие фильмы'
+        constraints = [
+            # блок на странице фильма — один проход по этому индексу
+            models.UniqueConstraint(fields=['movie', 'rank'], name='similar_movie_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_id} ~ {self.similar_id}'
+
+
+class Facet(models.Model):
+    """ Значение фильтра с числом опубликованных фильмов """
+    YEAR = 'year'
+    GENRE = 'genre'
+    KIND_CHOICES = (
+        (YEAR, 'Год'),
+        (GENRE, 'Жанр'),
+    )
+    kind = models.CharField('Фильтр', max_length=20, choices=KIND_CHOICES)
+    value = models.CharField('Значение', max_length=160)
+    label = models.CharField('Название', max_length=160)
+    count = models.PositiveIntegerField('Опубликованных фильмов', default=0)
+
+    class Meta:
+        verbose_name = 'Значение фильтра'
+        verbose_name_plural = 'Значения фильтров'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'value'], name='facet_kind_value_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.label}'
+
+
+class BoxOffice(models.Model):
+    """ Бюджеты и сборы опубликованных фильмов по году, жанру, стране, категории """
+    TOTAL = 'total'
+    YEAR = 'year'
+    GENRE = 'genre'
+    COUNTRY = 'country'
+    CATEGORY = 'category'
+    KIND_CHOICES = (
+        (TOTAL, 'Всего'),
+        (YEAR, 'Год'),
+        (GENRE, 'Жанр'),
+        (COUNTRY, 'Страна'),
+        (CATEGORY, 'Категория'),
+    )
+    kind = models.CharField('Разрез', max_length=20, choices=KIND_CHOICES)
+    value = models.CharField('Значение', max_length=160)
+    label = models.CharField('Название', max_length=160)
+    movies = models.PositiveIntegerField('Фильмов', default=0)
+    budget = models.PositiveBigIntegerField('Бюджет', default=0)
+    fees_in_usa = models.PositiveBigIntegerField('Сборы в США', default=0)
+    fees_in_the_world = models.PositiveBigIntegerField('Сборы в мире', default=0)
+    # окупаемость считается только по фильмам с известным бюджетом
+    budgeted_fees = models.PositiveBigIntegerField('Сборы фильмов с бюджетом', default=0)
+
+    class Meta:
+        verbose_name = 'Кассовые сборы'
+        verbose_name_plural = 'Кассовые сборы'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'value'], name='box_office_kind_value_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.label}'
+
+    @property
+    def roi(self):
+        """Окупаемость: прибыль на вложенный доллар, None без бюджета"""
+        if not self.budget:
+            return None
+        return (self.budgeted_fees - self.budget) / self.budget
+
+
+class DeletedMovie(models.Model):
+    """ Удаленный фильм для инкрементальной выгрузки (movies.export) """
+    movie_id = models.PositiveIntegerField('id фильма')
+    url = models.SlugField(max_length=160, db_index=False)
+    deleted = models.DateTimeField('Удален', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Удаленный фильм'
+        verbose_name_plural = 'Удаленные фильмы'
+        indexes = [
+            models.Index(fields=['deleted', 'id'], name='deleted_movie_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return self.url
@@ -0,0 +1,118 @@
+"""Постраничный вывод по ключу сортировки (keyset).
+
+Следующая страница выбирается условием `ключ > последнего показанного`
+по индексированным полям, без OFFSET и без COUNT(*), поэтому дальние
+страницы обходятся так же дешево, как первая. Курсор — значения ключа
+последней записи в base64, одна и та же позиция всегда дает один токен.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Значения ключа из курсора или None для пустого/испорченного"""
+    if not token:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def after_key(fields, values):
+    """Условие "строго после" для составного ключа сортировки,
+    поля с "-" упорядочены по убыванию"""
+    names = [field.lstrip('-') for field in fields]
+    condition = Q()
+    for i in reversed(range(len(fields))):
+        equal = {name: value for name, value in zip(names[:i], values)}
+        lookup = 'lt' if fields[i].startswith('-') else 'gt'
+        condition = Q(**equal, **{f'{names[i]}__{lookup}': values[i]}) | condition
+    return condition
+
+
+class KeysetPage:
+    """ Страница списка с курсором на следующую """
+
+    def __init__(self, object_list, next_cursor, next_query):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.next_query = next_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginationMixin:
+    """Постраничный вывод ListView по курсору вместо номера страницы"""
+    paginate_by = 12
+    cursor_param = 'after'
+    # поля ключа сортировки, последнее должно быть уникальным
+    cursor_fields = ('id',)
+
+    def get_cursor_fields(self):
+        return self.cursor_fields
+
+    def get_cursor(self):
+        fields = self.get_cursor_fields()
+        values = decode_cursor(self.request.GET.get(self.cursor_param))
+        # NULL не сравнивается: курсор с null испорчен
+        if values is None or len(values) != len(fields) or None in values:
+            return None
+        try:
+            return [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(fields, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def make_page(self, object_list, has_next):
+        if not has_next or not object_list:
+            return KeysetPage(object_list, None, None)
+        last = object_list[-1]
+        cursor = encode_cursor(
+            getattr(last, field.lstrip('-')) for field in self.get_cursor_fields()
+        )
+        query = self.request.GET.copy()
+        query[self.cursor_param] = cursor
+        return KeysetPage(object_list, cursor, query.urlencode())
+
+    def get_page_queryset(self, queryset, page_size):
+        """Записи страницы и одна лишняя — признак следующей страницы"""
+        fields = self.get_cursor_fields()
+        cursor = self.get_cursor()
+        if cursor is not None:
+            queryset = queryset.filter(after_key(fields, cursor))
+        return queryset.order_by(*fields)[:page_size + 1]
+
+    def split_page(self, object_list, page_size):
+        has_next = len(object_list) > page_size
+        page = self.make_page(object_list[:page_size], has_next)
+        return None, page, page.object_list, has_next
+
+    def paginate_queryset(self, queryset, page_size):
+        object_list = list(self.get_page_queryset(queryset, page_size))
+        return self.split_page(object_list, page_size)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        object_list = [obj async for obj in self.get_page_queryset(queryset, page_size)]
+        return self.split_page(object_list, page_size)
@@ -0,0 +1,155 @@
+"""Прием оценок через буфер в памяти процесса.
+
+Голоса копятся в словаре по паре (фильм, адрес), повторный голос с того
+же адреса заменяет прежний еще в памяти. Буфер сбрасывается одной
+транзакцией, когда набирается RATING_BUFFER_SIZE голосов или проходит
+RATING_BUFFER_DELAY секунд с первого голоса. Запись идет через
+INSERT ... ON CONFLICT (movie, ip) DO UPDATE, так что пропускная
+способность ограничена числом коммитов пачек, а не запросов. Пачка,
+которую не удалось записать (например, база занята), возвращается в
+буфер и пишется со следующей, после max_retries неудач подряд она
+отбрасывается.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from movies import aggregates, versions
+from movies.models import Movie, Rating
+
+logger = logging.getLogger(__name__)
+
+
+def write_votes(votes):
+    """Записывает голоса {(id фильма, адрес): оценка} одной транзакцией,
+    возвращает число записанных"""
+    with transaction.atomic():
+        movie_ids = set(
+            Movie.objects.filter(pk__in={movie_id for movie_id, _ in votes})
+            .values_list('pk', flat=True)
+        )
+        votes = {key: rate for key, rate in votes.items() if key[0] in movie_ids}
+        if not votes:
+            return 0
+        previous = {
+            (movie_id, ip): rate for movie_id, ip, rate in
+            Rating.objects.filter(
+                movie_id__in=movie_ids, ip__in={ip for _, ip in votes}
+            ).values_list('movie_id', 'ip', 'rate')
+        }
+        Rating.objects.bulk_create(
+            [Rating(movie_id=movie_id, ip=ip, rate=rate)
+             for (movie_id, ip), rate in votes.items()],
+            update_conflicts=True,
+            unique_fields=['movie', 'ip'],
+            update_fields=['rate'],
+        )
+        # bulk_create не вызывает сигналы, агрегаты обновляются здесь
+        aggregates.apply_rating_changes(
+            (movie_id, previous.get((movie_id, ip)), rate)
+            for (movie_id, ip), rate in votes.items()
+        )
+        versions.bump('rating')
+    return len(votes)
+
+
+class RatingBuffer:
+    """ Буфер голосов со сбросом по размеру или по времени """
+
+    def __init__(self, max_size=500, max_delay=1.0, max_retries=3):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        # неудачных сбросов подряд
+        self._failures = 0
+        self._lock = threading.Lock()
+        # в процессе пишет один сброс за раз: параллельные транзакции
+        # SQLite только мешают друг другу на блокировке записи
+        self._flush_lock = threading.Lock()
+        self._votes = {}
+        self._timer = None
+
+    def __len__(self):
+        return len(self._votes)
+
+    def add(self, movie_id, ip, rate):
+        with self._lock:
+            self._votes[(movie_id, ip)] = rate
+            full = len(self._votes) >= self.max_size
+            if not full and self._timer is None:
+                self._start_timer()
+        if full:
+            self.flush()
+
+    def _start_timer(self):
+        self._timer = threading.Timer(self.max_delay, self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Записывает накопленные голоса, возвращает их число"""
+        with self._flush_lock:
+            with self._lock:
+                votes, self._votes = self._votes, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not votes:
+                return 0
+            try:
+                written = write_votes(votes)
+            except Exception:
+                self._requeue(votes)
+                return 0
+            self._failures = 0
+            return written
+
+    def _requeue(self, votes):
+        """Возвращает в буфер голоса неудачного сброса; голос, поданный
+        с того же адреса после начала сброса, новее и остается"""
+        with self._lock:
+            self._failures += 1
+            if self._failures > self.max_retries:
+                self._failures = 0
+                logger.exception('Не удалось записать %d голосов, голоса потеряны', len(votes))
+                return
+            logger.exception(
+                'Не удалось записать %d голосов, попытка %d из %d',
+                len(votes), self._failures, self.max_retries + 1,
+            )
+            for key, rate in votes.items():
+                self._votes.setdefault(key, rate)
+            if self._timer is None:
+                self._start_timer()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # у потока таймера собственные соединения с базой
+            connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = RatingBuffer(
+                    max_size=getattr(settings, 'RATING_BUFFER_SIZE', 500),
+                    max_delay=getattr(settings, 'RATING_BUFFER_DELAY', 1.0),
+                )
+                # голоса, не попавшие в базу, сбрасываются при остановке
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def vote(movie_id, ip, rate):
+    get_buffer().add(movie_id, ip, rate)
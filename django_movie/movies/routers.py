@@ -0,0 +1,201 @@
+"""Чтение с реплик, запись в основную базу.
+
+На реплики (settings.DATABASE_REPLICAS) уходят только чтения, явно
+помеченные как безопасные: публичные страницы (ReplicaReadMixin) и
+шаблонные теги (replica_read). Все остальное — отзывы, оценки, админка,
+команды — читает и пишет в основную базу, поэтому без пометки поведение
+не меняется.
+
+Реплика может отставать. Чтобы автор видел свой отзыв сразу, после
+запроса с записью (POST и т.п.) клиенту ставится cookie, и пока она
+жива, его запросы читают из основной базы. Запись внутри помеченного
+запроса тоже переключает остаток запроса на основную базу.
+
+Страница или фрагмент, прочитанные с реплики вскоре после изменения
+данных, могут быть старыми, поэтому в кэш они не кладутся (cacheable):
+иначе старая копия жила бы под новой версией до следующего изменения.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from movies import versions
+
+PRIMARY = DEFAULT_DB_ALIAS
+# cookie "читать из основной базы", живет settings.REPLICA_LAG_SECONDS
+PIN_COOKIE = 'movies_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_replica_reads = ContextVar('movies_replica_reads', default=False)
+_pinned = ContextVar('movies_pinned', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_lag():
+    """За сколько секунд реплики догоняют основную базу"""
+    return getattr(settings, 'REPLICA_LAG_SECONDS', 5)
+
+
+def get_replica():
+    return random.choice(get_replicas())
+
+
+def pin():
+    """Дальнейшие чтения в этом контексте — из основной базы"""
+    _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def reads_from_replica():
+    return bool(get_replicas()) and _replica_reads.get() and not _pinned.get()
+
+
+def cacheable(*names):
+    """Можно ли положить в кэш данные, построенные по этим версиям"""
+    if not reads_from_replica():
+        return True
+    return time.time() - versions.last_modified(*names) >= get_lag()
+
+
+async def acacheable(*names):
+    """Асинхронный вариант cacheable"""
+    if not reads_from_replica():
+        return True
+    return time.time() - await versions.alast_modified(*names) >= get_lag()
+
+
+@contextmanager
+def replica_reads():
+    """Чтения внутри блока можно отдать реплике"""
+    token = _replica_reads.set(True)
+    # запись внутри блока переключает на основную базу только сам блок
+    pinned = _pinned.set(_pinned.get())
+    try:
+        yield
+    finally:
+        _pinned.reset(pinned)
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Чтения внутри блока — из основной базы, даже в помеченном запросе:
+    для данных, которые живут дольше запроса (индексы в памяти процесса)"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_read(func):
+    """replica_reads для функции, например шаблонного тега"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Маршрутизатор для settings.DATABASE_ROUTERS"""
+
+    def db_for_read(self, model, **hints):
+        if not reads_from_replica():
+            return PRIMARY
+        # связанные записи читаются из той же реплики, что и сам объект
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_replicas():
+            return instance._state.db
+        return get_replica()
+
+    def db_for_write(self, model, **hints):
+        if _replica_reads.get():
+            pin()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # реплики — копии основной базы, схема приходит вместе с данными
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """Чтения представления, включая шаблон, — с реплики"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class AsyncReplicaReadMixin:
+    """ReplicaReadMixin для асинхронных представлений"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return await super().dispatch(request, *args, **kwargs)
+        # контекст копируется в потоки sync_to_async, где выполняются запросы
+        with replica_reads():
+            return await super().dispatch(request, *args, **kwargs)
+
+
+class PinPrimaryMiddleware:
+    """Чтение своих записей: после запроса с записью клиент на время
+    отставания реплик читает из основной базы"""
+    # под ASGI запрос не переводится в поток ради этого middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _pinned.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = _pinned.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and get_replicas():
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=get_lag(),
+                httponly=True, samesite='Lax',
+            )
+        return response
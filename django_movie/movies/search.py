@@ -0,0 +1,227 @@
+"""Полнотекстовый поиск по фильмам и съемочной группе.
+
+На SQLite используется виртуальная таблица FTS5 (миграция 0005) с
+триграммным токенизатором: он не зависит от языка и находит подстроки,
+поэтому русские слова совпадают по основе. Для баз без FTS5 и
+запросов из слов короче трех букв поиск сводится к icontains по тем же
+полям. Индекс обновляется сигналами,
+полная перестройка — командой rebuild_search_index.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+from movies.models import FilmCrew, Movie
+
+TABLE = 'movies_search'
+MOVIE = 'movie'
+CREW = 'crew'
+
+# веса столбцов для bm25: kind, object_id, title, body
+RANK = f'bm25({TABLE}, 0, 0, 10.0, 1.0)'
+
+# гласные, которые отбрасываются в конце слов запроса
+ENDINGS = 'аеёиийоуыьэюя'
+
+_tokenizers = {}
+
+
+def tokenizer():
+    """Токенизатор таблицы поиска или None, если FTS5 недоступен"""
+    if connection.alias not in _tokenizers:
+        sql = None
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT sql FROM sqlite_master WHERE name = %s", [TABLE]
+                )
+                row = cursor.fetchone()
+                sql = row[0] if row else None
+        if sql is None:
+            _tokenizers[connection.alias] = None
+        else:
+            _tokenizers[connection.alias] = 'trigram' if 'trigram' in sql else 'unicode61'
+    return _tokenizers[connection.alias]
+
+
+def movie_document(movie):
+    text = f'{movie.tagline} {strip_tags(movie.description)}'
+    return MOVIE, movie.pk, movie.title, text
+
+
+def crew_document(person):
+    return CREW, person.pk, person.name, strip_tags(person.description)
+
+
+def _documents(obj):
+    if isinstance(obj, Movie):
+        return movie_document(obj)
+    return crew_document(obj)
+
+
+def index(obj):
+    """Добавляет или обновляет запись в индексе"""
+    if tokenizer() is None:
+        return
+    kind, object_id, title, body = _documents(obj)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE kind = %s AND object_id = %s',
+            [kind, object_id],
+        )
+        cursor.execute(
+            f'INSERT INTO {TABLE} (kind, object_id, title, body) '
+            f'VALUES (%s, %s, %s, %s)',
+            [kind, object_id, title, body],
+        )
+
+
+def add_many(objs):
+    """Добавляет в индекс новые записи одной вставкой"""
+    if tokenizer() is None or not objs:
+        return 0
+    with connection.cursor() as cursor:
+        return _insert(cursor, [_documents(obj) for obj in objs])
+
+
+def remove(obj):
+    if tokenizer() is None:
+        return
+    kind = MOVIE if isinstance(obj, Movie) else CREW
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE kind = %s AND object_id = %s',
+            [kind, obj.pk],
+        )
+
+
+def rebuild(batch_size=1000):
+    """Полная перестройка индекса, возвращает число записей"""
+    if tokenizer() is None:
+        return 0
+    querysets = (
+        (movie_document, Movie.objects.only('title', 'tagline', 'description')),
+        (crew_document, FilmCrew.objects.only('name', 'description')),
+    )
+    total = 0
+    # одна транзакция: поиск не видит пустой или наполовину заполненный индекс
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        for document, queryset in querysets:
+            batch = []
+            for obj in queryset.iterator(chunk_size=batch_size):
+                batch.append(document(obj))
+                if len(batch) >= batch_size:
+                    total += _insert(cursor, batch)
+                    batch = []
+            total += _insert(cursor, batch)
+    # слияние сегментов индекса — отдельно, после фиксации
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def _insert(cursor, rows):
+    cursor.executemany(
+        f'INSERT INTO {TABLE} (kind, object_id, title, body) '
+        f'VALUES (%s, %s, %s, %s)',
+        rows,
+    )
+    return len(rows)
+
+
+def _terms(query):
+    return [term for term in re.split(r'\W+', query.lower()) if term]
+
+
+def match_expression(query, mode):
+    """Запрос пользователя в синтаксисе FTS5, каждое слово в кавычках"""
+    terms = []
+    for term in _terms(query):
+        if mode == 'trigram':
+            # грубое отсечение окончания: "криминального" -> "криминальн",
+            # "фильмы" -> "фильм", "чтива" -> "чтив"
+            stem = term[:max(len(term) - 3, 5)]
+            while len(stem) > 4 and stem[-1] in ENDINGS:
+                stem = stem[:-1]
+            # триграммы не находят подстроки короче трех символов
+            if len(stem) >= 3:
+                terms.append(f'"{stem}"')
+        else:
+            terms.append(f'"{term}"*')
+    return ' '.join(terms)
+
+
+def matching(kind, query):
+    """Условие filter() на объекты вида kind, найденные в индексе,
+    без ограничения числа и учета публикации; None, если FTS5 недоступен
+    или в запросе нет слов, которые ищутся по индексу (короче трех букв
+    для триграмм)"""
+    mode = tokenizer()
+    if mode is None:
+        return None
+    expression = match_expression(query, mode)
+    if not expression:
+        return None
+    return Q(pk__in=RawSQL(
+        f'SELECT object_id FROM {TABLE} WHERE {TABLE} MATCH %s AND kind = %s',
+        [expression, kind],
+    ))
+
+
+class SearchResult:
+    """ Найденные фильмы и члены съемочной группы по убыванию релевантности """
+
+    def __init__(self, movies, crew):
+        self.movies = movies
+        self.crew = crew
+
+    def __bool__(self):
+        return bool(self.movies or self.crew)
+
+
+def search(query, limit=50):
+    mode = tokenizer()
+    if mode is None:
+        return _fallback_search(query, limit)
+    expression = match_expression(query, mode)
+    if not expression:
+        # слова короче трех букв индекс не ищет
+        return _fallback_search(query, limit)
+    with connection.cursor() as cursor:
+        # черновики отсекаются до LIMIT, иначе они занимали бы места в выдаче
+        cursor.execute(
+            f'SELECT kind, object_id FROM {TABLE} '
+            f'LEFT JOIN {Movie._meta.db_table} movie '
+            f'ON kind = %s AND movie.id = object_id '
+            f'WHERE {TABLE} MATCH %s AND (kind != %s OR NOT movie.draft) '
+            f'ORDER BY {RANK} LIMIT %s',
+            [MOVIE, expression, MOVIE, limit],
+        )
+        rows = cursor.fetchall()
+    movie_ids = [object_id for kind, object_id in rows if kind == MOVIE]
+    crew_ids = [object_id for kind, object_id in rows if kind == CREW]
+    movies = Movie.objects.filter(draft=False).in_bulk(movie_ids)
+    crew = FilmCrew.objects.in_bulk(crew_ids)
+    return SearchResult(
+        [movies[i] for i in movie_ids if i in movies],
+        [crew[i] for i in crew_ids if i in crew],
+    )
+
+
+def _fallback_search(query, limit):
+    """Поиск без FTS5: подстрока в тех же полях"""
+    query = query.strip()
+    if not query:
+        return SearchResult([], [])
+    movies = Movie.objects.filter(draft=False).filter(
+        Q(title__icontains=query) | Q(tagline__icontains=query) |
+        Q(description__icontains=query)
+    )[:limit]
+    crew = FilmCrew.objects.filter(
+        Q(name__icontains=query) | Q(description__icontains=query)
+    )[:limit]
+    return SearchResult(list(movies), list(crew))
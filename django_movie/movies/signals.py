@@ -0,0 +1,381 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from movies import (
+    aggregates, boxoffice, facets, filmography, search, similar, thumbnails, versions,
+)
+from movies.models import (
+    BoxOffice, Category, DeletedMovie, FilmCrew, Genre, Movie, MovieShot, Rating, Review,
+    SimilarMovie,
+)
+
+
+def deleted_with_movie(origin):
+    """Удаление идет каскадом от фильма"""
+    return isinstance(origin, Movie) or getattr(origin, 'model', None) is Movie
+
+
+@receiver(pre_delete, sender=Review)
+def review_pre_delete(sender, instance, origin=None, **kwargs):
+    """Перестраивает пути ответов перед удалением отзыва"""
+    # при удалении фильма отзывы удаляются вместе с ним
+    if deleted_with_movie(origin):
+        return
+    instance.detach_replies()
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        aggregates.apply_review_change(instance.movie_id, 1)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, origin=None, **kwargs):
+    if not deleted_with_movie(origin):
+        aggregates.apply_review_change(instance.movie_id, -1)
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, raw=False, **kwargs):
+    """Приращение агрегатов оценок фильма"""
+    if raw:
+        return
+    old_rate = None if created else getattr(instance, '_loaded_rate', None)
+    old_movie_id = getattr(instance, '_loaded_movie_id', None) or instance.movie_id
+    if old_movie_id != instance.movie_id:
+        aggregates.apply_rating_changes([
+            (old_movie_id, old_rate, None), (instance.movie_id, None, instance.rate)
+        ])
+    elif old_rate != instance.rate:
+        aggregates.apply_rating_changes([(instance.movie_id, old_rate, instance.rate)])
+    instance._loaded_rate = instance.rate
+    instance._loaded_movie_id = instance.movie_id
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, origin=None, **kwargs):
+    if not deleted_with_movie(origin):
+        aggregates.apply_rating_changes([(instance.movie_id, instance.rate, None)])
+
+
+@receiver(pre_save, sender=Movie)
+def movie_pre_save(sender, instance, raw=False, **kwargs):
+    """Запоминает прежний год выхода фильма"""
+    if raw or instance.pk is None:
+        instance._facet_years = set()
+        return
+    instance._facet_years = set(
+        Movie.objects.filter(pk=instance.pk).values_list('year', flat=True)
+    )
+
+
+@receiver(post_save, sender=Movie)
+def movie_post_save(sender, instance, raw=False, **kwargs):
+    """Пересчет фильтров по году и жанрам фильма"""
+    if raw:
+        return
+    facets.refresh_years(getattr(instance, '_facet_years', set()) | {instance.year})
+    facets.refresh_genres(
+        instance.genres.through.objects.filter(movie_id=instance.pk)
+        .values_list('genre_id', flat=True)
+    )
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_pre_delete(sender, instance, **kwargs):
+    """Запоминает жанры удаляемого фильма"""
+    instance._facet_genres = list(instance.genres.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Movie)
+def movie_post_delete(sender, instance, **kwargs):
+    facets.refresh_years([instance.year])
+    facets.refresh_genres(getattr(instance, '_facet_genres', []))
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Пересчет фильтров по жанрам при изменении связей"""
+    if action == 'pre_clear':
+        if reverse:
+            instance._facet_genres = [instance.pk]
+        else:
+            instance._facet_genres = list(
+                instance.genres.values_list('id', flat=True)
+            )
+    elif action == 'post_clear':
+        facets.refresh_genres(getattr(instance, '_facet_genres', []))
+    elif action in ('post_add', 'post_remove'):
+        facets.refresh_genres([instance.pk] if reverse else pk_set)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def genre_changed(sender, instance, raw=False, **kwargs):
+    """Обновление названия или удаление жанра в фильтрах"""
+    if raw:
+        return
+    facets.refresh_genres([instance.pk])
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    """У фильмов удаленной категории она обнуляется без сигналов"""
+    facets.invalidate()
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=FilmCrew)
+def search_index_update(sender, instance, raw=False, **kwargs):
+    """Обновление записи в полнотекстовом индексе"""
+    if not raw:
+        search.index(instance)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=FilmCrew)
+def search_index_remove(sender, instance, **kwargs):
+    search.remove(instance)
+
+
+def bump_version(sender, **kwargs):
+    """Новая версия данных модели для кэша фрагментов и страниц"""
+    versions.bump(sender._meta.model_name)
+
+
+def bump_movie_version(sender, action, **kwargs):
+    if action.startswith('post_'):
+        versions.bump('movie')
+
+
+for model in (Category, FilmCrew, Genre, Movie, MovieShot, Rating, Review):
+    post_save.connect(bump_version, sender=model, dispatch_uid=f'version_save_{model.__name__}')
+    post_delete.connect(bump_version, sender=model, dispatch_uid=f'version_delete_{model.__name__}')
+
+for field in ('director', 'actors', 'genres'):
+    m2m_changed.connect(
+        bump_movie_version, sender=getattr(Movie, field).through,
+        dispatch_uid=f'version_m2m_{field}',
+    )
+
+
+# поля с изображениями, для которых строятся уменьшенные копии
+IMAGE_FIELDS = {Movie: 'poster', FilmCrew: 'image', MovieShot: 'image'}
+
+
+def image_saved(sender, raw, update_fields):
+    """Сохранение может изменить поле с изображением"""
+    return not raw and (update_fields is None or IMAGE_FIELDS[sender] in update_fields)
+
+
+def remember_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Запоминает прежнее имя файла изображения"""
+    if not image_saved(sender, raw, update_fields) or instance.pk is None:
+        instance._thumbnail_source = None
+        return
+    instance._thumbnail_source = sender.objects.filter(pk=instance.pk).values_list(
+        IMAGE_FIELDS[sender], flat=True
+    ).first()
+
+
+def build_thumbnails(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Копии нового изображения строятся в пуле после фиксации транзакции"""
+    if not image_saved(sender, raw, update_fields):
+        return
+    fieldfile = getattr(instance, IMAGE_FIELDS[sender])
+    if fieldfile.name == getattr(instance, '_thumbnail_source', None):
+        return
+    transaction.on_commit(
+        lambda: thumbnails.schedule(fieldfile, sender._meta.model_name)
+    )
+
+
+for model in IMAGE_FIELDS:
+    pre_save.connect(remember_image, sender=model, dispatch_uid=f'thumbnails_pre_{model.__name__}')
+    post_save.connect(build_thumbnails, sender=model, dispatch_uid=f'thumbnails_{model.__name__}')
+
+
+# изменения связей и связанных записей меняют выгрузку фильма,
+# но не обновляют его поле updated (movies.export)
+
+def touch_linked_movies(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        field = Movie._meta.get_field(
+            next(name for name in ('director', 'actors', 'genres')
+                 if getattr(Movie, name).through is sender)
+        )
+        if action == 'pre_clear':
+            Movie.objects.filter(**{field.name: instance}).touch()
+        elif action in ('post_add', 'post_remove'):
+            Movie.objects.filter(pk__in=pk_set).touch()
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        Movie.objects.filter(pk=instance.pk).touch()
+
+
+for field in ('director', 'actors', 'genres'):
+    m2m_changed.connect(
+        touch_linked_movies, sender=getattr(Movie, field).through,
+        dispatch_uid=f'touch_m2m_{field}',
+    )
+
+
+@receiver(post_delete, sender=Movie)
+def log_deleted_movie(sender, instance, **kwargs):
+    """Удаление попадает в инкрементальную выгрузку как tombstone"""
+    DeletedMovie.objects.create(movie_id=instance.pk, url=instance.url)
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def touch_category_movies(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Movie.objects.filter(category=instance).touch()
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def touch_genre_movies(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Movie.objects.filter(genres=instance).touch()
+
+
+@receiver(post_save, sender=FilmCrew)
+@receiver(pre_delete, sender=FilmCrew)
+def touch_crew_movies(sender, instance, raw=False, created=False, **kwargs):
+    if not raw and not created:
+        Movie.objects.filter(Q(director=instance) | Q(actors=instance)).touch()
+
+
+# фильмография человека зависит от названия, года, адреса и публикации
+# его фильмов и от связей с ними (movies.filmography)
+
+@receiver(post_save, sender=Movie)
+def filmography_movie_saved(sender, instance, created=False, raw=False, **kwargs):
+    # у нового фильма связей еще нет, они добавятся через m2m_changed
+    if not raw and not created:
+        filmography.invalidate_movies([instance.pk])
+
+
+@receiver(pre_delete, sender=Movie)
+def filmography_movie_pre_delete(sender, instance, **kwargs):
+    instance._filmography_crew = filmography.crew_of([instance.pk])
+
+
+@receiver(post_delete, sender=Movie)
+def filmography_movie_deleted(sender, instance, **kwargs):
+    filmography.invalidate(getattr(instance, '_filmography_crew', ()))
+
+
+def filmography_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            filmography.invalidate([instance.pk])
+    elif action == 'pre_clear':
+        instance._filmography_crew = filmography.crew_of([instance.pk])
+    elif action == 'post_clear':
+        filmography.invalidate(getattr(instance, '_filmography_crew', ()))
+    elif action in ('post_add', 'post_remove'):
+        filmography.invalidate(pk_set)
+
+
+for field in ('director', 'actors'):
+    m2m_changed.connect(
+        filmography_links_changed, sender=getattr(Movie, field).through,
+        dispatch_uid=f'filmography_m2m_{field}',
+    )
+
+
+# похожие фильмы зависят от признаков фильма (категория, страна, год,
+# публикация) и от связей с людьми и жанрами (movies.similar)
+
+@receiver(post_save, sender=Movie)
+def similar_movie_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        similar.schedule([instance.pk])
+
+
+@receiver(pre_delete, sender=Movie)
+def similar_movie_pre_delete(sender, instance, **kwargs):
+    # строки, где фильм указан похожим, удалятся каскадом вместе с ним
+    instance._similar_listed = list(
+        SimilarMovie.objects.filter(similar=instance).values_list('movie_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Movie)
+def similar_movie_deleted(sender, instance, **kwargs):
+    listed = getattr(instance, '_similar_listed', ())
+    if listed:
+        similar.schedule(listed)
+
+
+def similar_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            similar.schedule([instance.pk])
+    elif action == 'pre_clear':
+        column = 'genre_id' if isinstance(instance, Genre) else 'filmcrew_id'
+        instance._similar_movies = list(
+            sender.objects.filter(**{column: instance.pk}).values_list('movie_id', flat=True)
+        )
+    elif action == 'post_clear':
+        similar.schedule(getattr(instance, '_similar_movies', ()))
+    elif action in ('post_add', 'post_remove'):
+        similar.schedule(pk_set)
+
+
+for field in ('director', 'actors', 'genres'):
+    m2m_changed.connect(
+        similar_links_changed, sender=getattr(Movie, field).through,
+        dispatch_uid=f'similar_m2m_{field}',
+    )
+
+
+# кассовые сборы зависят от сумм, года, страны, категории и публикации
+# фильма и от его жанров (movies.boxoffice)
+
+@receiver(pre_save, sender=Movie)
+def boxoffice_movie_pre_save(sender, instance, raw=False, **kwargs):
+    # прежние год, страна и категория, пока фильм не сохранен
+    if not raw and instance.pk is not None:
+        boxoffice.schedule(boxoffice.affected([instance.pk]))
+
+
+@receiver(post_save, sender=Movie)
+def boxoffice_movie_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        boxoffice.schedule(movie_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=Movie)
+def boxoffice_movie_pre_delete(sender, instance, **kwargs):
+    boxoffice.schedule(boxoffice.affected([instance.pk]))
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def boxoffice_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        boxoffice.schedule({BoxOffice.GENRE: (
+            [instance.pk] if reverse else instance.genres.values_list('id', flat=True)
+        )})
+    elif action in ('post_add', 'post_remove'):
+        boxoffice.schedule({BoxOffice.GENRE: [instance.pk] if reverse else pk_set})
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def boxoffice_genre_changed(sender, instance, raw=False, **kwargs):
+    """Новое название или удаление жанра"""
+    if not raw:
+        boxoffice.schedule({BoxOffice.GENRE: [instance.pk]})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def boxoffice_category_changed(sender, instance, raw=False, **kwargs):
+    """Новое название или удаление категории (у фильмов она обнуляется)"""
+    if not raw:
+        boxoffice.schedule({BoxOffice.CATEGORY: [instance.pk]})
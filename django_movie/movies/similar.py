@@ -0,0 +1,340 @@
+"""Похожие фильмы: заранее посчитанные соседи каждого фильма.
+
+Фильм — разреженный вектор признаков: режиссеры, актеры, жанры,
+категория, страна и пятилетие выхода, у каждого вида свой вес (WEIGHTS).
+Сходство — косинус между векторами. Перебор всех пар не нужен:
+кандидаты берутся из инвертированного индекса признак -> фильмы по
+редким признакам (съемочная группа), частичные суммы по целым спискам
+считает Counter.update, и только лучшие кандидаты досчитываются по всем
+признакам пересечением множеств. Признаков у фильма десяток, поэтому
+такое разреженное произведение обходится без NumPy/SciPy.
+
+В таблице SimilarMovie лежат TOP_K соседей каждого опубликованного
+фильма, страница фильма читает их одним запросом по индексу
+(movie, rank). build() пересчитывает все фильмы в памяти; update()
+— только фильмы с изменившимися признаками и списки, которые они могут
+поменять, с признаками из базы. Сигналы собирают измененные фильмы
+(schedule) и пересчитывают их после фиксации транзакции.
+"""
+import heapq
+import math
+import threading
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from movies import versions
+from movies.models import Movie, SimilarMovie
+
+VERSION = 'similar'
+TOP_K = 10
+# вес признака в векторе фильма по виду
+WEIGHTS = {
+    'director': 3.0,
+    'actor': 2.0,
+    'genre': 1.5,
+    'category': 1.0,
+    'country': 0.5,
+    'period': 0.5,
+}
+YEARS_PER_PERIOD = 5
+# связи фильма: вид признака -> (промежуточная таблица, столбец значения)
+LINKS = {
+    'director': (Movie.director.through, 'filmcrew_id'),
+    'actor': (Movie.actors.through, 'filmcrew_id'),
+    'genre': (Movie.genres.through, 'genre_id'),
+}
+# по каким признакам ищутся кандидаты; жанры — если кандидатов мало
+CANDIDATE_KINDS = ('director', 'actor')
+FALLBACK_KIND = 'genre'
+# признак, общий для большего числа фильмов, кандидатов не дает
+CANDIDATE_LIMIT = 500
+# сколько лучших по частичной сумме кандидатов досчитывается полностью
+RESCORE = TOP_K * 10
+# больше измененных фильмов — refresh() пересчитывает все
+UPDATE_LIMIT = 1000
+# размер списка id в одном запросе
+CHUNK_SIZE = 900
+
+
+def chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def norm(features):
+    return math.sqrt(sum(WEIGHTS[kind] ** 2 for kind, _ in features))
+
+
+def load_features(movie_ids=None):
+    """{id: множество признаков (вид, значение)} опубликованных фильмов,
+    всех или только movie_ids"""
+    groups = [None] if movie_ids is None else list(chunks(sorted(movie_ids)))
+    features = {}
+    for ids in groups:
+        movies = Movie.objects.filter(draft=False).order_by('id')
+        if ids is not None:
+            movies = movies.filter(id__in=ids)
+        for pk, category_id, country, year in movies.values_list(
+            'id', 'category_id', 'country', 'year'
+        ).iterator(chunk_size=2000):
+            features[pk] = {('country', country), ('period', year // YEARS_PER_PERIOD)}
+            if category_id:
+                features[pk].add(('category', category_id))
+        for kind, (through, column) in LINKS.items():
+            links = through.objects.order_by('movie_id')
+            if ids is not None:
+                links = links.filter(movie_id__in=ids)
+            for movie_id, value in links.values_list('movie_id', column).iterator(chunk_size=2000):
+                if movie_id in features:
+                    features[movie_id].add((kind, value))
+    return features
+
+
+class FeatureIndex:
+    """Признаки всех опубликованных фильмов и списки фильмов по признакам"""
+
+    def __init__(self, features):
+        self.features = {}
+        self.norms = {}
+        self.add(features)
+        postings = defaultdict(list)
+        for pk in sorted(features):
+            for feature in features[pk]:
+                if feature[0] in LINKS:
+                    postings[feature].append(pk)
+        self.postings = dict(postings)
+
+    def add(self, features):
+        for pk, own in features.items():
+            self.features[pk] = own
+            self.norms[pk] = norm(own)
+
+    def load(self, movie_ids):
+        """Признаки фильмов должны быть в индексе (здесь уже все)"""
+
+    def get_postings(self, feature):
+        """Фильмы с признаком по возрастанию id"""
+        return self.postings.get(feature, ())
+
+
+class DatabaseIndex(FeatureIndex):
+    """Признаки и списки читаются из базы по мере надобности"""
+
+    def __init__(self):
+        super().__init__({})
+
+    def load(self, movie_ids):
+        missing = set(movie_ids) - self.features.keys()
+        if missing:
+            loaded = load_features(missing)
+            self.add(loaded)
+            self.load_postings({
+                feature for own in loaded.values() for feature in own
+                if feature[0] in CANDIDATE_KINDS and feature not in self.postings
+            })
+
+    def load_postings(self, features):
+        """Списки фильмов сразу для многих признаков, запрос на вид"""
+        values = defaultdict(list)
+        for kind, value in features:
+            values[kind].append(value)
+        for kind, kind_values in values.items():
+            through, column = LINKS[kind]
+            for ids in chunks(kind_values):
+                for value in ids:
+                    self.postings[kind, value] = []
+                for value, movie_id in through.objects.filter(
+                    **{f'{column}__in': ids}, movie__draft=False
+                ).order_by(column, 'movie_id').values_list(column, 'movie_id').iterator(chunk_size=2000):
+                    postings = self.postings[kind, value]
+                    if len(postings) <= CANDIDATE_LIMIT:
+                        postings.append(movie_id)
+
+    def get_postings(self, feature):
+        if feature not in self.postings:
+            kind, value = feature
+            through, column = LINKS[kind]
+            # длинный список дальше CANDIDATE_LIMIT не нужен
+            self.postings[feature] = list(
+                through.objects.filter(**{column: value}, movie__draft=False)
+                .order_by('movie_id').values_list('movie_id', flat=True)[:CANDIDATE_LIMIT + 1]
+            )
+        return self.postings[feature]
+
+
+def ranked(scored, k=TOP_K):
+    """Лучшие k пар (сходство, id): по убыванию сходства, затем по id"""
+    return heapq.nsmallest(k, scored, key=lambda item: (-item[0], item[1]))
+
+
+def candidates(index, pk, k=TOP_K):
+    """Лучшие по частичной сумме кандидаты в соседи фильма"""
+    own = index.features.get(pk)
+    if not own:
+        return []
+    partial = Counter()
+    for kinds, limit in ((CANDIDATE_KINDS, None), ((FALLBACK_KIND,), CANDIDATE_LIMIT)):
+        if len(partial) > k:
+            break
+        for kind in kinds:
+            counts = Counter()
+            for feature in own:
+                if feature[0] != kind:
+                    continue
+                postings = index.get_postings(feature)
+                if limit:
+                    counts.update(postings[:limit])
+                elif len(postings) <= CANDIDATE_LIMIT:
+                    counts.update(postings)
+            weight = WEIGHTS[kind] ** 2
+            partial.update({other: weight * count for other, count in counts.items()})
+    partial.pop(pk, None)
+
+    # при равных суммах — меньший id, результат не зависит от порядка обхода
+    return [other for _, other in ranked(
+        ((total, other) for other, total in partial.items()), RESCORE
+    )]
+
+
+def rescore(index, pk, found, k=TOP_K):
+    """Ближайшие k из кандидатов found по всем признакам; признаки
+    кандидатов уже в индексе"""
+    own = index.features.get(pk)
+    if not own:
+        return []
+    scored = []
+    for other in found:
+        shared = own & index.features.get(other, set())
+        if shared:
+            score = sum(WEIGHTS[kind] ** 2 for kind, _ in shared)
+            scored.append((score / (index.norms[pk] * index.norms[other]), other))
+    return ranked(scored, k)
+
+
+def neighbours(index, pk, k=TOP_K):
+    """Ближайшие k фильмов [(сходство, id)]"""
+    index.load([pk])
+    found = candidates(index, pk, k)
+    index.load(found)
+    return rescore(index, pk, found, k)
+
+
+def store(results):
+    """Заменяет списки фильмов {id: [(сходство, id)]}"""
+    with transaction.atomic():
+        for ids in chunks(results):
+            SimilarMovie.objects.filter(movie_id__in=ids).delete()
+        SimilarMovie.objects.bulk_create([
+            SimilarMovie(movie_id=pk, similar_id=other, score=score, rank=rank)
+            for pk, found in results.items()
+            for rank, (score, other) in enumerate(found)
+        ], batch_size=1000)
+
+
+def build(batch_size=1000):
+    """Пересчет всех фильмов; возвращает число фильмов"""
+    index = FeatureIndex(load_features())
+    ids = sorted(index.features)
+    with transaction.atomic():
+        SimilarMovie.objects.all().delete()
+        for batch in chunks(ids, batch_size):
+            store({pk: neighbours(index, pk) for pk in batch})
+    versions.bump(VERSION)
+    return len(ids)
+
+
+def update(movie_ids):
+    """Пересчет после изменения признаков фильмов movie_ids.
+
+    Кроме самих фильмов пересчитываются списки, где они уже есть, и
+    фильмы с общими режиссерами и актерами — только у них измененный фильм
+    может оказаться кандидатом. Кандидаты из жанров (FALLBACK_KIND) —
+    первые CANDIDATE_LIMIT фильмов жанра, поэтому пересчитываются и они,
+    если среди них есть измененный фильм.
+    """
+    changed = set(movie_ids)
+    if not changed:
+        return
+    index = DatabaseIndex()
+    index.load(changed)
+    affected = set()
+    for ids in chunks(changed):
+        affected.update(
+            SimilarMovie.objects.filter(similar_id__in=ids).values_list('movie_id', flat=True)
+        )
+    for pk in changed:
+        for feature in index.features.get(pk, ()):
+            if feature[0] in CANDIDATE_KINDS:
+                postings = index.get_postings(feature)
+                if len(postings) <= CANDIDATE_LIMIT:
+                    affected.update(postings)
+            elif feature[0] == FALLBACK_KIND:
+                # как в neighbours(): из жанра берутся первые фильмы по id
+                postings = index.get_postings(feature)[:CANDIDATE_LIMIT]
+                if pk in postings:
+                    affected.update(postings)
+    affected |= changed
+    index.load(affected)
+    # признаки всех кандидатов читаются вместе, а не по фильму
+    found = {pk: candidates(index, pk) for pk in affected}
+    index.load(set().union(*found.values()))
+    results = {pk: rescore(index, pk, found[pk]) for pk in affected}
+    # большинство пересчитанных списков не меняется, они не перезаписываются
+    stored = defaultdict(list)
+    for ids in chunks(affected):
+        for pk, score, other in SimilarMovie.objects.filter(movie_id__in=ids).order_by(
+            'movie_id', 'rank'
+        ).values_list('movie_id', 'score', 'similar_id'):
+            stored[pk].append((score, other))
+    store({pk: found for pk, found in results.items() if found != stored[pk]})
+    versions.bump(VERSION)
+
+
+def refresh(movie_ids):
+    """Пересчет после массовых изменений без сигналов (импорт); movie_ids
+    None или больше UPDATE_LIMIT — полный пересчет дешевле"""
+    if movie_ids is None or len(movie_ids) > UPDATE_LIMIT:
+        build()
+    else:
+        update(movie_ids)
+
+
+def get_similar(movie):
+    """Похожие опубликованные фильмы по порядку, один запрос по индексу"""
+    return [
+        link.similar for link in SimilarMovie.objects.filter(movie=movie, similar__draft=False)
+        .select_related('similar').only('similar', 'similar__title', 'similar__url', 'similar__poster')
+        .order_by('rank')
+    ]
+
+
+async def aget_similar(movie):
+    """Асинхронный вариант get_similar"""
+    return [
+        link.similar async for link in SimilarMovie.objects.filter(movie=movie, similar__draft=False)
+        .select_related('similar').only('similar', 'similar__title', 'similar__url', 'similar__poster')
+        .order_by('rank')
+    ]
+
+
+# у каждого потока свое соединение и свои транзакции: фильмы,
+# измененные в еще не зафиксированной транзакции, не пересчитываются
+# при фиксации транзакции другого потока
+_pending = threading.local()
+
+
+def schedule(movie_ids):
+    """Пересчитать фильмы после фиксации транзакции; изменения одного
+    сохранения (фильм и его связи) собираются в один пересчет"""
+    if not hasattr(_pending, 'movie_ids'):
+        _pending.movie_ids = set()
+    _pending.movie_ids.update(movie_ids)
+    transaction.on_commit(flush)
+
+
+def flush():
+    movie_ids = getattr(_pending, 'movie_ids', set())
+    _pending.movie_ids = set()
+    update(movie_ids)
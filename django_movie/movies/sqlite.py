@@ -0,0 +1,27 @@
+"""Настройки соединений SQLite (settings.SQLITE_PRAGMAS).
+
+PRAGMA действуют на одно соединение, поэтому выполняются при каждом
+новом подключении. journal_mode=wal хранится в самом файле базы, но
+повторная установка ничего не стоит.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        # значения из настроек, не из запроса
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def get_pragmas(connection, names=None):
+    """Текущие значения PRAGMA соединения"""
+    connection.ensure_connection()
+    return {
+        name: connection.connection.execute(f'PRAGMA {name}').fetchone()[0]
+        for name in names or getattr(settings, 'SQLITE_PRAGMAS', {})
+    }
@@ -0,0 +1,233 @@
+"""Сборка и раздача статики: хеши в именах, сжатие при сборке.
+
+CompressedManifestStaticFilesStorage — ManifestStaticFilesStorage
+(имена вида style.3f2a1c.css, манифест staticfiles.json), который после
+collectstatic кладет рядом с текстовыми файлами сжатые копии: .gz и .br
+(пакет brotli из requirement.txt; без него — только .gz). Пока статика
+не собрана (разработка, тесты), {% static %} возвращает исходные имена.
+
+PrecompressedStaticMiddleware отдает файлы из STATIC_ROOT сразу после
+SecurityMiddleware, до остальных обработчиков: выбирает по
+Accept-Encoding готовую копию, ничего не сжимая во время запроса, и
+отдает файл через FileResponse (wsgi.file_wrapper, у gunicorn и uWSGI —
+sendfile). Список файлов читается с диска один раз при первом запросе,
+после collectstatic процессы перезапускаются. Файлы с хешем в имени не
+меняются, они кэшируются навсегда (immutable).
+"""
+import gzip
+import logging
+import mimetypes
+import os
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# текстовые форматы, которые имеет смысл сжимать
+COMPRESSIBLE = {
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+    '.eot', '.ttf', '.otf', '.ico',
+}
+# меньшие файлы помещаются в один пакет и без сжатия
+MIN_SIZE = 256
+# сжатая копия хранится, если она хотя бы на 5% меньше исходного файла
+MIN_RATIO = 0.95
+# кодировки по предпочтению: (Content-Encoding, расширение копии)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def compress(path):
+    """Пишет рядом с файлом .gz и .br; возвращает расширения созданных копий"""
+    data = path.read_bytes()
+    if len(data) < MIN_SIZE:
+        return []
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    created = []
+    for suffix, compressed in variants.items():
+        target = path.with_name(path.name + suffix)
+        if len(compressed) < len(data) * MIN_RATIO:
+            target.write_bytes(compressed)
+            created.append(suffix)
+        elif target.exists():
+            target.unlink()
+    return created
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Хеши в именах и сжатые копии собранных файлов"""
+
+    def stored_name(self, name):
+        # статика не собрана: исходные имена из STATICFILES_DIRS
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None:
+                raise
+            # ссылка из CSS на несуществующий файл остается как есть
+            logger.warning('Файл %s из ссылки в CSS не найден', name)
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        root = Path(self.location)
+        # исходные имена тоже: CKEditor загружает свои файлы без манифеста
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            path = root / name
+            if path.suffix.lower() in COMPRESSIBLE and path.is_file():
+                compress(path)
+
+
+class StaticFile:
+    """Файл из STATIC_ROOT с готовыми сжатыми копиями"""
+
+    def __init__(self, path, immutable):
+        stat = path.stat()
+        self.path = path
+        self.last_modified = http_date(stat.st_mtime)
+        self.tag = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+        self.content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        self.immutable = immutable
+        self.variants = {
+            encoding: path.with_name(path.name + suffix)
+            for encoding, suffix in ENCODINGS
+            if path.with_name(path.name + suffix).is_file()
+        }
+
+    def choose(self, accept_encoding):
+        """(путь, Content-Encoding или None) для заголовка Accept-Encoding"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding, path in self.variants.items():
+            if encoding in accepted:
+                return path, encoding
+        return self.path, None
+
+    def etag(self, encoding):
+        # у сжатой копии другие байты — и другой ETag
+        return f'"{self.tag}-{encoding}"' if encoding else f'"{self.tag}"'
+
+
+def parse_accept_encoding(header):
+    """Кодировки, которые клиент принимает (q > 0)"""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def scan(root):
+    """{адрес от STATIC_URL: StaticFile} по собранной статике"""
+    root = Path(root)
+    if not root.is_dir():
+        return {}
+    manifest = getattr(staticfiles_storage, 'hashed_files', None) or {}
+    hashed = set(manifest.values())
+    suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(suffixes) or name == 'staticfiles.json':
+                continue
+            path = Path(directory, name)
+            url = path.relative_to(root).as_posix()
+            files[url] = StaticFile(path, immutable=url in hashed)
+    return files
+
+
+class PrecompressedStaticMiddleware:
+    """Раздача собранной статики с готовыми сжатыми копиями"""
+    # под ASGI запрос не переводится в поток ради этого middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # относительный STATIC_URL Django дополняет до пути от корня сайта
+        self.prefix = settings.STATIC_URL
+        self.files = None
+
+    def is_static(self, request):
+        return request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix)
+
+    def load(self):
+        root = getattr(settings, 'STATIC_ROOT', None)
+        self.files = scan(root) if root else {}
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.is_static(request):
+            return self.get_response(request)
+        if self.files is None:
+            self.load()
+        static_file = self.files.get(request.path[len(self.prefix):])
+        if static_file is None:
+            return self.get_response(request)
+        return self.serve(request, static_file)
+
+    async def __acall__(self, request):
+        if not self.is_static(request):
+            return await self.get_response(request)
+        if self.files is None:
+            # обход STATIC_ROOT — один раз, но не в цикле событий
+            await sync_to_async(self.load)()
+        static_file = self.files.get(request.path[len(self.prefix):])
+        if static_file is None:
+            return await self.get_response(request)
+        return self.serve(request, static_file)
+
+    def serve(self, request, static_file):
+        path, encoding = static_file.choose(request.headers.get('Accept-Encoding', ''))
+        etag = static_file.etag(encoding)
+        headers = {
+            'Cache-Control': IMMUTABLE if static_file.immutable else
+            f'public, max-age={getattr(settings, "STATIC_CACHE_MAX_AGE", 60)}',
+            'ETag': etag,
+            'Last-Modified': static_file.last_modified,
+        }
+        if static_file.variants:
+            headers['Vary'] = 'Accept-Encoding'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return HttpResponseNotModified(headers=headers)
+
+        # тип — исходного файла, а не сжатой копии
+        response = FileResponse(
+            open(path, 'rb'), content_type=static_file.content_type, headers=headers,
+        )
+        # FileResponse добавляет "inline; filename=" по имени файла, статике он не нужен
+        del response['Content-Disposition']
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
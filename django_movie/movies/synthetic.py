@@ -0,0 +1,175 @@
+"""Синтетический каталог для проверки масштабирования.
+
+Записи строятся генератором случайных чисел с заданным seed, поэтому
+один и тот же размер и seed дают один и тот же каталог. Фильмы
+записываются импортом каталога (movies.catalogue) пачками, ответы на
+отзывы и оценки добавляются к каждой пачке прямыми вставками, агрегаты
+фильмов пересчитываются в конце.
+
+Пропорции: съемочная группа — половина числа фильмов, участие в фильмах
+распределено неравномерно (есть люди с сотнями фильмов), жанров и
+категорий фиксированное число, отзывов и оценок у популярных фильмов
+больше.
+"""
+import random
+from datetime import date, timedelta
+from itertools import islice
+
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+from movies import aggregates, versions
+from movies.catalogue import CatalogueImporter, insert_rows
+from movies.models import Movie, Rating, Review
+
+SCALES = {'1k': 1000, '100k': 100_000, '1m': 1_000_000}
+URL_PREFIX = 'synthetic-'
+GENRES = 20
+CATEGORIES = ('films', 'series', 'cartoons', 'documentary', 'shorts')
+COUNTRIES = ('США', 'Россия', 'Франция', 'Япония', 'Великобритания', 'Германия', 'Индия')
+WORDS = (
+    'ночь', 'город', 'тень', 'море', 'последний', 'дорога', 'звезда', 'время',
+    'огонь', 'зима', 'сердце', 'мир', 'тайна', 'остров', 'путь', 'день',
+    'небо', 'охота', 'дом', 'война', 'свет', 'ветер', 'песня', 'лес',
+)
+NAMES = ('Анна', 'Иван', 'Мария', 'Петр', 'Ольга', 'Джон', 'Эмма', 'Такеши', 'Жан', 'Ханс')
+SURNAMES = ('Смит', 'Иванов', 'Дюбуа', 'Мюллер', 'Танака', 'Браун', 'Сингх', 'Петров')
+# ответов на отзыв на каждом уровне дерева
+REPLY_DEPTH = 2
+
+
+def _skewed(rnd, size):
+    """Индекс от 0 до size-1, малые значения встречаются намного чаще"""
+    return min(size - 1, int(rnd.paretovariate(1.2)) - 1) if size else 0
+
+
+def _person(rnd, size):
+    """Половина ролей у случайных людей, половина у постоянно снимающихся"""
+    if rnd.random() < 0.5:
+        return rnd.randrange(size)
+    # простое число разносит популярных людей по всему списку
+    return _skewed(rnd, size) * 7919 % size
+
+
+def crew_name(number):
+    return f'{NAMES[number % len(NAMES)]} {SURNAMES[number // len(NAMES) % len(SURNAMES)]} {number}'
+
+
+def records(count, seed=1):
+    """Записи каталога в формате импорта: (номер, запись)"""
+    rnd = random.Random(seed)
+    crew_size = max(20, count // 2)
+    first_premiere = date(1950, 1, 1)
+    for number in range(count):
+        popularity = _skewed(rnd, 50)
+        title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 3))).capitalize()
+        premiere = first_premiere + timedelta(days=rnd.randrange(75 * 365))
+        yield number + 1, {
+            'url': f'{URL_PREFIX}{number}',
+            'title': f'{title} {number}',
+            'tagline': ' '.join(rnd.choice(WORDS) for _ in range(4)),
+            'description': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 80))),
+            'poster': 'movies/synthetic.jpg',
+            'year': premiere.year,
+            'country': rnd.choice(COUNTRIES),
+            'world_premiere': premiere.isoformat(),
+            'budget': rnd.randrange(10 ** 5, 3 * 10 ** 8),
+            'fees_in_usa': rnd.randrange(10 ** 8),
+            'fees_in_the_world': rnd.randrange(10 ** 9),
+            'draft': rnd.random() < 0.05,
+            'category': rnd.choice(CATEGORIES),
+            'genres': [f'genre-{rnd.randrange(GENRES)}' for _ in range(rnd.randint(1, 3))],
+            'director': [crew_name(_person(rnd, crew_size))],
+            'actors': [crew_name(_person(rnd, crew_size)) for _ in range(rnd.randint(2, 6))],
+            'shots': [
+                {'title': f'Кадр {k}', 'image': 'movie_shots/synthetic.jpg'}
+                for k in range(rnd.randint(0, 3))
+            ],
+            'reviews': [
+                {
+                    'name': rnd.choice(NAMES), 'email': 'viewer@example.com',
+                    'text': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40))),
+                }
+                for _ in range(min(popularity, 10))
+            ],
+            # оценки и ответы на отзывы добавляются после записи фильма
+            'ratings': [rnd.randint(1, 10) for _ in range(min(popularity * 3, 200))],
+            'replies': rnd.random(),
+        }
+
+
+def insert_replies(rnd, parents, chances):
+    """Ответы на отзывы [(id, id фильма)]; chances — доля отзывов фильма
+    с ответами. Возвращает ответы в том же виде для следующего уровня"""
+    rows = []
+    for parent_id, movie_id in parents:
+        if rnd.random() < chances[movie_id]:
+            rows += [
+                {
+                    'movie_id': movie_id, 'parent_id': parent_id, 'name': rnd.choice(NAMES),
+                    'email': 'reply@example.com', 'text': rnd.choice(WORDS),
+                }
+                for _ in range(rnd.randint(1, 2))
+            ]
+    if not rows:
+        return []
+    insert_rows(Review, rows)
+    # путь ответа — путь родителя и собственный id, известный после вставки
+    replies = Review.objects.filter(parent_id__in={row['parent_id'] for row in rows})
+    replies.filter(path='').update(path=Concat(
+        Subquery(Review.objects.filter(pk=OuterRef('parent_id')).values('path')[:1]),
+        LPad(Cast('id', models.CharField()), Review.PATH_STEP, Value('0')),
+        Value('/'),
+    ))
+    return list(replies.order_by('id').values_list('id', 'movie_id'))
+
+
+class CatalogueGenerator:
+    """Синтетический каталог пачками через импорт"""
+
+    def __init__(self, count, seed=1, batch_size=1000):
+        self.count = count
+        self.seed = seed
+        self.batch_size = batch_size
+        self.rnd = random.Random(seed + 1)
+        self.importer = CatalogueImporter()
+        self.processed = 0
+
+    def run(self, on_batch=None):
+        rows = records(self.count, self.seed)
+        while batch := list(islice(rows, self.batch_size)):
+            self.add_batch(batch)
+            self.processed += len(batch)
+            if on_batch:
+                on_batch(self)
+        self.finish()
+
+    def add_batch(self, batch):
+        extra = {record['url']: record for _, record in batch}
+        known = set(Movie.objects.filter(url__in=extra).values_list('url', flat=True))
+        self.importer.add_batch(batch)
+        # оценки и ответы только у фильмов, созданных этой пачкой
+        new = dict(
+            Movie.objects.filter(url__in=extra.keys() - known).values_list('id', 'url')
+        )
+        if not new:
+            return
+        with transaction.atomic():
+            insert_rows(Rating, [
+                {'movie_id': pk, 'ip': f'10.{k >> 16 & 255}.{k >> 8 & 255}.{k & 255}', 'rate': rate}
+                for pk, url in new.items()
+                for k, rate in enumerate(extra[url]['ratings'])
+            ])
+            chances = {pk: extra[url]['replies'] for pk, url in new.items()}
+            parents = list(Review.objects.filter(
+                movie_id__in=new, parent__isnull=True,
+            ).order_by('id').values_list('id', 'movie_id'))
+            for _ in range(REPLY_DEPTH):
+                parents = insert_replies(self.rnd, parents, chances)
+
+    def finish(self):
+        self.importer.finish()
+        # счетчики оценок и отзывов (с ответами) считаются по таблицам
+        aggregates.reconcile(batch_size=self.batch_size)
+        versions.bump('movie', 'rating', 'review')
@@ -1,18 +1,55 @@
 from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from movies import routers, thumbnails, versions
 from movies.models import Category, Movie
 
 register = template.Library()
 
 
 @register.simple_tag()
+@routers.replica_read
 def get_categories():
     """Вывод списка категорий"""
-
-    return Category.objects.all()
+    # список хранится в кэше до изменения любой категории
+    key = versions.key('movies:categories', 'category')
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.all())
+        if routers.cacheable('category'):
+            cache.set(key, categories, versions.FRAGMENT_TIMEOUT)
+    return categories
 
 
-@register.inclusion_tag('movies/tags/last_movie.html')
+@register.simple_tag()
+@routers.replica_read
 def get_last_movies(quantity=5):
     """Список последних добавленных"""
-    movies = Movie.objects.order_by('id')[:quantity]
-    return {'last_movies': movies}
+    # готовый фрагмент хранится в кэше до изменения любого фильма
+    key = versions.key(f'movies:last_movies:{quantity}', 'movie')
+    html = cache.get(key)
+    if html is None:
+        # последние по первичному ключу: обратный проход по индексу с LIMIT
+        movies = Movie.objects.filter(draft=False).only(
+            'title', 'poster', 'url'
+        ).order_by('-id')[:quantity]
+        html = render_to_string(
+            'movies/tags/last_movie.html', {'last_movies': movies}
+        )
+        if routers.cacheable('movie'):
+            cache.set(key, html, versions.FRAGMENT_TIMEOUT)
+    return mark_safe(html)
+
+
+@register.simple_tag()
+def picture(image, size, **attrs):
+    """Изображение с уменьшенными копиями: {% picture movie.poster 'card' class='img-fluid' %}"""
+    return thumbnails.picture(image, size, **attrs)
+
+
+@register.simple_tag()
+def thumbnail_url(image, size, extension='jpg'):
+    """Адрес уменьшенной копии или оригинала"""
+    return thumbnails.thumbnail_url(image, size, extension)
@@ -1,3 +1,1648 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.admin.sites import site
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+
+from movies import (
+    aggregates, async_views, boxoffice, facets, filmography, filters, instrumentation, ratings,
+    routers, search, similar, sqlite, staticfiles, thumbnails, urls, views,
+)
+from movies.management.commands import bench_asgi
+from movies.models import (
+    BoxOffice, Category, Facet, FilmCrew, Genre, Movie, MovieShot, Rating, Review, SimilarMovie,
+)
+from movies.pagination import KeysetPaginationMixin, decode_cursor, encode_cursor
+
+
+def create_movie(title='Фильм', url='film', **kwargs):
+    """Фильм со съемочной группой, жанром и кадром"""
+    category, _ = Category.objects.get_or_create(
+        url='films', defaults={'name': 'Фильмы', 'description': ''}
+    )
+    genre, _ = Genre.objects.get_or_create(
+        url='drama', defaults={'name': 'Драма', 'description': ''}
+    )
+    director, _ = FilmCrew.objects.get_or_create(
+        name='Режиссер', defaults={'description': '', 'image': 'crew/d.jpg'}
+    )
+    actor, _ = FilmCrew.objects.get_or_create(
+        name='Актер', defaults={'description': '', 'image': 'crew/a.jpg'}
+    )
+    kwargs.setdefault('description', '')
+    kwargs.setdefault('country', 'США')
+    movie = Movie.objects.create(
+        title=title, poster='movies/p.jpg', category=category, url=url, **kwargs
+    )
+    movie.genres.add(genre)
+    movie.director.add(director)
+    movie.actors.add(actor)
+    MovieShot.objects.create(
+        title='Кадр', description='', image='movie_shots/s.jpg', movie=movie
+    )
+    return movie
+
+
+def add_reviews(movie, count):
+    """Отзывы с одним ответом на каждый"""
+    for i in range(count):
+        review = Review.objects.create(
+            email='a@a.ru', name=f'Автор {i}', text='Текст', movie=movie
+        )
+        Review.objects.create(
+            email='b@b.ru', name=f'Ответ {i}', text='Текст',
+            movie=movie, parent=review
+        )
+
+
+class MovieDetailQueriesTest(TestCase):
+    """Число запросов страницы фильма"""
+
+    # фильм, режиссеры, актеры, жанры, кадры, похожие фильмы и страница
+    # веток отзывов (2 запроса); боковая панель и шапка читаются из кэша
+    DETAIL_QUERY_BUDGET = 8
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+        self.url = reverse('movie_detail', kwargs={'slug': self.movie.url})
+
+    def test_query_budget_does_not_depend_on_reviews(self):
+        # прогрев кэша боковой панели и шапки
+        self.client.get(self.url)
+        for count in (1, 50):
+            add_reviews(self.movie, count)
+            with self.assertNumQueries(self.DETAIL_QUERY_BUDGET):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_replies_are_nested(self):
+        add_reviews(self.movie, 2)
+        response = self.client.get(self.url)
+        reviews = response.context['reviews']
+        self.assertEqual([r.name for r in reviews], ['Автор 0', 'Автор 1'])
+        self.assertEqual([r.name for r in reviews[0].replies], ['Ответ 0'])
+
+
+class ReviewTreeTest(TestCase):
+    """Дерево отзывов на материализованных путях"""
+
+    def setUp(self):
+        self.movie = create_movie()
+
+    def review(self, name, parent=None):
+        return Review.objects.create(
+            email='a@a.ru', name=name, text='Текст',
+            movie=self.movie, parent=parent
+        )
+
+    def names(self, reviews):
+        return [review.name for review in reviews]
+
+    def test_thread_is_ordered_depth_first(self):
+        first = self.review('1')
+        second = self.review('2')
+        reply = self.review('1.1', first)
+        self.review('2.1', second)
+        self.review('1.1.1', reply)
+        self.assertEqual(
+            self.names(Review.objects.thread(self.movie)),
+            ['1', '1.1', '1.1.1', '2', '2.1'],
+        )
+        self.assertEqual(
+            self.names(Review.objects.subtree(first)), ['1', '1.1', '1.1.1']
+        )
+        self.assertEqual(Review.objects.get(name='1.1.1').depth, 2)
+
+    def test_thread_page(self):
+        for i in range(3):
+            root = self.review(f'{i}')
+            self.review(f'{i}.1', root)
+        reviews, next_after = Review.objects.thread_page(self.movie, limit=2)
+        self.assertEqual(self.names(reviews), ['0', '0.1', '1', '1.1'])
+        reviews, next_after = Review.objects.thread_page(
+            self.movie, after=next_after, limit=2
+        )
+        self.assertEqual(self.names(reviews), ['2', '2.1'])
+        self.assertIsNone(next_after)
+
+    def test_delete_detaches_replies(self):
+        root = self.review('1')
+        reply = self.review('1.1', root)
+        self.review('1.1.1', reply)
+        root.delete()
+        self.assertEqual(
+            self.names(Review.objects.thread(self.movie)), ['1.1', '1.1.1']
+        )
+        self.assertEqual(Review.objects.get(name='1.1').depth, 0)
+
+    def test_delete_several_reviews_of_one_thread(self):
+        root = self.review('1')
+        reply = self.review('1.1', root)
+        nested = self.review('1.1.1', reply)
+        self.review('1.1.1.1', nested)
+        Review.objects.filter(pk__in=[root.pk, reply.pk]).delete()
+        self.assertEqual(
+            self.names(Review.objects.thread(self.movie)), ['1.1.1', '1.1.1.1']
+        )
+        nested.refresh_from_db()
+        self.assertIsNone(nested.parent_id)
+        self.assertEqual(nested.path, f'{nested.pk:0{Review.PATH_STEP}d}/')
+        self.assertEqual(Review.objects.get(name='1.1.1.1').depth, 1)
+
+    def test_add_review_ignores_parent_of_other_movie(self):
+        other = create_movie(title='Другой', url='other')
+        foreign = Review.objects.create(
+            email='a@a.ru', name='Чужой', text='Текст', movie=other
+        )
+        self.client.post(
+            reverse('add_review', kwargs={'id': self.movie.id}),
+            {'name': 'Ответ', 'email': 'a@a.ru', 'text': 'Текст',
+             'parent': foreign.id},
+        )
+        self.assertIsNone(Review.objects.get(name='Ответ').parent)
+
+
+class FacetIndexTest(TestCase):
+    """Индекс значений фильтров"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie(year=1999)
+
+    def counts(self, kind):
+        return {
+            facet.label: facet.count for facet in facets.get_facets()[kind]
+        }
+
+    def test_counts_follow_movie_changes(self):
+        create_movie(title='Второй', url='second', year=1999)
+        self.assertEqual(self.counts(Facet.YEAR), {'1999': 2})
+        self.assertEqual(self.counts(Facet.GENRE), {'Драма': 2})
+
+        self.movie.year = 2001
+        self.movie.save()
+        self.assertEqual(self.counts(Facet.YEAR), {'1999': 1, '2001': 1})
+
+        comedy = Genre.objects.create(name='Комедия', description='', url='comedy')
+        self.movie.genres.set([comedy])
+        self.assertEqual(self.counts(Facet.GENRE), {'Драма': 1, 'Комедия': 1})
+
+        self.movie.delete()
+        self.assertEqual(self.counts(Facet.YEAR), {'1999': 1})
+        self.assertEqual(self.counts(Facet.GENRE), {'Драма': 1})
+
+    def test_admin_actions_refresh_counts(self):
+        model_admin = site._registry[Movie]
+        request = RequestFactory().post('/')
+        with mock.patch.object(model_admin, 'message_user'):
+            model_admin.unpublish(request, Movie.objects.all())
+            self.assertEqual(self.counts(Facet.YEAR), {})
+            model_admin.publish(request, Movie.objects.all())
+            self.assertEqual(self.counts(Facet.YEAR), {'1999': 1})
+
+    def test_sidebar_is_served_from_cache(self):
+        facets.get_facets()
+        with self.assertNumQueries(0):
+            facets.get_facets()
+
+
+class FilterMoviesTest(TestCase):
+    """Фильтр фильмов"""
+
+    def setUp(self):
+        cache.clear()
+        self.drama = Genre.objects.create(name='Драма', description='', url='drama')
+        self.comedy = Genre.objects.create(name='Комедия', description='', url='comedy')
+        self.movies = {}
+        for url, year, genres in (
+            ('a', 1991, [self.drama, self.comedy]),
+            ('b', 1995, [self.drama]),
+            ('c', 2005, [self.drama, self.comedy]),
+            ('d', 1995, [self.comedy]),
+        ):
+            movie = create_movie(title=url, url=url, year=year)
+            movie.genres.set(genres)
+            self.movies[url] = movie
+        create_movie(title='draft', url='draft', year=1995, draft=True)
+
+    def filter(self, params):
+        response = self.client.get(reverse('filter'), params)
+        return response, sorted(m.url for m in response.context['movie_list'])
+
+    def test_and_between_filters_or_within(self):
+        _, urls = self.filter({'year': ['1995', '2005'], 'genre': [self.drama.id]})
+        self.assertEqual(urls, ['b', 'c'])
+
+    def test_all_genres_in_year_range(self):
+        response, urls = self.filter({
+            'genre': [self.drama.id, self.comedy.id], 'genre_mode': 'all',
+            'year_from': '1990', 'year_to': '1999',
+        })
+        self.assertEqual(urls, ['a'])
+
+    def test_counts_exclude_own_filter(self):
+        response, urls = self.filter({'year': ['1995']})
+        self.assertEqual(urls, ['b', 'd'])
+        counts = response.context['view'].filter_result.counts
+        # годы считаются без учета выбранного года, черновики не входят
+        self.assertEqual(counts['year'], {'1991': 1, '1995': 2, '2005': 1})
+        self.assertEqual(
+            counts['genre'], {str(self.drama.id): 1, str(self.comedy.id): 1}
+        )
+
+    def test_index_follows_changes(self):
+        self.filter({})
+        self.movies['d'].draft = True
+        self.movies['d'].save()
+        _, urls = self.filter({'year': ['1995']})
+        self.assertEqual(urls, ['b'])
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_index_built_from_primary(self):
+        self.movies['d'].save()
+        with routers.replica_reads(), mock.patch('movies.routers.get_replica') as get_replica:
+            filters.get_index()
+        get_replica.assert_not_called()
+
+
+class KeysetPaginationTest(TestCase):
+    """Постраничный вывод по курсору"""
+
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            create_movie(title=f'{i}', url=f'movie-{i}', year=2000)
+        create_movie(title='draft', url='draft', draft=True)
+
+    def walk(self, url, params, page_size=2):
+        """Проходит все страницы, возвращает названия и SQL запросов"""
+        titles, sql, cursor = [], [], None
+        with mock.patch.object(KeysetPaginationMixin, 'paginate_by', page_size):
+            while True:
+                query = dict(params, **({'after': cursor} if cursor else {}))
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, query)
+                sql += [q['sql'] for q in queries.captured_queries]
+                titles += [m.title for m in response.context['movie_list']]
+                page = response.context['page_obj']
+                if not page.has_next():
+                    return titles, sql
+                cursor = page.next_cursor
+
+    def test_movie_list_pages(self):
+        titles, sql = self.walk(reverse('movie_list'), {})
+        self.assertEqual(titles, ['0', '1', '2', '3', '4'])
+        self.assertFalse([q for q in sql if 'OFFSET' in q or 'COUNT(' in q])
+
+    def test_filter_pages(self):
+        titles, _ = self.walk(reverse('filter'), {'year': '2000'})
+        self.assertEqual(titles, ['0', '1', '2', '3', '4'])
+
+    def test_cursor_is_stable_and_validated(self):
+        self.assertEqual(encode_cursor([42]), encode_cursor([42]))
+        self.assertEqual(decode_cursor(encode_cursor([42])), [42])
+        response = self.client.get(reverse('movie_list'), {'after': 'мусор'})
+        self.assertEqual(response.status_code, 200)
+        for values in ([None], ['abc'], [[1]]):
+            response = self.client.get(reverse('movie_list'), {'after': encode_cursor(values)})
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.context['view'].get_cursor())
+
+
+class SearchTest(TestCase):
+    """Полнотекстовый поиск"""
+
+    def setUp(self):
+        cache.clear()
+        self.pulp = create_movie(
+            title='Криминальное чтиво', url='pulp',
+            description='<p>Два <strong>бандита</strong> и боксер</p>',
+        )
+        self.other = create_movie(
+            title='Большой куш', url='snatch',
+            description='<p>Похоже на криминальное кино</p>',
+        )
+
+    def titles(self, query):
+        response = self.client.get(reverse('search'), {'q': query})
+        return [movie.title for movie in response.context['result'].movies]
+
+    def test_ranking_and_word_forms(self):
+        self.assertEqual(
+            self.titles('криминального'), ['Криминальное чтиво', 'Большой куш']
+        )
+        self.assertEqual(self.titles('чтива'), ['Криминальное чтиво'])
+
+    def test_markup_is_stripped_and_index_follows_changes(self):
+        self.assertEqual(self.titles('бандит'), ['Криминальное чтиво'])
+        self.assertEqual(self.titles('strong'), [])
+        self.pulp.delete()
+        self.assertEqual(self.titles('бандит'), [])
+
+    def test_crew_and_drafts(self):
+        self.other.draft = True
+        self.other.save()
+        result = search.search('Режиссер криминальное')
+        self.assertEqual(result.movies, [])
+        result = search.search('режиссер')
+        self.assertEqual([person.name for person in result.crew], ['Режиссер'])
+
+    def test_short_terms(self):
+        # слово короче трех букв ищется подстрокой в полях
+        self.assertEqual(self.titles('ку'), ['Большой куш'])
+
+    def test_drafts_do_not_take_places(self):
+        self.pulp.draft = True
+        self.pulp.save()
+        result = search.search('криминального', limit=1)
+        self.assertEqual([movie.title for movie in result.movies], ['Большой куш'])
+
+    def test_fallback_without_fts(self):
+        with mock.patch.object(search, 'tokenizer', return_value=None):
+            self.assertEqual(self.titles('чтиво'), ['Криминальное чтиво'])
+
+    def test_failed_rebuild_keeps_index(self):
+        with mock.patch.object(search, '_insert', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                search.rebuild()
+        self.assertEqual(self.titles('бандит'), ['Криминальное чтиво'])
+        self.assertEqual(search.rebuild(), 4)
+        self.assertEqual(self.titles('бандит'), ['Криминальное чтиво'])
+
+
+class MovieAggregatesTest(TestCase):
+    """Агрегаты оценок и отзывов в фильме"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+
+    def aggregates(self):
+        self.movie.refresh_from_db()
+        return (
+            self.movie.rating_count, self.movie.rating_sum,
+            self.movie.rating_avg, self.movie.rating_histogram,
+            self.movie.review_count,
+        )
+
+    def test_incremental_updates(self):
+        first = Rating.objects.create(ip='1.1.1.1', rate=4, movie=self.movie)
+        Rating.objects.create(ip='2.2.2.2', rate=9, movie=self.movie)
+        add_reviews(self.movie, 1)
+        self.assertEqual(self.aggregates(), (2, 13, 6.5, {'4': 1, '9': 1}, 2))
+
+        first = Rating.objects.get(pk=first.pk)
+        first.rate = 9
+        first.save()
+        self.assertEqual(self.aggregates(), (2, 18, 9.0, {'9': 2}, 2))
+
+        first.delete()
+        Review.objects.filter(parent__isnull=False).delete()
+        self.assertEqual(self.aggregates(), (1, 9, 9.0, {'9': 1}, 1))
+
+    def test_save_keeps_aggregates(self):
+        stale = Movie.objects.get(pk=self.movie.pk)
+        Rating.objects.create(ip='1.1.1.1', rate=7, movie=self.movie)
+        add_reviews(self.movie, 1)
+        # фильм, загруженный до оценки и отзыва, сохраняется без агрегатов
+        stale.title = 'Новое название'
+        stale.save()
+        self.assertEqual(self.aggregates(), (1, 7, 7.0, {'7': 1}, 2))
+        self.assertEqual(self.movie.title, 'Новое название')
+
+    def test_reconcile_repairs_drift(self):
+        Rating.objects.create(ip='1.1.1.1', rate=7, movie=self.movie)
+        add_reviews(self.movie, 2)
+        expected = self.aggregates()
+        Movie.objects.filter(pk=self.movie.pk).update(
+            rating_count=10, rating_histogram={}, review_count=0
+        )
+        self.assertEqual(aggregates.reconcile(batch_size=1), (1, 1))
+        self.assertEqual(self.aggregates(), expected)
+        self.assertEqual(aggregates.reconcile(), (1, 0))
+
+    def test_list_sorted_by_rating(self):
+        other = create_movie(title='Другой', url='other')
+        Rating.objects.create(ip='1.1.1.1', rate=3, movie=self.movie)
+        Rating.objects.create(ip='1.1.1.1', rate=8, movie=other)
+        with mock.patch.object(KeysetPaginationMixin, 'paginate_by', 1):
+            response = self.client.get(reverse('movie_list'), {'sort': 'rating'})
+            self.assertEqual(
+                [m.title for m in response.context['movie_list']], ['Другой']
+            )
+            cursor = response.context['page_obj'].next_cursor
+            response = self.client.get(
+                reverse('movie_list'), {'sort': 'rating', 'after': cursor}
+            )
+        self.assertEqual([m.title for m in response.context['movie_list']], ['Фильм'])
+
+
+class RatingIngestionTest(TestCase):
+    """Прием оценок через буфер"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+
+    def test_votes_are_upserted_with_aggregates(self):
+        Rating.objects.create(ip='1.1.1.1', rate=2, movie=self.movie)
+        written = ratings.write_votes({
+            (self.movie.pk, '1.1.1.1'): 8,
+            (self.movie.pk, '2.2.2.2'): 6,
+            (10 ** 6, '3.3.3.3'): 5,
+        })
+        self.assertEqual(written, 2)
+        self.assertEqual(
+            dict(Rating.objects.values_list('ip', 'rate')),
+            {'1.1.1.1': 8, '2.2.2.2': 6},
+        )
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 2)
+        self.assertEqual(self.movie.rating_histogram, {'6': 1, '8': 1})
+
+    def test_endpoint_buffers_until_batch_is_full(self):
+        buffer = ratings.RatingBuffer(max_size=2, max_delay=60)
+        url = reverse('add_rating')
+        with mock.patch.object(ratings, '_buffer', buffer):
+            response = self.client.post(url, {'movie': self.movie.pk, 'star': 3})
+            self.assertEqual(response.status_code, 202)
+            # повторный голос с того же адреса заменяет прежний в буфере
+            self.client.post(url, {'movie': self.movie.pk, 'star': 9})
+            self.assertEqual(len(buffer), 1)
+            self.assertFalse(Rating.objects.exists())
+            self.client.post(
+                url, {'movie': self.movie.pk, 'star': 5}, REMOTE_ADDR='10.0.0.1'
+            )
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            dict(Rating.objects.values_list('ip', 'rate')),
+            {'127.0.0.1': 9, '10.0.0.1': 5},
+        )
+
+    def test_failed_flush_is_retried(self):
+        buffer = ratings.RatingBuffer(max_size=10, max_delay=60, max_retries=1)
+        self.addCleanup(buffer.flush)
+        buffer.add(self.movie.pk, '1.1.1.1', 3)
+        buffer.add(self.movie.pk, '2.2.2.2', 4)
+
+        def locked(votes):
+            # голос, поданный во время сброса, новее возвращенного в буфер
+            buffer.add(self.movie.pk, '1.1.1.1', 7)
+            raise OperationalError('database is locked')
+
+        with mock.patch.object(ratings, 'write_votes', side_effect=locked), \
+                self.assertLogs('movies.ratings', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(buffer), 2)
+        self.assertIsNotNone(buffer._timer)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(
+            dict(Rating.objects.values_list('ip', 'rate')), {'1.1.1.1': 7, '2.2.2.2': 4}
+        )
+
+        buffer.add(self.movie.pk, '3.3.3.3', 5)
+        with mock.patch.object(ratings, 'write_votes', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('movies.ratings', 'ERROR') as logs:
+            buffer.flush()
+            buffer.flush()
+        self.assertIn('потеряны', logs.output[-1])
+        self.assertEqual(len(buffer), 0)
+
+    def test_endpoint_rejects_bad_votes(self):
+        url = reverse('add_rating')
+        self.assertEqual(
+            self.client.post(url, {'movie': self.movie.pk, 'star': 11}).status_code, 400
+        )
+        self.assertEqual(
+            self.client.post(url, {'movie': 10 ** 6, 'star': 5}).status_code, 404
+        )
+
+
+class FragmentCacheTest(TestCase):
+    """Кэш фрагментов шапки и боковой панели"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+
+    def render(self):
+        return Template(
+            '{% load movie_tag %}{% get_categories as categories %}'
+            '{% for c in categories %}{{ c.name }};{% endfor %}'
+            '{% get_last_movies quantity=2 %}'
+        ).render(Context())
+
+    def test_fragments_are_cached_until_version_changes(self):
+        first = self.render()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), first)
+
+        Category.objects.create(name='Сериалы', description='', url='series')
+        create_movie(title='Новинка', url='new')
+        with self.assertNumQueries(2):
+            html = self.render()
+        self.assertIn('Сериалы;', html)
+        self.assertIn('Новинка', html)
+
+
+class ConditionalPageTest(TestCase):
+    """ETag, Last-Modified и кэш страниц"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+
+    def test_not_modified_without_queries(self):
+        url = reverse('movie_list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('private', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_page_is_served_until_movie_changes(self):
+        url = reverse('movie_list')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(cached['ETag'], first['ETag'])
+
+        create_movie(title='Новинка', url='new')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertContains(response, 'Новинка')
+
+    def test_detail_page_is_private(self):
+        url = self.movie.get_absolute_url()
+        response = self.client.get(url)
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Review.objects.create(name='Гость', email='g@example.com', text='Отзыв', movie=self.movie)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    # основная база выступает своей же репликой, чтобы запросы выполнялись
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_fresh_page_from_replica_is_not_stored(self):
+        url = reverse('movie_list')
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertIn('no-store', response['Cache-Control'])
+        with mock.patch('movies.routers.get_lag', return_value=0):
+            response = self.client.get(url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertNotIn('no-store', response['Cache-Control'])
+
+
+class ThumbnailTest(TestCase):
+    """Уменьшенные копии изображений"""
+
+    def setUp(self):
+        from PIL import Image
+
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(MEDIA_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.root, 'movies'))
+        self.path = os.path.join(self.root, 'movies', 'p.jpg')
+        Image.new('RGB', (600, 900), (200, 30, 30)).save(self.path)
+        self.movie = create_movie()
+
+    def test_original_until_derivatives_are_built(self):
+        html = thumbnails.picture(self.movie.poster, 'card', alt='Фильм')
+        self.assertEqual(html, '<img src="/media/movies/p.jpg" alt="Фильм">')
+
+    def test_picture_with_srcset(self):
+        address, created = thumbnails.render(self.path, self.root)
+        self.assertTrue(created)
+        self.assertEqual(thumbnails.render(self.path, self.root), (address, False))
+
+        html = thumbnails.picture(self.movie.poster, 'card', alt='Фильм')
+        prefix = f'/media/thumbs/{address[:2]}/{address}/'
+        self.assertIn(
+            f'srcset="{prefix}card-270.webp 270w, {prefix}card-540.webp 540w"', html
+        )
+        self.assertIn(f'<img src="{prefix}card-270.jpg"', html)
+        # маленький оригинал не увеличивается
+        self.assertEqual(
+            thumbnails.get_manifest(self.movie.poster)['detail']['jpg'][-1][1], 600
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                thumbnails.thumbnail_url(self.movie.poster, 'admin'),
+                f'{prefix}admin-100.jpg',
+            )
+
+    def test_scheduled_only_for_new_image(self):
+        def scheduled(save):
+            with mock.patch.object(thumbnails, 'schedule') as schedule, \
+                    self.captureOnCommitCallbacks(execute=True):
+                save()
+            return [call.args[0].name for call in schedule.call_args_list]
+
+        self.assertIn('movies/p.jpg', scheduled(lambda: create_movie(url='new')))
+        self.movie.title = 'Другое название'
+        self.assertEqual(scheduled(self.movie.save), [])
+        self.movie.poster = 'movies/other.jpg'
+        self.assertEqual(scheduled(lambda: self.movie.save(update_fields=['title'])), [])
+        self.assertEqual(scheduled(self.movie.save), ['movies/other.jpg'])
+        # загрузка фикстур (raw) копий не строит
+        self.movie.poster = 'movies/fixture.jpg'
+        fixture = serializers.serialize('json', [self.movie])
+        self.assertEqual(scheduled(lambda: [
+            obj.save() for obj in serializers.deserialize('json', fixture)
+        ]), [])
+
+    def test_replaced_original_is_not_hashed(self):
+        from PIL import Image
+
+        thumbnails.render(self.path, self.root)
+        Image.new('RGB', (300, 300), (0, 0, 200)).save(self.path)
+        cache.clear()
+        # при выводе оригинал не читается: размер другой — копий нет
+        with mock.patch('movies.thumbnails.digest') as hashed:
+            self.assertIsNone(thumbnails.get_manifest(self.movie.poster))
+        hashed.assert_not_called()
+        address, _ = thumbnails.render(self.path, self.root)
+        cache.clear()
+        self.assertIn(address, thumbnails.thumbnail_url(self.movie.poster, 'card'))
+
+
+class AsyncViewsTest(TestCase):
+    """Асинхронные страницы дают тот же результат, что и синхронные"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+        for i in range(13):
+            create_movie(title=f'Фильм {i}', url=f'film-{i}', year=2000 + i % 2)
+        add_reviews(self.movie, 3)
+
+    async def render(self, view, path, **kwargs):
+        # одинаковые страницы не должны браться из общего кэша
+        await cache.aclear()
+        response = await view.as_view()(AsyncRequestFactory().get(path), **kwargs)
+        if hasattr(response, 'render'):
+            await sync_to_async(response.render)()
+        return response
+
+    async def test_lists_match_sync_views(self):
+        for name, params in (('movie_list', ''), ('filter', '?year=2001')):
+            path = reverse(name) + params
+            sync_view = getattr(views, 'MoviesView' if name == 'movie_list' else 'FilterMoviesView')
+            async_view = getattr(async_views, sync_view.__name__)
+            expected = await sync_to_async(
+                lambda: sync_view.as_view()(RequestFactory().get(path)).render().content
+            )()
+            response = await self.render(async_view, path)
+            self.assertEqual(response.content, expected)
+
+    async def test_filmcrew_matches_sync_view(self):
+        person = await FilmCrew.objects.aget(name='Актер')
+        path = person.get_absolute_url()
+        expected = await sync_to_async(
+            lambda: views.FilmCrewView.as_view()(RequestFactory().get(path), slug=person.slug)
+            .render().content
+        )()
+        response = await self.render(async_views.FilmCrewView, path, slug=person.slug)
+        self.assertEqual(response.content, expected)
+        self.assertContains(response, 'Фильм 12')
+
+    async def test_cache_is_not_blocking(self):
+        loop_thread = threading.get_ident()
+
+        def off_loop(method):
+            # aget и другие асинхронные методы locmem вызывают синхронные
+            # через sync_to_async — в другом потоке
+            def wrapper(*args, **kwargs):
+                self.assertNotEqual(threading.get_ident(), loop_thread, method.__name__)
+                return method(*args, **kwargs)
+            return wrapper
+
+        for name in ('get', 'get_many', 'set', 'add'):
+            patcher = mock.patch.object(cache, name, off_loop(getattr(cache, name)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        path = reverse('movie_list')
+        response = await async_views.MoviesView.as_view()(AsyncRequestFactory().get(path))
+        self.assertIn('ETag', response)
+        cached = await async_views.MoviesView.as_view()(
+            AsyncRequestFactory().get(path, headers={'If-None-Match': response['ETag']})
+        )
+        self.assertEqual(cached.status_code, 304)
+
+    def test_detail_prefetches_related(self):
+        view = async_to_sync(async_views.MovieDetailView.as_view())
+        url = self.movie.get_absolute_url()
+        view(AsyncRequestFactory().get(url), slug=self.movie.url).render()
+        # те же запросы, что и у синхронной страницы
+        with self.assertNumQueries(MovieDetailQueriesTest.DETAIL_QUERY_BUDGET):
+            response = view(AsyncRequestFactory().get(url), slug=self.movie.url).render()
+        self.assertContains(response, 'Ответ 2')
+
+    async def test_add_review(self):
+        request = AsyncRequestFactory().post(
+            '/', {'name': 'Гость', 'email': 'g@g.ru', 'text': 'Отзыв'}
+        )
+        response = await async_views.AddReview.as_view()(request, id=self.movie.id)
+        self.assertEqual(response.status_code, 302)
+        await sync_to_async(self.movie.refresh_from_db)()
+        self.assertEqual(self.movie.review_count, 7)
+
+    def test_bench_paths_exist(self):
+        command = bench_asgi.Command()
+        for path in command.get_paths():
+            self.assertEqual(self.client.get(path).status_code, 200, path)
+        with self.assertRaisesMessage(CommandError, '/missing/ (404)'):
+            command.check_failures([('/missing/', 404), ('/missing/', 404)])
+
+
+async def event_loop_probe(request):
+    """Представление, запоминающее поток, в котором оно выполнилось"""
+    AsgiMiddlewareTest.threads.append(threading.get_ident())
+    return HttpResponse(str(await Movie.objects.acount()))
+
+
+class AsgiUrls:
+    urlpatterns = [path('probe/', event_loop_probe, name='probe')]
+
+
+@override_settings(ROOT_URLCONF=AsgiUrls)
+class AsgiMiddlewareTest(TestCase):
+    """Под ASGI middleware проекта не переводят запрос в поток"""
+    threads = []
+
+    async def test_view_runs_on_event_loop(self):
+        await cache.aclear()
+        self.threads.clear()
+        # синхронный middleware Django оборачивает в sync_to_async и при
+        # DEBUG пишет об этом в журнал django.request
+        with override_settings(DEBUG=True), \
+                self.assertNoLogs('django.request', 'DEBUG'):
+            response = await self.async_client.get('/probe/')
+            stats = await sync_to_async(instrumentation.histograms)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.threads, [threading.get_ident()])
+        # запрос ORM выполнился в другом потоке, но попал в счетчики
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertEqual(stats['probe']['count'], 1)
+
+
+class CatalogueImportTest(TestCase):
+    """Импорт каталога командой import_catalogue"""
+
+    RECORDS = [
+        {
+            'url': 'first', 'title': 'Первый', 'year': 2001, 'category': 'films',
+            'genres': ['drama', 'comedy'], 'director': ['Режиссер'],
+            'actors': ['Актер', 'Новый актер'],
+            'shots': [{'title': 'Кадр', 'image': 'movie_shots/1.jpg'}],
+            'reviews': [{'name': 'Зритель', 'email': 'z@z.ru', 'text': 'Отлично'}],
+        },
+        {'url': 'second', 'title': 'Второй', 'year': 2002, 'genres': ['drama']},
+        {'url': 'bad', 'title': 'Ошибка', 'year': 'не год'},
+        {'url': 'first', 'title': 'Повтор'},
+    ]
+
+    def setUp(self):
+        cache.clear()
+        create_movie()
+        self.path = os.path.join(tempfile.mkdtemp(), 'catalogue.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in self.RECORDS:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def load(self, path, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalogue', path, '--batch-size', '2', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_is_idempotent(self):
+        out, err = self.load(self.path)
+        self.assertIn('Импортировано фильмов: 2, пропущено: 1, ошибок: 1', out)
+        self.assertIn('Строка 3: year', err)
+
+        movie = Movie.objects.get(url='first')
+        self.assertEqual(movie.category.url, 'films')
+        self.assertEqual(sorted(movie.genres.values_list('url', flat=True)), ['comedy', 'drama'])
+        # существующий член группы найден по имени, новый создан
+        self.assertEqual(FilmCrew.objects.filter(name='Актер').count(), 1)
+        self.assertEqual(
+            sorted(movie.actors.values_list('name', flat=True)), ['Актер', 'Новый актер']
+        )
+        self.assertEqual(movie.movieshot_set.count(), 1)
+        self.assertEqual(movie.review_count, 1)
+        self.assertEqual(list(Review.objects.thread(movie)), list(movie.get_review()))
+        self.assertIn(movie, search.search('Первый').movies)
+        self.assertEqual(
+            Facet.objects.get(kind=Facet.YEAR, value='2002').count, 1
+        )
+
+        out, _ = self.load(self.path)
+        self.assertIn('Импортировано фильмов: 0, пропущено: 3', out)
+        self.assertEqual(Movie.objects.count(), 3)
+
+    def test_csv(self):
+        path = os.path.join(os.path.dirname(self.path), 'catalogue.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['url', 'title', 'genres', 'director', 'reviews'])
+            writer.writerow([
+                'csv-film', 'Из CSV', 'drama|thriller', 'Режиссер',
+                json.dumps([{'text': 'Первый отзыв'}, {'text': 'Второй'}]),
+            ])
+        self.load(path)
+        movie = Movie.objects.get(url='csv-film')
+        self.assertEqual(sorted(movie.genres.values_list('url', flat=True)), ['drama', 'thriller'])
+        self.assertEqual(movie.review_count, 2)
+
+
+class ExportTest(TestCase):
+    """Потоковая выгрузка каталога"""
+
+    def setUp(self):
+        cache.clear()
+        self.movies = [create_movie(title=f'Фильм {i}', url=f'film-{i}') for i in range(5)]
+        create_movie(title='Черновик', url='draft', draft=True)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export'), params)
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content).decode()
+        return response, [json.loads(line) for line in body.splitlines()]
+
+    def test_nested_relations_in_bounded_queries(self):
+        # фильмы, категории соединением, по запросу на каждую связь
+        with self.assertNumQueries(4):
+            response, rows = self.export()
+        self.assertEqual([row['url'] for row in rows], [f'film-{i}' for i in range(5)])
+        self.assertEqual(rows[0]['director'], [{'id': rows[0]['director'][0]['id'], 'name': 'Режиссер'}])
+        self.assertEqual(rows[0]['genres'][0]['url'], 'drama')
+        self.assertEqual(rows[0]['category']['url'], 'films')
+        self.assertIn('X-Export-Version', response)
+
+    def test_incremental_export(self):
+        _, rows = self.export()
+        version = timezone.now().isoformat()
+        self.assertEqual(len(self.export(since=version)[1]), 0)
+
+        Rating.objects.create(ip='1.1.1.1', rate=7, movie=self.movies[1])
+        self.movies[3].actors.add(FilmCrew.objects.create(name='Новый', description=''))
+        _, rows = self.export(since=version)
+        self.assertEqual([row['url'] for row in rows], ['film-1', 'film-3'])
+        self.assertEqual(rows[0]['rating']['count'], 1)
+
+        self.assertEqual(self.client.get(reverse('export'), {'since': 'вчера'}).status_code, 400)
+
+    def test_incremental_export_tombstones(self):
+        version = timezone.now().isoformat()
+        site._registry[Movie].unpublish(mock.Mock(), Movie.objects.filter(pk=self.movies[2].pk))
+        deleted_id = self.movies[4].pk
+        self.movies[4].delete()
+        _, rows = self.export(since=version)
+        self.assertEqual(
+            [(row['id'], row['url'], row.get('removed')) for row in rows],
+            [(self.movies[2].pk, 'film-2', True), (deleted_id, 'film-4', True)],
+        )
+        self.assertEqual(set(rows[0]), {'id', 'url', 'removed', 'updated'})
+        # полная выгрузка tombstone не содержит
+        self.assertNotIn('removed', json.dumps(self.export()[1]))
+
+    def test_json_array_command(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_catalogue', '--format', 'json', '--drafts', stdout=out, stderr=err)
+        self.assertEqual(len(json.loads(out.getvalue())), 6)
+        self.assertIn('Выгружено фильмов: 6', err.getvalue())
+
+
+class ApiTest(TestCase):
+    """JSON API: поля, связи, курсор, ETag"""
+
+    def setUp(self):
+        cache.clear()
+        self.movies = [
+            create_movie(title=f'Фильм {i}', url=f'film-{i}', rating_avg=i) for i in range(5)
+        ]
+        create_movie(title='Черновик', url='draft', draft=True)
+
+    def get(self, name, params=None, **kwargs):
+        return self.client.get(reverse(name, kwargs=kwargs or None), params or {})
+
+    def test_sparse_fields(self):
+        data = self.get('api_movies', {'fields': 'title,poster'}).json()['data']
+        self.assertEqual(data[0], {'id': self.movies[0].pk, 'title': 'Фильм 0', 'poster': '/media/movies/p.jpg'})
+        self.assertEqual(len(data), 5)
+        response = self.get('api_movies', {'fields': 'title,rating_sum'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.json()['errors'])
+
+    def test_include_in_bounded_queries(self):
+        # фильмы, категории, по два запроса на связь многие-ко-многим
+        with self.assertNumQueries(6):
+            data = self.get('api_movies', {'include': 'category,genres,director'}).json()['data']
+        self.assertEqual(data[0]['category']['url'], 'films')
+        self.assertEqual([genre['url'] for genre in data[4]['genres']], ['drama'])
+        self.assertEqual(data[0]['director'][0]['name'], 'Режиссер')
+
+        crew = FilmCrew.objects.get(name='Актер')
+        data = self.get('api_crew_detail', {'include': 'acted'}, lookup=crew.pk).json()['data']
+        self.assertEqual([movie['url'] for movie in data['acted']], [f'film-{i}' for i in range(5)])
+        self.assertEqual(self.get('api_movies', {'include': 'reviews'}).status_code, 400)
+
+    def test_cursor(self):
+        urls = []
+        params = {'sort': 'rating', 'limit': 2, 'fields': 'url'}
+        while True:
+            body = self.get('api_movies', params).json()
+            urls += [movie['url'] for movie in body['data']]
+            if body['next'] is None:
+                break
+            response = self.client.get(body['next'])
+            params = response.wsgi_request.GET
+        self.assertEqual(urls, [f'film-{i}' for i in reversed(range(5))])
+        self.assertEqual(self.get('api_movie', lookup='draft').status_code, 404)
+
+        for values in (['abc'], [None], [None, 1]):
+            response = self.get('api_movies', {'after': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('after', response.json()['errors'])
+        response = self.get('api_movies', {'sort': 'rating', 'after': encode_cursor(['x', 1])})
+        self.assertEqual(response.status_code, 400)
+
+    def test_etag(self):
+        response = self.get('api_movie', lookup='film-1')
+        self.assertEqual(response.json()['data']['title'], 'Фильм 1')
+        self.assertIn('max-age=60', response['Cache-Control'])
+        response = self.client.get(
+            reverse('api_movie', kwargs={'lookup': 'film-1'}), HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+        Genre.objects.filter(url='drama').get().save()
+        response = self.client.get(
+            reverse('api_movie', kwargs={'lookup': 'film-1'}), HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ReplicaRoutingTest(TestCase):
+    """Чтение с реплик и чтение своих записей"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Movie), 'default')
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Movie), 'replica1')
+            self.assertEqual(router.db_for_write(Review), 'default')
+            # после записи остаток блока читает из основной базы
+            self.assertEqual(router.db_for_read(Movie), 'default')
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Movie), 'replica1')
+        self.assertFalse(router.allow_migrate('replica1', 'movies'))
+
+    # основная база выступает своей же репликой, чтобы запросы выполнялись
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_sticky_after_post(self):
+        url = self.movie.get_absolute_url()
+        with mock.patch('movies.routers.get_replica', wraps=routers.get_replica) as get_replica:
+            self.client.get(url)
+            self.assertTrue(get_replica.called)
+
+            response = self.client.post(
+                reverse('add_review', kwargs={'id': self.movie.pk}),
+                {'name': 'Автор', 'email': 'a@a.ru', 'text': 'Текст'},
+            )
+            self.assertIn(routers.PIN_COOKIE, response.cookies)
+            get_replica.reset_mock()
+            response = self.client.get(url)
+            self.assertContains(response, 'Автор')
+            self.assertFalse(get_replica.called)
+
+            self.client.cookies.pop(routers.PIN_COOKIE)
+            cache.clear()
+            self.client.get(url)
+            self.assertTrue(get_replica.called)
+
+
+class SqlitePragmaTest(TestCase):
+    """PRAGMA из настроек для каждого соединения"""
+
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -1234, 'busy_timeout': 4321})
+    def test_pragmas_applied(self):
+        sqlite.apply_pragmas(sender=None, connection=connection)
+        self.assertEqual(sqlite.get_pragmas(connection), {'cache_size': -1234, 'busy_timeout': 4321})
+
+
+def seed_catalogue(movies=60, crew=40, genres=6):
+    """Каталог с разными жанрами, съемочной группой, отзывами и оценками"""
+    categories = [
+        Category.objects.create(name=f'Категория {i}', url=f'category-{i}', description='')
+        for i in range(3)
+    ]
+    genre_list = [
+        Genre.objects.create(name=f'Жанр {i}', url=f'genre-{i}', description='')
+        for i in range(genres)
+    ]
+    people = [
+        FilmCrew.objects.create(name=f'Человек {i}', description='', image=f'crew/{i}.jpg')
+        for i in range(crew)
+    ]
+    movie_list = []
+    for i in range(movies):
+        movie = Movie.objects.create(
+            title=f'Фильм {i}', tagline='Слоган', description='Описание', country='США',
+            poster='movies/p.jpg', year=2000 + i % 10, category=categories[i % 3],
+            url=f'movie-{i}', draft=i % 12 == 0,
+        )
+        movie.genres.add(genre_list[i % genres], genre_list[(i + 1) % genres])
+        movie.director.add(people[i % crew])
+        movie.actors.add(*(people[(i + k) % crew] for k in range(1, 4)))
+        MovieShot.objects.create(title='Кадр', description='', image='movie_shots/s.jpg', movie=movie)
+        if i % 3 == 0:
+            add_reviews(movie, 3)
+        for k in range(i % 4):
+            Rating.objects.create(ip=f'10.0.0.{k}', rate=k + 5, movie=movie)
+        movie_list.append(movie)
+    return movie_list
+
+
+class QueryBudgetTest(TestCase):
+    """Число запросов и планы запросов каждого адреса movies/urls.py"""
+
+    # маленькие справочники читаются целиком намеренно
+    SCAN_ALLOWED = {'movies_category', 'movies_genre', 'movies_facet'}
+    SCAN = re.compile(r'^SCAN (\w+)$')
+
+    def setUp(self):
+        cache.clear()
+        self.movies = seed_catalogue()
+        self.movie = self.movies[3]
+        self.person = FilmCrew.objects.get(name='Человек 5')
+        self.genre = Genre.objects.get(url='genre-1')
+        self.category = Category.objects.get(url='category-1')
+
+    def get_cases(self):
+        """(имя адреса, kwargs, метод, данные, бюджет запросов без кэша)"""
+        return [
+            ('movie_list', {}, 'get', {}, 4),
+            ('filter', {}, 'get', {'genre': self.genre.pk, 'year': 2003}, 6),
+            ('search', {}, 'get', {'q': 'Фильм'}, 5),
+            ('movie_detail', {'slug': self.movie.url}, 'get', {}, 11),
+            ('add_review', {'id': self.movie.pk}, 'post',
+             {'name': 'Автор', 'email': 'a@a.ru', 'text': 'Текст'}, 6),
+            ('add_rating', {}, 'post', {'movie': self.movie.pk, 'star': 3}, 12),
+            ('export', {}, 'get', {}, 4),
+            # без входа в админку — перенаправление без запросов к базе
+            ('request_stats', {}, 'get', {}, 0),
+            ('box_office', {}, 'get', {}, 0),
+            ('filmcrew_detail', {'slug': self.person.slug}, 'get', {}, 5),
+            ('api_movies', {}, 'get', {'include': 'category,genres,director,actors'}, 8),
+            ('api_movie', {'lookup': self.movie.url}, 'get', {'include': 'genres'}, 3),
+            ('api_crew', {}, 'get', {'include': 'directed,acted'}, 5),
+            ('api_crew_detail', {'lookup': self.person.pk}, 'get', {'include': 'acted'}, 3),
+            ('api_genres', {}, 'get', {}, 1),
+            ('api_genre', {'lookup': self.genre.url}, 'get', {}, 1),
+            ('api_categories', {}, 'get', {}, 1),
+            ('api_category', {'lookup': self.category.url}, 'get', {}, 1),
+        ]
+
+    def request(self, name, kwargs, method, data):
+        response = getattr(self.client, method)(reverse(name, kwargs=kwargs), data)
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, name)
+        return response
+
+    def scans(self, queries):
+        """Полные проходы по таблицам в планах запросов"""
+        found = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for *_, detail in cursor.fetchall():
+                    match = self.SCAN.match(detail)
+                    # первые строки таблицы по порядку (первая страница API) — не полный проход
+                    bounded = ' WHERE ' not in sql and ' LIMIT ' in sql
+                    if match and match.group(1) not in self.SCAN_ALLOWED and not bounded:
+                        found.append(f'{detail}: {sql}')
+        return found
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, {case[0] for case in self.get_cases()})
+
+    def test_query_budgets_and_plans(self):
+        for name, kwargs, method, data, budget in self.get_cases():
+            with self.subTest(name):
+                # без кэша: все фрагменты и индексы строятся заново
+                cache.clear()
+                # голос записывается сразу, в пределах запроса
+                buffer = ratings.RatingBuffer(max_size=1, max_delay=60)
+                with mock.patch.object(ratings, '_buffer', buffer), \
+                        CaptureQueriesContext(connection) as queries:
+                    self.request(name, kwargs, method, data)
+                self.assertLessEqual(len(queries), budget)
+                self.assertEqual(self.scans(queries.captured_queries), [])
+
+    def test_scan_is_detected(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Movie.objects.filter(title='Фильм 1'))
+        self.assertEqual(len(self.scans(queries.captured_queries)), 1)
+
+
+class SyntheticCatalogueTest(TestCase):
+    """Воспроизводимый синтетический каталог"""
+
+    def test_generate(self):
+        out = io.StringIO()
+        call_command('generate_catalogue', '--movies', '40', '--batch-size', '15', stdout=out)
+        self.assertIn('Создано фильмов: 40', out.getvalue())
+        self.assertEqual(Movie.objects.count(), 40)
+        self.assertTrue(Rating.objects.exists())
+        for reply in Review.objects.exclude(parent=None).select_related('parent'):
+            self.assertTrue(reply.path.startswith(reply.parent.path))
+        # счетчики фильмов совпадают с таблицами
+        self.assertEqual(aggregates.reconcile(dry_run=True), (40, 0))
+        slugs = list(FilmCrew.objects.values_list('slug', flat=True))
+        self.assertTrue(all(slugs))
+        self.assertEqual(len(set(slugs)), len(slugs))
+        first = list(Movie.objects.order_by('url').values_list('url', 'title', 'rating_count'))
+
+        # повторный запуск ничего не добавляет
+        call_command('generate_catalogue', '--movies', '40', stdout=io.StringIO())
+        self.assertEqual(Movie.objects.count(), 40)
+        Movie.objects.all().delete()
+        call_command('generate_catalogue', '--movies', '40', stdout=io.StringIO())
+        self.assertEqual(
+            list(Movie.objects.order_by('url').values_list('url', 'title', 'rating_count')), first
+        )
+
+
+class RequestStatsTest(TestCase):
+    """Server-Timing, гистограммы по адресам и журнал медленных запросов"""
+
+    def setUp(self):
+        cache.clear()
+        self.movie = create_movie()
+
+    def test_server_timing(self):
+        response = self.client.get(self.movie.get_absolute_url())
+        timing = dict(
+            part.strip().split(';', 1) for part in response['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(timing), {'db', 'tpl', 'cache', 'app', 'total'})
+        queries = int(re.search(r'desc="(\d+) queries"', timing['db']).group(1))
+        self.assertGreater(queries, 0)
+        self.assertNotEqual(timing['tpl'], 'dur=0.0')
+        # фрагменты страницы ищутся в кэше
+        self.assertRegex(timing['cache'], r'desc="\d+ hits / [1-9]\d* misses"')
+
+    def test_histograms(self):
+        for _ in range(3):
+            self.client.get(reverse('movie_list'))
+        self.client.get('/no-such-page/')
+        stats = instrumentation.histograms()
+        self.assertEqual(stats['movie_list']['count'], 3)
+        self.assertEqual(sum(stats['movie_list']['buckets'].values()), 3)
+        self.assertEqual(stats['<unresolved>']['count'], 1)
+
+        # с LocMemCache команда в отдельном процессе гистограмм не увидит
+        with self.assertRaises(CommandError):
+            call_command('request_stats', stdout=io.StringIO())
+        out = io.StringIO()
+        with mock.patch('movies.instrumentation.is_shared', return_value=True):
+            call_command('request_stats', '--json', '--reset', stdout=out, stderr=io.StringIO())
+        self.assertEqual(json.loads(out.getvalue())['movie_list']['count'], 3)
+        self.assertEqual(instrumentation.histograms(), {})
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs('movies.instrumentation', 'WARNING') as logs:
+            self.client.get(self.movie.get_absolute_url())
+        self.assertIn('movie_detail', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_stats_page_for_staff(self):
+        self.assertEqual(self.client.get(reverse('request_stats')).status_code, 302)
+        user = get_user_model().objects.create_user('staff', is_staff=True)
+        self.client.force_login(user)
+        self.client.get(reverse('movie_list'))
+        response = self.client.get(reverse('request_stats'))
+        self.assertEqual(response.json()['movie_list']['count'], 1)
+
+
+class AdminChangeListTest(TestCase):
+    """Списки админки: запросы не зависят от числа строк, курсор, поиск по индексу"""
+
+    def setUp(self):
+        cache.clear()
+        seed_catalogue(movies=24, crew=12)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'a@a.ru', 'x'))
+
+    def changelist(self, model, **params):
+        url = reverse(f'admin:movies_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_queries_independent_of_rows(self):
+        models = ('movie', 'review', 'rating', 'movieshot', 'filmcrew')
+        few = {model: self.changelist(model)[1] for model in models}
+        for i in range(10):
+            movie = create_movie(f'Еще {i}', f'more-{i}')
+            add_reviews(movie, 2)
+            Rating.objects.create(ip='10.1.1.1', rate=5, movie=movie)
+            FilmCrew.objects.create(name=f'Еще {i}', description='', image='crew/x.jpg')
+        many = {model: self.changelist(model)[1] for model in models}
+        self.assertEqual(few, many)
+        self.assertLessEqual(max(many.values()), 8)
+
+    def test_keyset_pages(self):
+        seen = []
+        params = {}
+        with mock.patch.object(site._registry[Review], 'list_per_page', 7):
+            while True:
+                response, queries = self.changelist('review', **params)
+                cl = response.context['cl']
+                self.assertTrue(cl.keyset)
+                seen += [review.pk for review in cl.result_list]
+                if not cl.next_page_url:
+                    break
+                params = dict(
+                    pair.split('=') for pair in cl.next_page_url.lstrip('?').split('&')
+                )
+        self.assertEqual(seen, list(Review.objects.order_by('-pk').values_list('pk', flat=True)))
+
+    def test_invalid_cursor(self):
+        for values in ([None], ['abc'], [[1]]):
+            response, _ = self.changelist('review', after=encode_cursor(values))
+            self.assertIsNone(response.context['cl'].cursor)
+
+    def test_estimated_count(self):
+        with mock.patch('movies.changelists.EstimatedCountPaginator.exact_limit', 2):
+            response, _ = self.changelist('movie')
+            self.assertContains(response, f'≈ {Movie.objects.order_by("-pk").first().pk} ')
+            response, _ = self.changelist('movie', year=2001)
+            self.assertContains(response, 'более 2 ')
+        response, _ = self.changelist('movie', year=2001)
+        self.assertContains(response, f'{Movie.objects.filter(year=2001).count()} Фильм')
+
+    def test_prefix_search(self):
+        movie = Movie.objects.first()
+        Review.objects.create(email='Search@example.com', name='Поиск', text='', movie=movie)
+        response, _ = self.changelist('review', q='Search@')
+        self.assertEqual([review.name for review in response.context['cl'].result_list], ['Поиск'])
+        response, _ = self.changelist('rating', q='10.0.0.2')
+        self.assertEqual(
+            {rating.ip for rating in response.context['cl'].result_list}, {'10.0.0.2'}
+        )
+
+    def test_full_text_search(self):
+        search.rebuild()
+        response, _ = self.changelist('movie', q='Фильм 13')
+        self.assertIn('Фильм 13', [movie.title for movie in response.context['cl'].result_list])
+        # черновики в админке тоже находятся
+        response, _ = self.changelist('movie', q='Фильм 12')
+        self.assertIn('Фильм 12', [movie.title for movie in response.context['cl'].result_list])
+
+    def test_short_search_terms(self):
+        search.rebuild()
+        # слово короче трех букв индекс не ищет — поиск по названию
+        response, _ = self.changelist('movie', q='13')
+        self.assertEqual([movie.title for movie in response.context['cl'].result_list], ['Фильм 13'])
+
+    def test_category_search(self):
+        search.rebuild()
+        cartoons = Category.objects.create(name='Мультфильмы', url='cartoons')
+        Movie.objects.filter(title='Фильм 5').update(category=cartoons)
+        # название категории ищется вместе с индексом
+        response, _ = self.changelist('movie', q='Мультфильмы')
+        self.assertEqual([movie.title for movie in response.context['cl'].result_list], ['Фильм 5'])
+
+    def test_thumbnails_not_read(self):
+        with mock.patch('movies.thumbnails._read_manifest') as read:
+            self.changelist('movieshot')
+            self.changelist('filmcrew')
+        read.assert_not_called()
+
+
+class FilmographyTest(TestCase):
+    """Адреса людей и фильмография одним запросом из кэша"""
+
+    def setUp(self):
+        cache.clear()
+        self.person = FilmCrew.objects.create(name='Анна Смит', description='', image='crew/a.jpg')
+        self.old = create_movie('Старый', 'old', year=1990)
+        self.new = create_movie('Новый', 'new', year=2010)
+        self.draft = create_movie('Черновик', 'draft', year=2020, draft=True)
+        self.old.director.add(self.person)
+        self.old.actors.add(self.person)
+        self.new.actors.add(self.person)
+        self.draft.actors.add(self.person)
+
+    def test_unique_slugs(self):
+        namesake = FilmCrew.objects.create(name='Анна  Смит', description='', image='crew/b.jpg')
+        self.assertEqual(self.person.slug, 'анна-смит')
+        self.assertEqual(namesake.slug, 'анна-смит-2')
+        for person in (self.person, namesake):
+            response = self.client.get(person.get_absolute_url())
+            self.assertEqual(response.context['filmcrew'], person)
+
+    def test_filmography(self):
+        with self.assertNumQueries(1):
+            movies = filmography.get(self.person)
+        self.assertEqual(
+            [(movie['title'], movie['directed'], movie['acted']) for movie in movies],
+            [('Новый', False, True), ('Старый', True, True)],
+        )
+        with self.assertNumQueries(0):
+            filmography.get(self.person)
+        response = self.client.get(self.person.get_absolute_url())
+        self.assertContains(response, 'Старый</a>\n                                (режиссер, актер)')
+
+    def titles(self):
+        return [movie['title'] for movie in filmography.get(self.person)]
+
+    def test_invalidation(self):
+        other = FilmCrew.objects.create(name='Другой', description='', image='crew/c.jpg')
+        other.film_actors.add(create_movie('Чужой', 'other'))
+        filmography.get(other)
+        self.titles()
+        self.new.title = 'Новый 2'
+        self.new.save()
+        self.assertEqual(self.titles(), ['Новый 2', 'Старый'])
+        self.new.actors.remove(self.person)
+        self.assertEqual(self.titles(), ['Старый'])
+        self.person.film_actors.add(self.new)
+        self.assertEqual(self.titles(), ['Новый 2', 'Старый'])
+        site._registry[Movie].publish(mock.Mock(), Movie.objects.filter(pk=self.draft.pk))
+        self.assertEqual(self.titles(), ['Черновик', 'Новый 2', 'Старый'])
+        self.old.delete()
+        self.assertEqual(self.titles(), ['Черновик', 'Новый 2'])
+        # фильмография другого человека осталась в кэше
+        with self.assertNumQueries(0):
+            filmography.get(other)
+
+
+class SimilarMoviesTest(TestCase):
+    """Похожие фильмы: полный расчет и пересчет по сигналам"""
+
+    def setUp(self):
+        cache.clear()
+        self.star = FilmCrew.objects.create(name='Звезда', description='', image='crew/s.jpg')
+        self.base = create_movie('Основа', 'base', year=2000)
+        self.sequel = create_movie('Продолжение', 'sequel', year=2002)
+        self.other = create_movie('Другой', 'other', year=1970, country='Франция')
+        self.draft = create_movie('Черновик', 'draft', year=2000, draft=True)
+        for movie in (self.base, self.sequel):
+            movie.actors.add(self.star)
+        # в TestCase транзакция не фиксируется: пересчет запускается вручную
+        similar.flush()
+        SimilarMovie.objects.all().delete()
+
+    def similar_to(self, movie):
+        return [m.title for m in similar.get_similar(movie)]
+
+    def test_build_ranks_by_shared_features(self):
+        self.assertEqual(similar.build(), 3)
+        self.assertEqual(self.similar_to(self.base), ['Продолжение', 'Другой'])
+        self.assertEqual(self.similar_to(self.other), ['Основа', 'Продолжение'])
+        scores = list(SimilarMovie.objects.filter(movie=self.base).values_list('score', flat=True))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertAlmostEqual(scores[0], 1.0)
+        self.assertFalse(SimilarMovie.objects.filter(similar=self.draft).exists())
+
+    def test_update_matches_build(self):
+        similar.build()
+        self.other.actors.add(self.star)
+        self.other.country = 'США'
+        self.other.year = 2001
+        self.other.save()
+        similar.flush()
+        # признаки совпали с продолжением, при равенстве — по id
+        self.assertEqual(self.similar_to(self.base), ['Продолжение', 'Другой'])
+        self.assertAlmostEqual(SimilarMovie.objects.get(movie=self.base, similar=self.other).score, 1.0)
+        updated = set(SimilarMovie.objects.values_list('movie', 'similar', 'rank'))
+        similar.build()
+        self.assertEqual(updated, set(SimilarMovie.objects.values_list('movie', 'similar', 'rank')))
+
+    def test_update_genre_candidates(self):
+        similar.build()
+        # общий с остальными только жанр: кандидат из FALLBACK_KIND
+        Movie.objects.create(
+            title='Новый', url='new', year=1950, country='Италия', description='',
+            poster='movies/p.jpg',
+        ).genres.add(*self.base.genres.all())
+        similar.flush()
+        self.assertIn('Новый', self.similar_to(self.base))
+        updated = set(SimilarMovie.objects.values_list('movie', 'similar', 'rank'))
+        similar.build()
+        self.assertEqual(updated, set(SimilarMovie.objects.values_list('movie', 'similar', 'rank')))
+
+    def test_publish_and_delete(self):
+        similar.build()
+        site._registry[Movie].publish(mock.Mock(), Movie.objects.filter(pk=self.draft.pk))
+        similar.flush()
+        self.assertIn('Черновик', self.similar_to(self.base))
+        self.sequel.delete()
+        similar.flush()
+        self.assertEqual(self.similar_to(self.base), ['Черновик', 'Другой'])
+
+    def test_detail_page(self):
+        call_command('build_similar', stdout=io.StringIO())
+        response = self.client.get(self.base.get_absolute_url())
+        self.assertContains(response, 'Похожие фильмы')
+        self.assertEqual(response.context['similar_movies'], [self.sequel, self.other])
+
+
+class BoxOfficeTest(TestCase):
+    """Кассовые сборы по разрезам и их пересчет при изменении фильмов"""
+
+    def setUp(self):
+        cache.clear()
+        self.first = create_movie(
+            'Первый', 'first', year=2000, budget=100, fees_in_usa=150, fees_in_the_world=300
+        )
+        self.second = create_movie(
+            'Второй', 'second', year=2001, country='Франция', fees_in_the_world=50
+        )
+        create_movie('Черновик', 'draft', year=2000, budget=1000, draft=True)
+        # в TestCase транзакция не фиксируется: пересчет запускается вручную
+        boxoffice.flush()
+
+    def row(self, kind, value=''):
+        return BoxOffice.objects.get(kind=kind, value=str(value))
+
+    def test_rebuild_matches_signals(self):
+        incremental = set(BoxOffice.objects.values_list(
+            'kind', 'value', 'label', 'movies', 'budget', 'fees_in_the_world', 'budgeted_fees',
+        ))
+        call_command('rebuild_box_office', stdout=io.StringIO())
+        self.assertEqual(incremental, set(BoxOffice.objects.values_list(
+            'kind', 'value', 'label', 'movies', 'budget', 'fees_in_the_world', 'budgeted_fees',
+        )))
+        total = self.row(BoxOffice.TOTAL)
+        self.assertEqual((total.movies, total.budget, total.fees_in_the_world), (2, 100, 350))
+        # у второго фильма бюджет неизвестен, в окупаемость он не входит
+        self.assertEqual(total.roi, 2.0)
+        self.assertEqual(self.row(BoxOffice.YEAR, 2000).movies, 1)
+        self.assertIsNone(self.row(BoxOffice.COUNTRY, 'Франция').roi)
+        self.assertEqual(self.row(BoxOffice.GENRE, self.first.genres.get().pk).movies, 2)
+
+    def test_incremental_updates(self):
+        self.second.year = 2000
+        self.second.budget = 50
+        self.second.save()
+        boxoffice.flush()
+        self.assertFalse(BoxOffice.objects.filter(kind=BoxOffice.YEAR, value='2001').exists())
+        self.assertEqual(self.row(BoxOffice.YEAR, 2000).budget, 150)
+        self.assertEqual(self.row(BoxOffice.TOTAL).budgeted_fees, 350)
+        genre = Genre.objects.create(name='Комедия', description='', url='comedy')
+        self.second.genres.add(genre)
+        boxoffice.flush()
+        self.assertEqual(self.row(BoxOffice.GENRE, genre.pk).fees_in_the_world, 50)
+        genre.name = 'Комедии'
+        genre.save()
+        boxoffice.flush()
+        self.assertEqual(self.row(BoxOffice.GENRE, genre.pk).label, 'Комедии')
+        site._registry[Movie].unpublish(mock.Mock(), Movie.objects.filter(pk=self.first.pk))
+        self.assertEqual(self.row(BoxOffice.TOTAL).movies, 1)
+        self.second.delete()
+        boxoffice.flush()
+        self.assertEqual(self.row(BoxOffice.TOTAL).movies, 0)
+        self.assertFalse(BoxOffice.objects.filter(kind=BoxOffice.GENRE).exists())
+
+    def test_staff_report_from_cache(self):
+        url = reverse('box_office')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        staff = get_user_model().objects.create_user('staff', password='pass', is_staff=True)
+        self.client.force_login(staff)
+        report = self.client.get(url).json()
+        self.assertEqual(report['total']['fees_in_the_world'], 350)
+        self.assertEqual([row['value'] for row in report['year']], ['2000', '2001'])
+        with self.assertNumQueries(0):
+            boxoffice.get_report()
+        self.first.fees_in_the_world = 400
+        self.first.save()
+        boxoffice.flush()
+        self.assertEqual(boxoffice.get_report()['total']['fees_in_the_world'], 450)
+
+
+class StaticFilesTest(TestCase):
+    """Статика с хешами в именах и готовыми сжатыми копиями"""
+
+    CSS = '.banner { background: url(../images/dot.png); }\n' * 20
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        for directory in (self.source, self.root):
+            self.addCleanup(shutil.rmtree, directory)
+        os.makedirs(os.path.join(self.source, 'css'))
+        os.makedirs(os.path.join(self.source, 'images'))
+        with open(os.path.join(self.source, 'css', 'site.css'), 'w') as f:
+            f.write(self.CSS)
+        with open(os.path.join(self.source, 'images', 'dot.png'), 'wb') as f:
+            f.write(b'\x89PNG')
+        override = override_settings(
+            STATIC_ROOT=self.root, STATICFILES_DIRS=[self.source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_original_names_until_collected(self):
+        self.assertEqual(staticfiles_storage.url('css/site.css'), '/static/css/site.css')
+
+    def test_hashed_and_precompressed(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        url = staticfiles_storage.url('css/site.css')
+        self.assertRegex(url, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.root, url[len('/static/'):] + '.gz')))
+        # маленький файл не сжимается
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'images', 'dot.png.gz')))
+
+        response, body = self.get(url, accept_encoding='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], staticfiles.IMMUTABLE)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        # заголовки SecurityMiddleware есть и у статики
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+        self.assertFalse(response.has_header('Content-Disposition'))
+        css = gzip.decompress(body).decode()
+        self.assertIn(staticfiles_storage.url('images/dot.png').rsplit('/', 1)[1], css)
+
+        plain, body = self.get(url, accept_encoding='gzip;q=0')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(body.decode(), css)
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+        cached, _ = self.get(url, accept_encoding='gzip', if_none_match=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        # без хеша в имени — короткое время кэширования
+        response, _ = self.get('/static/css/site.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.client.get('/static/css/missing.css').status_code, 404)
+
+    async def test_served_on_event_loop(self):
+        await sync_to_async(call_command)('collectstatic', interactive=False, verbosity=0)
+        url = staticfiles_storage.url('css/site.css')
+        with override_settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            response = await self.async_client.get(url, headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_brotli_preferred(self):
+        fake = mock.Mock(compress=lambda data, quality: b'brotli')
+        with mock.patch.object(staticfiles, 'brotli', fake):
+            call_command('collectstatic', interactive=False, verbosity=0)
+        response, body = self.get(staticfiles_storage.url('css/site.css'), accept_encoding='gzip, br')
+        self.assertEqual((response['Content-Encoding'], body), ('br', b'brotli'))
@@ -0,0 +1,296 @@
+"""Уменьшенные копии постеров, фотографий и кадров.
+
+Для каждого изображения строятся именованные размеры (SIZES) в WebP и
+JPEG. Копии лежат в MEDIA_ROOT/thumbs/ в каталоге, имя которого — хэш
+содержимого оригинала и параметров обработки: одинаковые файлы
+обрабатываются один раз, а изменение размеров дает новые адреса.
+Список готовых файлов пишется в manifest.json последним, поэтому
+частично обработанный каталог не используется. Адрес копий оригинала
+вместе с его размером и временем изменения записывается в
+thumbs/sources/ при обработке: при выводе оригинал не читается, а
+замененный файл (другие размер или время) выводится без копий, пока
+они не построены заново.
+
+Обработка идет в пуле процессов вне запроса (schedule) или командой
+build_thumbnails. Пока копий нет, шаблоны выводят оригинал.
+"""
+import atexit
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import format_html, format_html_join
+
+from movies import versions
+
+logger = logging.getLogger(__name__)
+
+# ширина в пикселях для обычных экранов и для экранов с плотностью 2x
+SIZES = {
+    # карточка в списке фильмов и кадры на странице фильма
+    'card': (270, 540),
+    # последние добавленные в боковой панели
+    'sidebar': (120, 240),
+    # миниатюра в админке
+    'admin': (100, 200),
+    # постер на странице фильма и фото члена съемочной группы
+    'detail': (400, 800),
+}
+# расширение, формат Pillow и параметры сохранения
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+DIRECTORY = 'thumbs'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+
+# пока копий нет, повторная проверка не чаще чем раз в минуту
+MISSING_TIMEOUT = 60
+MANIFEST = 'manifest.json'
+# адреса копий по именам оригиналов
+SOURCES = 'sources'
+
+_SPEC = json.dumps([SIZES, FORMATS], sort_keys=True).encode()
+
+
+def digest(content):
+    """Адрес копий: хэш содержимого оригинала и параметров обработки"""
+    return hashlib.sha1(content + _SPEC).hexdigest()
+
+
+def directory(root, address):
+    return os.path.join(root, DIRECTORY, address[:2], address)
+
+
+def source_record(root, name):
+    """Файл с адресом копий оригинала name (путь от MEDIA_ROOT)"""
+    key = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(root, DIRECTORY, SOURCES, key[:2], f'{key}.json')
+
+
+def _write_source(path, root, address, stat):
+    name = os.path.relpath(path, root).replace(os.sep, '/')
+    record = source_record(root, name)
+    os.makedirs(os.path.dirname(record), exist_ok=True)
+    tmp = f'{record}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'address': address, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}, f)
+    os.replace(tmp, record)
+
+
+def _save(image, path, image_format, options):
+    # запись через временный файл: читатели не увидят недописанный файл
+    tmp = f'{path}.{os.getpid()}.tmp'
+    image.save(tmp, image_format, **options)
+    os.replace(tmp, path)
+
+
+def _flatten(image):
+    """Изображение в RGB: прозрачность заливается белым"""
+    from PIL import Image
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(path, root):
+    """Строит копии файла path в каталоге root (выполняется в пуле).
+
+    Возвращает (адрес, построены ли копии заново). Использует только
+    Pillow, поэтому не требует настроенного Django в процессе пула.
+    """
+    from PIL import Image, ImageOps
+
+    # до чтения: файл, замененный во время обработки, не совпадет с записью
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        content = f.read()
+    address = digest(content)
+    target = directory(root, address)
+    if os.path.exists(os.path.join(target, MANIFEST)):
+        _write_source(path, root, address, stat)
+        return address, False
+
+    os.makedirs(target, exist_ok=True)
+    with Image.open(io.BytesIO(content)) as original:
+        image = _flatten(ImageOps.exif_transpose(original))
+    manifest = {}
+    for name, widths in SIZES.items():
+        # без увеличения: маленький оригинал дает одну ширину
+        actual = sorted({min(width, image.width) for width in widths})
+        resized = {
+            width: image if width == image.width else image.resize(
+                (width, max(1, round(image.height * width / image.width))),
+                Image.LANCZOS,
+            )
+            for width in actual
+        }
+        manifest[name] = {}
+        for extension, image_format, options in FORMATS:
+            files = []
+            for width, copy in resized.items():
+                filename = f'{name}-{width}.{extension}'
+                _save(copy, os.path.join(target, filename), image_format, options)
+                files.append((filename, width))
+            manifest[name][extension] = files
+    with open(os.path.join(target, f'{MANIFEST}.tmp'), 'w') as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(target, f'{MANIFEST}.tmp'), os.path.join(target, MANIFEST))
+    _write_source(path, root, address, stat)
+    return address, True
+
+
+def cache_key(name):
+    # имена файлов бывают длинными и не в ASCII
+    return f'movies:thumbs:{hashlib.sha1(name.encode()).hexdigest()}'
+
+
+def get_manifest(fieldfile):
+    """Готовые копии файла: {размер: {расширение: [(url, ширина), ...]}}.
+
+    Возвращает None, если копий еще нет или хранилище не локальное.
+    """
+    if not fieldfile:
+        return None
+    key = cache_key(fieldfile.name)
+    manifest = cache.get(key)
+    if manifest is None:
+        manifest = _read_manifest(fieldfile)
+        if manifest:
+            cache.set(key, manifest, versions.FRAGMENT_TIMEOUT)
+        else:
+            # пустой словарь: копий нет, не читать файл при каждом выводе
+            cache.set(key, {}, MISSING_TIMEOUT)
+    return manifest or None
+
+
+def get_cached_manifests(fieldfiles):
+    """Копии многих файлов одним запросом к кэшу: {имя: копии или None}.
+
+    Файлы, которых нет в кэше, не читаются: для них None, выводится
+    оригинал. Для списков, где чтение каждого файла дороже страницы.
+    """
+    keys = {cache_key(fieldfile.name): fieldfile.name for fieldfile in fieldfiles if fieldfile}
+    cached = cache.get_many(keys)
+    return {name: cached.get(key) or None for key, name in keys.items()}
+
+
+def _read_manifest(fieldfile):
+    try:
+        stat = os.stat(fieldfile.path)
+        with open(source_record(str(settings.MEDIA_ROOT), fieldfile.name)) as f:
+            source = json.load(f)
+    except (NotImplementedError, OSError, ValueError):
+        return {}
+    # оригинал заменен после обработки: копии от прежнего файла
+    if (source.get('size'), source.get('mtime')) != (stat.st_size, stat.st_mtime_ns):
+        return {}
+    address = source['address']
+    try:
+        with open(os.path.join(directory(settings.MEDIA_ROOT, address), MANIFEST)) as f:
+            files = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    prefix = f'{DIRECTORY}/{address[:2]}/{address}/'
+    return {
+        name: {
+            extension: [(fieldfile.storage.url(prefix + filename), width)
+                        for filename, width in variants]
+            for extension, variants in formats.items()
+        }
+        for name, formats in files.items()
+    }
+
+
+def srcset(variants):
+    return ', '.join(f'{url} {width}w' for url, width in variants)
+
+
+def thumbnail_url(fieldfile, size, extension='jpg'):
+    """Адрес наименьшей копии размера size или оригинала"""
+    manifest = get_manifest(fieldfile)
+    if manifest is None or size not in manifest:
+        return fieldfile.url
+    return manifest[size][extension][0][0]
+
+
+def picture(fieldfile, size, sizes=None, manifests=None, **attrs):
+    """Тег <picture> с WebP и JPEG копиями и srcset; manifests — уже
+    полученные копии (get_cached_manifests)"""
+    attrs = format_html_join('', ' {}="{}"', sorted(attrs.items()))
+    if not fieldfile:
+        return format_html('<img src=""{}>', attrs)
+    if manifests is None:
+        manifest = get_manifest(fieldfile)
+    else:
+        manifest = manifests.get(fieldfile.name)
+    if manifest is None or size not in manifest:
+        return format_html('<img src="{}"{}>', fieldfile.url, attrs)
+    variants = manifest[size]
+    # по умолчанию картинка занимает ширину первого размера
+    sizes = sizes or f'{SIZES[size][0]}px'
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        srcset(variants['webp']), sizes,
+        variants['jpg'][0][0], srcset(variants['jpg']), sizes, attrs,
+    )
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Общий пул процессов (THUMBNAIL_WORKERS, 0 — выключен)"""
+    global _executor
+    workers = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+    if not workers:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn: fork многопоточного веб-процесса может зависнуть на блокировках
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+            atexit.register(_executor.shutdown, cancel_futures=True)
+    return _executor
+
+
+def schedule(fieldfile, version):
+    """Построить копии в пуле; version — версия кэша, выводящего файл"""
+    executor = get_executor()
+    if executor is None or not fieldfile:
+        return
+    try:
+        path = fieldfile.path
+    except NotImplementedError:
+        # удаленное хранилище обрабатывается отдельно
+        return
+    future = executor.submit(render, path, str(settings.MEDIA_ROOT))
+    future.add_done_callback(
+        lambda done: _finished(done, fieldfile.name, version)
+    )
+
+
+def _finished(future, name, version):
+    try:
+        _, created = future.result()
+    except Exception:
+        logger.exception('Не удалось построить копии %s', name)
+        return
+    cache.delete(cache_key(name))
+    if created:
+        # страницы и фрагменты перестраиваются уже с копиями
+        versions.bump(version)
@@ -1,12 +1,34 @@
+from django.conf import settings
 from django.urls import path
 
-from movies.views import MoviesView, MovieDetailView, AddReview, FilmCrewView, FilterMoviesView
+from movies import api, async_views, views
+
+# под ASGI страницы обслуживаются асинхронными представлениями
+pages = async_views if getattr(settings, 'ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path("", MoviesView.as_view(), name='movie_list'),
-    path("filter/", FilterMoviesView.as_view(), name='filter'),
-    path("<slug:slug>/detail/", MovieDetailView.as_view(), name='movie_detail'),
-    path("review/<int:id>/", AddReview.as_view(), name='add_review'),
+    path("", pages.MoviesView.as_view(), name='movie_list'),
+    path("filter/", pages.FilterMoviesView.as_view(), name='filter'),
+    path("search/", views.SearchView.as_view(), name='search'),
+    path("<slug:slug>/detail/", pages.MovieDetailView.as_view(), name='movie_detail'),
+    path("review/<int:id>/", pages.AddReview.as_view(), name='add_review'),
+    path("add-rating/", views.AddStarRating.as_view(), name='add_rating'),
+    path("export/", views.ExportView.as_view(), name='export'),
+    path("stats/", views.RequestStatsView.as_view(), name='request_stats'),
+    path("stats/box-office/", views.BoxOfficeView.as_view(), name='box_office'),
     path("filmcrew/<str:slug>/detail/",
-         FilmCrewView.as_view(), name='filmcrew_detail'),
+         pages.FilmCrewView.as_view(), name='filmcrew_detail'),
+    path("api/movies/", api.ApiView.as_view(resource_name='movies'), name='api_movies'),
+    path("api/movies/<slug:lookup>/",
+         api.ApiView.as_view(resource_name='movies'), name='api_movie'),
+    path("api/crew/", api.ApiView.as_view(resource_name='crew'), name='api_crew'),
+    path("api/crew/<int:lookup>/",
+         api.ApiView.as_view(resource_name='crew'), name='api_crew_detail'),
+    path("api/genres/", api.ApiView.as_view(resource_name='genres'), name='api_genres'),
+    path("api/genres/<slug:lookup>/",
+         api.ApiView.as_view(resource_name='genres'), name='api_genre'),
+    path("api/categories/",
+         api.ApiView.as_view(resource_name='categories'), name='api_categories'),
+    path("api/categories/<slug:lookup>/",
+         api.ApiView.as_view(resource_name='categories'), name='api_category'),
 ]
@@ -0,0 +1,101 @@
+"""Счетчики версий содержимого для кэширования.
+
+У каждого вида данных (категории, фильмы, жанры и т. д.) есть версия в
+кэше. Сигналы увеличивают ее при любом изменении, а ключи кэша строятся
+с учетом версий, поэтому устаревшие фрагменты просто перестают
+читаться и истекают сами. Для нескольких процессов нужен общий кэш
+(см. CACHES в настройках).
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+PREFIX = 'movies:version:'
+MODIFIED_PREFIX = 'movies:modified:'
+
+# старые ключи фрагментов истекают сами через это время
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+def _initial():
+    # после вытеснения счетчика из кэша версия не должна повториться
+    return int(time.time() * 1000)
+
+
+def get_many(*names):
+    """Текущие версии указанных видов данных"""
+    keys = {f'{PREFIX}{name}': name for name in names}
+    versions = cache.get_many(keys)
+    for key, name in keys.items():
+        if key not in versions:
+            cache.add(key, _initial(), None)
+            versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+async def aget_many(*names):
+    """Асинхронный вариант get_many"""
+    keys = {f'{PREFIX}{name}': name for name in names}
+    versions = await cache.aget_many(keys)
+    for key, name in keys.items():
+        if key not in versions:
+            await cache.aadd(key, _initial(), None)
+            versions[key] = await cache.aget(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def get(name):
+    return get_many(name)[name]
+
+
+def last_modified(*names):
+    """Время последнего изменения указанных данных (unix time)"""
+    keys = [f'{MODIFIED_PREFIX}{name}' for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            # время неизвестно: считаем, что данные изменились сейчас
+            cache.add(key, int(time.time()), None)
+            values[key] = cache.get(key)
+    return max(values.values())
+
+
+async def alast_modified(*names):
+    """Асинхронный вариант last_modified"""
+    keys = [f'{MODIFIED_PREFIX}{name}' for name in names]
+    values = await cache.aget_many(keys)
+    for key in keys:
+        if key not in values:
+            await cache.aadd(key, int(time.time()), None)
+            values[key] = await cache.aget(key)
+    return max(values.values())
+
+
+def _bump(names):
+    now = int(time.time())
+    for name in names:
+        try:
+            cache.incr(f'{PREFIX}{name}')
+        except ValueError:
+            cache.add(f'{PREFIX}{name}', _initial(), None)
+    cache.set_many({f'{MODIFIED_PREFIX}{name}': now for name in names}, None)
+
+
+def bump(*names):
+    """Новая версия данных: сразу и еще раз после коммита, чтобы
+    параллельный запрос не закэшировал незафиксированное состояние"""
+    _bump(names)
+    transaction.on_commit(lambda: _bump(names))
+
+
+def key(prefix, *names):
+    """Ключ кэша, зависящий от версий указанных данных"""
+    versions = get_many(*names)
+    return ':'.join([prefix] + [f'{name}{versions[name]}' for name in names])
+
+
+async def akey(prefix, *names):
+    """Асинхронный вариант key"""
+    versions = await aget_many(*names)
+    return ':'.join([prefix] + [f'{name}{versions[name]}' for name in names])
@@ -1,35 +1,81 @@
+from bisect import bisect_right
 from typing import Any
 from django.db.models.query import QuerySet
-from django.db.models import Q
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.utils.decorators import method_decorator
 from django.views.generic.base import View
-from django.views.generic import ListView, DetailView
+from django.views.generic import ListView, DetailView, TemplateView
 
-from movies.models import Movie, Category, FilmCrew, Genre
-from movies.forms import ReviewForm
+from movies import (
+    boxoffice, export, facets, filmography, filters, instrumentation, ratings, search, similar,
+)
+from movies.models import Movie, Category, FilmCrew, Genre, Rating, Review, Facet
+from movies.conditional import ConditionalPageMixin
+from movies.forms import RatingForm, ReviewForm
+from movies.pagination import KeysetPaginationMixin
+from movies.routers import ReplicaReadMixin
 
 
 class GenreYear:
     """Жанры и года выхода фильмов"""
 
     def get_genres(self):
-        return Genre.objects.all()
+        return facets.get_facets()[Facet.GENRE]
 
     def get_years(self):
-        return Movie.objects.filter(draft=False).values('year')
+        return facets.get_facets()[Facet.YEAR]
 
 
-class MoviesView(GenreYear, ListView):
+class MoviesView(ReplicaReadMixin, ConditionalPageMixin, GenreYear, KeysetPaginationMixin, ListView):
     """ Список фильмов """
+    content_versions = ('movie', 'category', 'facets', 'rating')
     model = Movie
     queryset = Movie.objects.filter(draft=False)
+    # варианты сортировки (?sort=) и соответствующие ключи курсора
+    sort_fields = {
+        'rating': ('-rating_avg', '-id'),
+    }
 
+    def get_cursor_fields(self):
+        return self.sort_fields.get(self.request.GET.get('sort'), self.cursor_fields)
 
-class MovieDetailView(GenreYear, DetailView):
+
+class MovieDetailView(ReplicaReadMixin, ConditionalPageMixin, GenreYear, DetailView):
     """ Описание фильма """
+    content_versions = (
+        'movie', 'category', 'facets', 'rating',
+        'filmcrew', 'genre', 'review', 'movieshot', similar.VERSION,
+    )
+    # формы отзыва и оценки содержат токен CSRF
+    cache_response = False
     model = Movie
     slug_field = 'url'
 
+    # количество веток отзывов на странице
+    reviews_paginate_by = 20
+
+    def get_queryset(self):
+        # связанные данные загружаются заранее,
+        # число запросов не зависит от количества отзывов
+        return Movie.objects.with_detail()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # страница веток отзывов одним проходом по индексу (movie, path)
+        reviews, next_after = Review.objects.thread_page(
+            self.object,
+            after=self.request.GET.get('reviews_after', ''),
+            limit=self.reviews_paginate_by,
+        )
+        context['reviews'] = Review.build_tree(reviews)
+        context['reviews_next'] = next_after
+        context['star_choices'] = Rating.RATE_CHOICES
+        context['similar_movies'] = similar.get_similar(self.object)
+        return context
+
 
 class AddReview(View):
     """ Отзыв """
@@ -42,29 +88,122 @@ class AddReview(View):
             bound_form = bound_form.save(commit=False)
 
             # присовение родителя отзыва
-            if request.POST.get('parent', None):
-                bound_form.parent_id = int(request.POST.get('parent'))
+            parent_id = request.POST.get('parent', '')
+            if parent_id.isdigit():
+                bound_form.parent = Review.objects.filter(
+                    id=int(parent_id), movie=movie
+                ).first()
 
             bound_form.movie = movie
-            bound_form.save()
+            # отзыв и счетчик отзывов фильма в одной транзакции
+            with transaction.atomic():
+                bound_form.save()
 
         return redirect(movie.get_absolute_url())
 
 
-class FilmCrewView(GenreYear, DetailView):
+class AddStarRating(View):
+    """ Оценка фильма """
+
+    def post(self, request):
+        form = RatingForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        movie_id = form.cleaned_data['movie']
+        # опубликованные фильмы известны индексу фильтров, база не нужна
+        if movie_id not in filters.get_index().all_ids:
+            return JsonResponse({'errors': {'movie': ['Фильм не найден']}}, status=404)
+        # голос попадает в буфер и записывается пачкой
+        ratings.vote(movie_id, request.META['REMOTE_ADDR'], form.cleaned_data['star'])
+        return JsonResponse({'status': 'accepted'}, status=202)
+
+
+class FilmCrewView(ReplicaReadMixin, ConditionalPageMixin, GenreYear, DetailView):
     """ Вывод информации о члене съёмочной группы """
+    content_versions = ('filmcrew', 'movie', 'category', 'facets')
     model = FilmCrew
     template_name = 'movies/filmcrew.html'
-    slug_field = 'name'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filmography'] = filmography.get(self.object)
+        return context
 
 
-class FilterMoviesView(GenreYear, ListView):
+class FilterMoviesView(ReplicaReadMixin, ConditionalPageMixin, GenreYear, KeysetPaginationMixin, ListView):
     """ Фильтр фильмов """
+    content_versions = ('movie', 'category', 'facets', 'rating')
+    model = Movie
 
     def get_queryset(self):
-        query_set = Movie.objects.filter(
-            Q(year__in=self.request.GET.getlist("year")) |
-            Q(genres__in=self.request.GET.getlist("genre"))
+        # фильтрация по множествам id в памяти, без соединения таблиц
+        self.filter_result = filters.search(self.request.GET)
+        return Movie.objects.all()
+
+    def paginate_queryset(self, queryset, page_size):
+        # найденные id уже отсортированы, страница выбирается в памяти
+        ids = self.filter_result.ids
+        cursor = self.get_cursor()
+        start = bisect_right(ids, cursor[0]) if cursor else 0
+        page_ids = ids[start:start + page_size]
+        object_list = list(queryset.filter(id__in=page_ids).order_by('id'))
+        has_next = start + page_size < len(ids)
+        page = self.make_page(object_list, has_next)
+        return None, page, page.object_list, has_next
+
+    def get_genres(self):
+        return self.filter_result.facet_values('genre', super().get_genres())
+
+    def get_years(self):
+        return self.filter_result.facet_values('year', super().get_years())
+
+
+class SearchView(GenreYear, TemplateView):
+    """ Поиск фильмов и членов съемочной группы """
+    template_name = 'movies/search.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '').strip()
+        context['result'] = search.search(context['query'])
+        return context
+
+
+class ExportView(View):
+    """ Потоковая выгрузка опубликованных фильмов (NDJSON или JSON) """
+
+    def get(self, request):
+        file_format = request.GET.get('format', 'ndjson')
+        if file_format not in export.FORMATS:
+            return JsonResponse({'errors': {'format': list(export.FORMATS)}}, status=400)
+        try:
+            since = export.parse_since(request.GET.get('since'))
+        except ValueError as e:
+            return JsonResponse({'errors': {'since': [str(e)]}}, status=400)
+        version = export.get_version()
+        response = StreamingHttpResponse(
+            export.stream(since, file_format=file_format),
+            content_type=f'{export.FORMATS[file_format]}; charset=utf-8',
+        )
+        # следующая инкрементальная выгрузка: ?since=<версия>
+        response['X-Export-Version'] = version
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class BoxOfficeView(ReplicaReadMixin, View):
+    """ Кассовые сборы по разрезам, только для администраторов """
+
+    def get(self, request):
+        return JsonResponse(boxoffice.get_report(), json_dumps_params={'ensure_ascii': False})
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class RequestStatsView(View):
+    """ Гистограммы времени ответа по адресам, только для администраторов """
+
+    def get(self, request):
+        return JsonResponse(
+            instrumentation.histograms(), json_dumps_params={'ensure_ascii': False}
         )
-        # метод чтобы задоджить повторение по двум фильтрам
-        return query_set.distinct()